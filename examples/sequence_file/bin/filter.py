@@ -22,8 +22,6 @@
 Filter out words whose occurrence falls below a specified value.
 """
 
-import struct
-
 from pydoop.mapreduce.pipes import run_task, Factory
 from pydoop.mapreduce.api import Mapper
 
@@ -40,11 +38,10 @@ class FilterMapper(Mapper):
 
     def map(self, context):
         word, occurrence = context.key, context.value
-        occurrence = struct.unpack(">i", occurrence)[0]
         if occurrence >= self.threshold:
             context.emit(word, str(occurrence))
 
 
 if __name__ == "__main__":
     factory = Factory(FilterMapper)
-    run_task(factory, raw_values=True)
+    run_task(factory)
@@ -29,16 +29,17 @@ MapReduce applications and interact with HDFS in pure Python.
 
 import os
 import errno
+import sys
 from importlib import import_module
 import pydoop.hadoop_utils as hu
-from pydoop.utils.py3compat import configparser, parser_read
 
 try:
     from pydoop.version import version as __version__
 except ImportError:  # should only happen at compile time
     __version__ = None
+# Hadoop info is not needed by most tasks, so it's only looked for when
+# first requested (see _path_finder)
 _PATH_FINDER = hu.PathFinder()
-_HADOOP_INFO = _PATH_FINDER.find()  # fill the cache ASAP
 
 __author__ = ", ".join((
     "Simone Leo",
@@ -60,60 +61,83 @@ __url__ = "http://crs4.github.io/pydoop"
 __propfile_basename__ = "pydoop.properties"
 
 
+def _path_finder():
+    # fill the path finder's cache (from the persistent one, if possible)
+    # before the first use
+    if "_HADOOP_INFO" not in globals():
+        globals()["_HADOOP_INFO"] = _PATH_FINDER.find()
+    return _PATH_FINDER
+
+
+def __getattr__(name):  # PEP 562
+    if name == "_HADOOP_INFO":
+        _path_finder()
+        return globals()[name]
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+if sys.version_info < (3, 7):  # no PEP 562
+    _path_finder()
+
+
 def reset():
     _PATH_FINDER.reset()
 
 
 def hadoop_home():
-    return _PATH_FINDER.hadoop_home()
+    return _path_finder().hadoop_home()
 
 
 def hadoop_exec(hadoop_home=None):
-    return _PATH_FINDER.hadoop_exec(hadoop_home)
+    return _path_finder().hadoop_exec(hadoop_home)
 
 
 def mapred_exec(hadoop_home=None):
-    return _PATH_FINDER.mapred_exec(hadoop_home)
+    return _path_finder().mapred_exec(hadoop_home)
 
 
 def hadoop_version(hadoop_home=None):
-    return _PATH_FINDER.hadoop_version(hadoop_home)
+    return _path_finder().hadoop_version(hadoop_home)
 
 
 def hadoop_version_info(hadoop_home=None):
-    return _PATH_FINDER.hadoop_version_info(hadoop_home)
+    return _path_finder().hadoop_version_info(hadoop_home)
 
 
 def has_mrv2(hadoop_home=None):
-    return _PATH_FINDER.hadoop_version_info(hadoop_home).has_mrv2()
+    return _path_finder().hadoop_version_info(hadoop_home).has_mrv2()
 
 
 def is_apache(hadoop_home=None):
-    return _PATH_FINDER.is_apache(hadoop_home)
+    return _path_finder().is_apache(hadoop_home)
 
 
 def is_cloudera(hadoop_home=None):
-    return _PATH_FINDER.is_cloudera(hadoop_home)
+    return _path_finder().is_cloudera(hadoop_home)
 
 
 def is_hortonworks(hadoop_home=None):
-    return _PATH_FINDER.is_hortonworks(hadoop_home)
+    return _path_finder().is_hortonworks(hadoop_home)
 
 
 def hadoop_conf(hadoop_home=None):
-    return _PATH_FINDER.hadoop_conf(hadoop_home)
+    return _path_finder().hadoop_conf(hadoop_home)
 
 
 def hadoop_params(hadoop_conf=None, hadoop_home=None):
-    return _PATH_FINDER.hadoop_params(hadoop_conf, hadoop_home)
+    return _path_finder().hadoop_params(hadoop_conf, hadoop_home)
 
 
 def hadoop_native(hadoop_home=None):
-    return _PATH_FINDER.hadoop_native(hadoop_home)
+    return _path_finder().hadoop_native(hadoop_home)
 
 
 def hadoop_classpath(hadoop_home=None):
-    return _PATH_FINDER.hadoop_classpath(hadoop_home)
+    return _path_finder().hadoop_classpath(hadoop_home)
+
+
+def hadoop_info():
+    return _path_finder().dump_info()
 
 
 def package_dir():
@@ -181,6 +205,7 @@ class AddSectionWrapper(object):
 
 
 def read_properties(fname):
+    from pydoop.utils.py3compat import configparser, parser_read
     parser = configparser.SafeConfigParser()
     parser.optionxform = str  # preserve key case
     try:
@@ -29,6 +29,7 @@ import sys
 from pydoop.version import version
 
 SUBMOD_NAMES = [
+    "profiles",
     "script",
     "submit",
 ]
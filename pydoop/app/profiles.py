@@ -0,0 +1,329 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+"""
+Pydoop Pstats
+=============
+
+Aggregate the cProfile stats of all tasks of a job run with ``pydoop
+submit --pstats-dir``.
+
+Profiles are fetched in parallel and merged, separately for each task
+type, into job-wide stats, of which the top functions by cumulative and
+own time are printed. Tasks whose total time is far from the median for
+their type are listed as outliers, together with the functions that
+account for most of the difference. Merged stats can also be exported as
+collapsed stacks, the input format of ``flamegraph.pl`` and compatible
+tools.
+"""
+
+import argparse
+import os
+import pstats
+import re
+import shutil
+import sys
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+DESCRIPTION = "Aggregate the cProfile stats of a job's tasks"
+
+# file names generated with the default pstats_fmt (see pydoop.mapreduce.pipes)
+PSTATS_NAME = re.compile(r"^([a-z])_(\d+)_")
+TASK_TYPES = {"m": "map", "r": "reduce"}
+UNKNOWN_TASK_TYPE = "other"
+#: call paths that take less than this fraction of the total are not exported
+MIN_STACK_FRACTION = 1e-4
+#: number of functions by own time kept for each task, to explain outliers
+TOP_TASK_FUNCTIONS = 10
+
+
+def task_info(name):
+    """\
+    Return the ``(task_type, partition)`` of the task that wrote the
+    pstats file ``name``. If the name does not match the default pattern,
+    return ``("other", None)``.
+    """
+    m = PSTATS_NAME.match(name)
+    if m is None:
+        return UNKNOWN_TASK_TYPE, None
+    return TASK_TYPES.get(m.group(1), UNKNOWN_TASK_TYPE), int(m.group(2))
+
+
+def fetch(pstats_dir, dest_dir, threads=1):
+    """\
+    Copy all files in ``pstats_dir`` (an HDFS path) to ``dest_dir``,
+    using ``threads`` threads. Yield local paths as files are copied.
+    """
+    import pydoop.hdfs as hdfs
+    paths = [
+        _["name"] for _ in hdfs.lsl(pstats_dir) if _["kind"] == "file"
+    ]
+
+    def get(path):
+        local_path = os.path.join(dest_dir, hdfs.path.basename(path))
+        hdfs.get(path, local_path)
+        return local_path
+
+    pool = ThreadPool(max(min(threads, len(paths)), 1))
+    try:
+        for local_path in pool.imap_unordered(get, paths):
+            yield local_path
+    finally:
+        pool.close()
+        pool.join()
+
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    if not n:
+        return None
+    if n % 2:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2.
+
+
+class TaskProfile(object):
+    """\
+    Summary of a single task's profile: total time and top functions by
+    own time (the full stats are merged and discarded).
+    """
+
+    def __init__(self, name, stats):
+        self.name = name
+        self.task_type, self.partition = task_info(name)
+        self.total_tt = stats.total_tt
+        self.top = sorted(
+            ((v[2], f) for f, v in stats.stats.items()), reverse=True
+        )[:TOP_TASK_FUNCTIONS]
+
+
+class JobProfile(object):
+    """\
+    Job-wide profile: task profiles merged by task type.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.stats = {}  # by task type
+        self.tasks = {}
+
+    def add(self, path):
+        """\
+        Add the pstats file at ``path``.
+        """
+        s = pstats.Stats(path, stream=self.stream)
+        task = TaskProfile(os.path.basename(path), s)
+        self.tasks.setdefault(task.task_type, []).append(task)
+        try:
+            self.stats[task.task_type].add(s)
+        except KeyError:
+            self.stats[task.task_type] = s
+
+    def task_types(self):
+        return sorted(self.stats, key=lambda t: (t == UNKNOWN_TASK_TYPE, t))
+
+    def outliers(self, task_type, ratio=2.0):
+        """\
+        Return ``(task, total_tt / median)`` for each task of the given
+        type whose total time is at least ``ratio`` times the median, or at
+        most the median divided by ``ratio``, farthest first.
+        """
+        tasks = self.tasks[task_type]
+        m = median(_.total_tt for _ in tasks)
+        inf = float("inf")
+        rval = []
+        for t in tasks:
+            r = t.total_tt / m if m else inf
+            if r >= ratio or r <= 1. / ratio:
+                rval.append((t, r))
+        rval.sort(key=lambda _: max(_[1], 1. / _[1]) if _[1] else inf,
+                  reverse=True)
+        return rval
+
+    def excess(self, task):
+        """\
+        Return the function among the task's top ones by own time that
+        exceeds its job-wide average (per task of the same type) the most,
+        along with the difference in seconds.
+        """
+        if not task.top:
+            return None, 0.
+        merged = self.stats[task.task_type].stats
+        n = len(self.tasks[task.task_type])
+        dt, f = max((tt - merged[f][2] / n, f) for tt, f in task.top)
+        return f, dt
+
+    def collapsed_stacks(self, task_type):
+        """\
+        Return a ``{stack: seconds}`` dict with the own time of each call
+        path for the given task type, where ``stack`` is a ``;``-separated
+        list of frames starting with the task type.
+
+        cProfile only records caller-callee pairs, so the time of a
+        function called from several paths is split among them
+        proportionally to the time of each caller.
+        """
+        stats = self.stats[task_type].stats
+        callees = {}
+        roots = []
+        for f, (_, _, _, _, callers) in stats.items():
+            if not callers:
+                roots.append(f)
+            for c in callers:
+                callees.setdefault(c, []).append(f)
+        min_time = MIN_STACK_FRACTION * sum(stats[_][3] for _ in roots)
+        rval = {}
+        todo = [(f, (task_type,), frozenset(), stats[f][3]) for f in roots]
+        while todo:
+            f, path, seen, t = todo.pop()
+            tt, ct = stats[f][2], stats[f][3]
+            path += (frame_label(f),)
+            seen = seen | {f}
+            ratio = t / ct if ct else 0.
+            stack = ";".join(path)
+            rval[stack] = rval.get(stack, 0.) + tt * ratio
+            for g in callees.get(f, []):
+                if g in seen:  # recursion, included in the caller's time
+                    continue
+                edge = stats[g][4][f]
+                child_t = (edge[3] if isinstance(edge, tuple) else 0) * ratio
+                if child_t > min_time:
+                    todo.append((g, path, seen, child_t))
+        return rval
+
+    def write_collapsed(self, f):
+        """\
+        Write collapsed stacks for all task types to the file object ``f``,
+        with times in microseconds.
+        """
+        for task_type in self.task_types():
+            stacks = self.collapsed_stacks(task_type)
+            for stack in sorted(stacks):
+                us = int(round(1e6 * stacks[stack]))
+                if us > 0:
+                    f.write("%s %d\n" % (stack, us))
+
+    def print_report(self, top=20, outlier_ratio=2.0, strip_dirs=False):
+        """\
+        For each task type, print the top ``top`` functions by cumulative
+        and own time, followed by outlier tasks. With ``strip_dirs``, the
+        merged stats are modified by :meth:`pstats.Stats.strip_dirs`.
+        """
+        out = self.stream
+        for task_type in self.task_types():
+            s = self.stats[task_type]
+            tasks = self.tasks[task_type]
+            outliers = []  # before strip_dirs, which changes function keys
+            for task, r in self.outliers(task_type, outlier_ratio):
+                line = "%s: %.3f s (%.2fx median)" % (
+                    task.name, task.total_tt, r
+                )
+                f, dt = self.excess(task)
+                if f is not None and dt > 0:
+                    line += ", %s: %+.3f s vs average" % (
+                        pstats.func_std_string(f), dt
+                    )
+                outliers.append(line)
+            if strip_dirs:
+                s.strip_dirs()
+            s.files = []  # don't list thousands of file names in each table
+            out.write("=== %s tasks: %d profiles, %.3f s total ===\n" % (
+                task_type, len(tasks), s.total_tt
+            ))
+            for key, title in (("cumulative", "cumulative time"),
+                               ("tottime", "own time")):
+                out.write("\n--- top %d by %s ---\n" % (top, title))
+                s.sort_stats(key).print_stats(top)
+            out.write("--- outliers (median: %.3f s) ---\n" % median(
+                _.total_tt for _ in tasks
+            ))
+            out.write("%s\n\n" % ("\n".join(outliers) or "none"))
+
+
+def frame_label(func):
+    filename, line, name = func
+    if filename == "~":  # built-in
+        label = name
+    else:
+        label = "%s (%s:%d)" % (name, os.path.basename(filename), line)
+    return label.replace(";", ",")
+
+
+def run(args, unknown_args=None):
+    job_profile = JobProfile()
+    tmp_dir = tempfile.mkdtemp(prefix="pydoop_pstats_")
+    try:
+        for path in fetch(args.pstats_dir, tmp_dir, args.threads):
+            job_profile.add(path)
+            os.remove(path)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    if not job_profile.stats:
+        raise RuntimeError("no pstats files in %r" % (args.pstats_dir,))
+    job_profile.print_report(
+        top=args.top, outlier_ratio=args.outlier_ratio,
+        strip_dirs=args.strip_dirs
+    )
+    if args.collapsed:
+        with open(args.collapsed, "w") as f:
+            job_profile.write_collapsed(f)
+    return 0
+
+
+def add_parser_arguments(parser):
+    parser.add_argument(
+        'pstats_dir', metavar='HDFS_DIR',
+        help="pstats dir of the job (see pydoop submit --pstats-dir)"
+    )
+    parser.add_argument(
+        '-n', '--top', metavar='INT', type=int, default=20,
+        help="number of functions to show in each table"
+    )
+    parser.add_argument(
+        '--threads', metavar='INT', type=int, default=16,
+        help="number of threads used to fetch profiles"
+    )
+    parser.add_argument(
+        '--outlier-ratio', metavar='FLOAT', type=float, default=2.0,
+        help=("report tasks whose total time is at least this many times "
+              "the median for their type, or at most the median divided "
+              "by this")
+    )
+    parser.add_argument(
+        '--strip-dirs', action='store_true',
+        help="remove leading paths from file names in tables"
+    )
+    parser.add_argument(
+        '--collapsed', metavar='FILE',
+        help=("also write merged stats as collapsed stacks (one line per "
+              "call path, times in microseconds) to this local file, "
+              "e.g., for flamegraph.pl")
+    )
+
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser(
+        "pstats",
+        description=DESCRIPTION,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    add_parser_arguments(parser)
+    parser.set_defaults(func=run)
+    return parser
@@ -108,6 +108,9 @@ class PydoopScript(object):
         args.keep_wd = False
         args.pstats_dir = None
         args.pstats_fmt = None
+        args.sample_partitions = None
+        args.group_fields = None
+        args.warm_workers = False
 
         self.args, self.unknown_args = args, unknown_args
 
@@ -24,6 +24,7 @@ import os
 import sys
 import glob
 import argparse
+import json
 import logging
 import uuid
 logging.basicConfig(level=logging.INFO)
@@ -31,10 +32,15 @@ logging.basicConfig(level=logging.INFO)
 import pydoop
 import pydoop.hdfs as hdfs
 import pydoop.hadut as hadut
+import pydoop.hadoop_utils as hu
 import pydoop.utils as utils
 import pydoop.utils.conversion_tables as conv_tables
 from pydoop.mapreduce.api import AVRO_IO_MODES
-from pydoop.mapreduce.pipes import PSTATS_DIR, PSTATS_FMT
+from pydoop.mapreduce.grouping import GROUPING_FIELDS_KEY, java_properties
+from pydoop.mapreduce.partitioners import PARTITION_FILE_KEY
+from pydoop.mapreduce.pipes import (
+    INTERMEDIATE_CODEC_KEY, PSTATS_DIR, PSTATS_FMT
+)
 
 from .argparse_types import a_file_that_can_be_read, UpdateMap
 from .argparse_types import a_comma_separated_list, a_hdfs_file
@@ -50,6 +56,7 @@ USER_HOME = "mapreduce.admin.user.home.dir"
 JOB_REDUCES = "mapreduce.job.reduces"
 JOB_NAME = "mapreduce.job.name"
 COMPRESS_MAP_OUTPUT = "mapreduce.map.output.compress"
+PARTITION_FILE_NAME = "_partition.lst"
 
 
 class PydoopSubmitter(object):
@@ -156,6 +163,13 @@ class PydoopSubmitter(object):
         self.properties[JOB_REDUCES] = args.num_reducers
         if args.job_name:
             self.properties[JOB_NAME] = args.job_name
+        if args.sample_partitions:
+            self.properties[PARTITION_FILE_KEY] = hdfs.path.join(
+                self.remote_wd, PARTITION_FILE_NAME
+            )
+        else:  # from a previous call
+            self.properties.pop(PARTITION_FILE_KEY, None)
+        self.__set_grouping_properties(args)
         self.properties.update(args.job_conf or {})
         self.__set_files_to_cache(args)
         self.__set_archives_to_cache(args)
@@ -163,6 +177,28 @@ class PydoopSubmitter(object):
         self.args = args
         self.unknown_args = unknown_args
 
+    def __set_grouping_properties(self, args):
+        # drop any leftovers from a previous call with a different setup
+        for k in java_properties(1):
+            self.properties.pop(k, None)
+        self.properties.pop(INTERMEDIATE_CODEC_KEY, None)
+        if not args.group_fields:
+            return
+        if args.group_key_format == "text":
+            self.properties.update(java_properties(args.group_fields))
+            return
+        # ordered keys: fields are only known to the ordered codec
+        codec = (args.job_conf or {}).get(INTERMEDIATE_CODEC_KEY, "ordered")
+        if codec != "ordered":
+            raise RuntimeError(
+                "--group-fields with --group-key-format ordered requires "
+                "the ordered intermediate codec, but %s is %r" % (
+                    INTERMEDIATE_CODEC_KEY, codec
+                )
+            )
+        self.properties[GROUPING_FIELDS_KEY] = str(args.group_fields)
+        self.properties[INTERMEDIATE_CODEC_KEY] = "ordered"
+
     def __warn_user_if_wd_maybe_unreadable(self, abs_remote_path):
         """
         Check directories above the remote module and issue a warning if
@@ -268,8 +304,24 @@ class PydoopSubmitter(object):
             lines.append('import sys')
             lines.append('sys.stderr.write("%r\\n" % sys.path)')
             lines.append('sys.stderr.write("%s\\n" % sys.version)')
-        lines.append('import %s as module' % self.args.module)
-        lines.append('module.%s()' % self.args.entry_point)
+        # saves the task the trouble of running "hadoop classpath", etc.,
+        # if the Hadoop installation is the same (see PathFinder.find).
+        # Disabled if the variable is set via --set-env (e.g., to '')
+        hadoop_info = pydoop.hadoop_info()
+        if hadoop_info and hu.HADOOP_INFO_ENV not in self.requested_env:
+            lines.append('import os')
+            lines.append('os.environ.setdefault(%r, %r)' % (
+                hu.HADOOP_INFO_ENV, json.dumps(hadoop_info)
+            ))
+        if self.args.warm_workers:
+            lines.append('import pydoop.mapreduce.zygote as zygote')
+            lines.append('zygote.run(%r, %r, %r)' % (
+                self.args.module, self.args.entry_point,
+                hdfs.path.basename(self.remote_exe)
+            ))
+        else:
+            lines.append('import %s as module' % self.args.module)
+            lines.append('module.%s()' % self.args.entry_point)
         return os.linesep.join(lines) + os.linesep
 
     def __validate(self):
@@ -324,6 +376,18 @@ class PydoopSubmitter(object):
         self.logger.debug("Created%sremote paths:" %
                           (' [simulation] ' if self.args.pretend else ' '))
 
+    def __sample_partitions(self):
+        import pydoop.mapreduce.sampler as sampler
+        path = self.properties[PARTITION_FILE_KEY]
+        self.logger.info("sampling input to create %s", path)
+        kwargs = {"fraction": self.args.sample_partitions}
+        if self.args.sample_key_codec == "text":
+            kwargs["key"] = kwargs["encode"] = lambda _: _
+        points = sampler.create_partition_file(
+            [self.args.input], path, int(self.args.num_reducers), **kwargs
+        )
+        self.logger.debug("%d split points", len(points))
+
     def run(self):
         if self.args is None:
             raise RuntimeError("cannot run without args, please call set_args")
@@ -374,6 +438,8 @@ class PydoopSubmitter(object):
                               self.properties)
         try:
             self.__setup_remote_paths()
+            if self.args.sample_partitions and not self.args.pretend:
+                self.__sample_partitions()
             executor = (hadut.run_class if not self.args.pretend
                         else self.fake_run_class)
             executor(submitter_class, args=job_args,
@@ -549,6 +615,36 @@ def add_parser_arguments(parser):
     parser.add_argument(
         '--keep-wd', action='store_true', help="Don't remove the work dir"
     )
+    parser.add_argument(
+        '--warm-workers', action='store_true',
+        help=("Run tasks in processes forked from a node-local server that "
+              "has already imported MODULE (see pydoop.mapreduce.zygote)")
+    )
+    parser.add_argument(
+        '--sample-partitions', metavar='FRACTION', type=float,
+        help=("Read this fraction of the input splits and create a partition "
+              "file for pydoop.mapreduce.partitioners.TotalOrderPartitioner. "
+              "Sampled keys are input lines, see --sample-key-codec")
+    )
+    parser.add_argument(
+        '--sample-key-codec', choices=["ordered", "text"], default="ordered",
+        help=("Serialization of sampled keys: 'ordered' for the ordered "
+              "intermediate codec, 'text' for raw lines (without private "
+              "encoding)")
+    )
+    parser.add_argument(
+        '--group-fields', metavar='N', type=int,
+        help=("Secondary sort: call the reducer once for each distinct "
+              "prefix of N key fields, with values ordered by the full key "
+              "(see pydoop.mapreduce.grouping)")
+    )
+    parser.add_argument(
+        '--group-key-format', choices=["ordered", "text"], default="ordered",
+        help=("Format of map output keys for --group-fields: 'ordered' for "
+              "tuples with the ordered intermediate codec (set by this "
+              "option), 'text' for separator-delimited text (without "
+              "private encoding)")
+    )
 
 
 def add_parser(subparsers):
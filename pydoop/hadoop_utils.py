@@ -26,27 +26,51 @@ installation(s): version, classpath, etc.
 Known issues: from-tarball CDH installation is not supported.
 """
 
+# Modules only needed to actually look for Hadoop info (i.e., not when it's
+# been cached) are imported where they are used.
+
 import os
-import glob
 import re
-import platform
-import subprocess as sp
-import xml.dom.minidom as dom
-from xml.parsers.expat import ExpatError
-
-SYSTEM = platform.system().lower()
+import sys
+
+CACHE_DIR_ENV = "PYDOOP_CACHE_DIR"
+HADOOP_INFO_ENV = "PYDOOP_HADOOP_INFO"
+HADOOP_INFO_FORMAT = 1
+HADOOP_CONF_FILES = (
+    "hadoop-env.sh", "hadoop-site.xml", "core-site.xml", "hdfs-site.xml",
+    "mapred-site.xml", "yarn-site.xml",
+)
 
 
 def first_dir_in_glob(pattern):
+    import glob
     for path in sorted(glob.glob(pattern)):
         if os.path.isdir(path):
             return path
 
 
 CDH_HADOOP_HOME_PKG = '/usr/lib/hadoop'  # Cloudera bin packages
-CDH_HADOOP_HOME_PARCEL = first_dir_in_glob(
-    '/opt/cloudera/parcels/CDH-*/lib/hadoop'  # Cloudera Manager
-)
+
+
+def __getattr__(name):  # PEP 562
+    if name == "SYSTEM":
+        import platform
+        value = platform.system().lower()
+    elif name == "CDH_HADOOP_HOME_PARCEL":
+        value = first_dir_in_glob(
+            '/opt/cloudera/parcels/CDH-*/lib/hadoop'  # Cloudera Manager
+        )
+    else:
+        raise AttributeError("module %r has no attribute %r" % (
+            __name__, name
+        ))
+    globals()[name] = value
+    return value
+
+
+if sys.version_info < (3, 7):  # no PEP 562
+    SYSTEM = __getattr__("SYSTEM")
+    CDH_HADOOP_HOME_PARCEL = __getattr__("CDH_HADOOP_HOME_PARCEL")
 
 
 class HadoopVersionError(Exception):
@@ -64,6 +88,7 @@ class HadoopXMLError(Exception):
 def get_arch():
     # if SYSTEM == 'darwin':
     #     return "", ""
+    import platform
     bits, _ = platform.architecture()
     if bits == "64bit":
         return "amd64", "64"
@@ -73,8 +98,9 @@ def get_arch():
 def _cdh_hadoop_home():
     if os.path.isdir(CDH_HADOOP_HOME_PKG):
         return CDH_HADOOP_HOME_PKG
-    elif os.path.isdir(CDH_HADOOP_HOME_PARCEL or ''):
-        return CDH_HADOOP_HOME_PARCEL
+    parcel = sys.modules[__name__].CDH_HADOOP_HOME_PARCEL
+    if os.path.isdir(parcel or ''):
+        return parcel
     raise RuntimeError("unsupported CDH deployment")
 
 
@@ -283,6 +309,8 @@ def extract_text(node):
 
 
 def parse_hadoop_conf_file(fn):
+    import xml.dom.minidom as dom
+    from xml.parsers.expat import ExpatError
     items = []
     try:
         doc = dom.parse(fn)
@@ -305,6 +333,8 @@ def parse_hadoop_conf_file(fn):
 
 
 def _hadoop_home_from_version_cmd():
+    import subprocess as sp
+
     def get_hh_from_version_output(output):
         """
         the ``hadoop version`` command prints out some information.  The
@@ -345,6 +375,54 @@ def _hadoop_home_from_version_cmd():
     return None
 
 
+def cache_dir():
+    """\
+    Return the directory where information on the Hadoop installation is
+    cached, or :obj:`None` if caching is disabled.
+
+    This is the value of the ``PYDOOP_CACHE_DIR`` environment variable, if
+    set (an empty value disables caching), else ``pydoop`` under the user
+    cache directory (``XDG_CACHE_HOME``, default: ``~/.cache``).
+    """
+    d = os.getenv(CACHE_DIR_ENV)
+    if d is not None:
+        return d or None
+    base = (os.getenv("XDG_CACHE_HOME") or
+            os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "pydoop")
+
+
+def _cache_path():
+    d = cache_dir()
+    if not d:
+        return None
+    key = "%s:%s" % (
+        os.getenv("HADOOP_HOME") or os.getenv("HADOOP_PREFIX") or "",
+        os.getenv("HADOOP_CONF_DIR", ""),
+    )
+    import hashlib
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return os.path.join(d, "hadoop-%s.json" % digest)
+
+
+def _stamps(hadoop_home, hadoop_exec, hadoop_conf):
+    # modification times of everything that can affect the cached info
+    # (not the home dir itself, since Hadoop can write logs there)
+    import glob
+    paths = [hadoop_exec]
+    paths.extend(sorted(glob.glob(os.path.join(
+        hadoop_home, "share", "hadoop", "*"
+    ))))
+    paths.extend(os.path.join(hadoop_conf, _) for _ in HADOOP_CONF_FILES)
+    stamps = {}
+    for p in paths:
+        try:
+            stamps[p] = os.stat(p).st_mtime
+        except OSError:
+            stamps[p] = None
+    return stamps
+
+
 class PathFinder(object):
     """
     Encapsulates the logic to find paths and other info required by Pydoop.
@@ -423,6 +501,7 @@ class PathFinder(object):
                 except ValueError:
                     pass
                 else:
+                    import subprocess as sp
                     try:
                         env = os.environ.copy()
                         # why pop HADOOP_HOME?
@@ -529,6 +608,8 @@ class PathFinder(object):
         if hadoop_home is None:
             hadoop_home = self.hadoop_home()
         if not self.__hadoop_classpath:
+            import glob
+            import subprocess as sp
             hadoop = self.hadoop_exec(hadoop_home=hadoop_home)
             cmd = [hadoop, 'classpath', '--glob']
             cp = sp.check_output(cmd, universal_newlines=True).strip()
@@ -538,7 +619,125 @@ class PathFinder(object):
             self.__hadoop_classpath = cp
         return self.__hadoop_classpath
 
+    def dump_info(self):
+        """\
+        Return all information found on the Hadoop installation as a
+        JSON-serializable dict that can be passed to :meth:`load_info`, or
+        :obj:`None` if something could not be found.
+        """
+        info = {}
+        try:
+            for a in ("hadoop_home", "hadoop_exec", "hadoop_version",
+                      "hadoop_conf", "hadoop_params", "hadoop_classpath"):
+                info[a] = getattr(self, a)()
+        except ValueError:
+            return None
+        try:
+            info["hadoop_native"] = self.hadoop_native()
+        except (ValueError, RuntimeError):
+            info["hadoop_native"] = None
+        info["format"] = HADOOP_INFO_FORMAT
+        info["classpath_env"] = os.getenv("HADOOP_CLASSPATH", "")
+        info["stamps"] = _stamps(
+            info["hadoop_home"], info["hadoop_exec"], info["hadoop_conf"]
+        )
+        return info
+
+    @staticmethod
+    def __info_is_valid(info):
+        if info.get("format") != HADOOP_INFO_FORMAT:
+            return False
+        for a, value in (
+                ("hadoop_home", (os.getenv("HADOOP_HOME") or
+                                 os.getenv("HADOOP_PREFIX"))),
+                ("hadoop_conf", os.getenv("HADOOP_CONF_DIR")),
+                ("hadoop_version", os.getenv("HADOOP_VERSION")),
+        ):
+            if value and value != info[a]:
+                return False
+        if os.getenv("HADOOP_CLASSPATH", "") != info["classpath_env"]:
+            return False
+        return info["stamps"] == _stamps(
+            info["hadoop_home"], info["hadoop_exec"], info["hadoop_conf"]
+        )
+
+    def load_info(self, info):
+        """\
+        Load information returned by :meth:`dump_info` (possibly in another
+        process), if it's still valid: i.e., it agrees with the Hadoop
+        environment variables and the Hadoop home and configuration files
+        have not been modified since. Return :obj:`True` if ``info`` was
+        loaded.
+        """
+        try:
+            if not self.__info_is_valid(info):
+                return False
+        except (AttributeError, KeyError, TypeError):
+            return False
+        self.__hadoop_home = info["hadoop_home"]
+        self.__hadoop_exec = info["hadoop_exec"]
+        self.__hadoop_version = info["hadoop_version"]
+        self.__hadoop_version_info = None
+        self.__hadoop_conf = info["hadoop_conf"]
+        self.__hadoop_params = info["hadoop_params"]
+        self.__hadoop_classpath = info["hadoop_classpath"]
+        self.__hadoop_native = info["hadoop_native"]
+        return True
+
+    def __load_cached_info(self):
+        import json
+        sources = [os.getenv(HADOOP_INFO_ENV)]
+        path = _cache_path()
+        if path:
+            try:
+                with open(path) as f:
+                    sources.append(f.read())
+            except (IOError, OSError):
+                pass
+        for s in sources:
+            if not s:
+                continue
+            try:
+                info = json.loads(s)
+            except ValueError:
+                continue
+            if self.load_info(info):
+                return True
+        return False
+
+    def __save_cached_info(self):
+        path = _cache_path()
+        info = path and self.dump_info()
+        if not info:
+            return
+        import json
+        import tempfile
+        d = os.path.dirname(path)
+        tmp = None
+        try:
+            if not os.path.isdir(d):
+                os.makedirs(d)
+            fd, tmp = tempfile.mkstemp(prefix=".hadoop-", dir=d)
+            with os.fdopen(fd, "w") as f:
+                json.dump(info, f)
+            os.rename(tmp, path)  # atomic
+        except (IOError, OSError):
+            if tmp and os.path.exists(tmp):
+                os.remove(tmp)
+
     def find(self):
+        """\
+        Find all information on the Hadoop installation, returning the
+        most commonly used items.
+
+        Running ``hadoop`` (to get the version and the classpath) is slow,
+        so results are cached in a file under :func:`cache_dir` and
+        reused as long as they are valid (see :meth:`load_info`). Info
+        found by another process can also be passed (serialized to JSON)
+        via the ``PYDOOP_HADOOP_INFO`` environment variable: ``pydoop
+        submit`` does this for the job's tasks.
+        """
+        loaded = self.__load_cached_info()
         info = {}
         for a in (
             "hadoop_exec",
@@ -552,6 +751,8 @@ class PathFinder(object):
                 info[a] = getattr(self, a)()
             except ValueError:
                 info[a] = None
+        if not loaded:
+            self.__save_cached_info()
         return info
 
     def is_yarn(self, hadoop_conf=None, hadoop_home=None):
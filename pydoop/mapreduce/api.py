@@ -25,7 +25,6 @@ must be subclassed by the developer, providing implementations for all
 methods called by the framework.
 """
 
-import json
 from abc import abstractmethod
 from collections import namedtuple
 
@@ -35,6 +34,37 @@ from pydoop.utils.py3compat import ABC
 # move to pydoop.properties?
 AVRO_IO_MODES = {'k', 'v', 'kv', 'K', 'V', 'KV'}
 
+# py2 compat
+try:
+    _NUMBER_TYPES = frozenset((int, long, float))
+except NameError:
+    _NUMBER_TYPES = frozenset((int, float))
+
+_NUMPY = []  # lazily imported, see _to_batch
+
+
+def _to_batch(seq, use_numpy=True):
+    """\
+    Convert a sequence of input keys or values to the format expected by
+    batch components: a NumPy array if all items are numbers (and NumPy is
+    available), else a list.
+    """
+    if not use_numpy or not seq or type(seq[0]) not in _NUMBER_TYPES:
+        return list(seq)
+    if not _NUMPY:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _NUMPY.append(numpy)
+    if _NUMPY[0] is None:
+        return list(seq)
+    try:
+        a = _NUMPY[0].asarray(seq)
+    except (TypeError, ValueError, OverflowError):
+        return list(seq)
+    return a if a.dtype.kind in "iuf" else list(seq)
+
 
 class JobConf(dict):
     """
@@ -48,20 +78,133 @@ class JobConf(dict):
       '1'
       >>> jc.get_int('a')
       1
+
+    The framework creates the job conf with :meth:`fromraw`, so that each
+    property is only decoded when it's first accessed (iterating over the
+    job conf decodes all of them). Typed lookups are memoized, so they are
+    cheap enough to be done for each record; note that this means that
+    :meth:`get_json` returns the same object each time for a given key.
     """
+    def __init__(self, *args, **kwargs):
+        self.__raw = {}  # undecoded items, disjoint from the dict's own
+        self._reset_typed()
+        super(JobConf, self).__init__(*args, **kwargs)
+
+    @classmethod
+    def fromraw(cls, raw):
+        """\
+        Create a job conf from a dict of UTF-8 encoded (:class:`bytes`)
+        property names and values, which are decoded on demand.
+        """
+        jc = cls()
+        jc.__raw = raw
+        return jc
+
+    def __raw_key(self, key):
+        try:
+            return key.encode("utf-8")
+        except AttributeError:
+            return None
+
+    def __decode(self, key):
+        try:
+            value = self.__raw.pop(self.__raw_key(key))
+        except (KeyError, TypeError):
+            raise KeyError(key)
+        value = value.decode("utf-8")
+        dict.__setitem__(self, key, value)
+        return value
+
+    def _reset_typed(self):
+        # memoized typed lookups, by kind: {(key, default): value}
+        self.__ints, self.__floats, self.__bools, self.__jsons = (
+            {}, {}, {}, {}
+        )
+
+    def _load(self):
+        """\
+        Decode all properties.
+        """
+        if self.__raw:
+            dict.update(self, (
+                (k.decode("utf-8"), v.decode("utf-8"))
+                for k, v in self.__raw.items()
+            ))
+            self.__raw.clear()
+
+    def __missing__(self, key):
+        return self.__decode(key)
+
+    def __contains__(self, key):
+        return (dict.__contains__(self, key) or
+                self.__raw_key(key) in self.__raw)
+
+    def __len__(self):
+        return dict.__len__(self) + len(self.__raw)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        self.__raw.pop(self.__raw_key(key), None)
+        self._reset_typed()
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        if not dict.__contains__(self, key):
+            self.__decode(key)
+        self._reset_typed()
+        dict.__delitem__(self, key)
+
+    def __reduce__(self):
+        self._load()
+        return self.__class__, (dict(self),)
+
+    def copy(self):
+        self._load()
+        return self.__class__(self)
+
+    def __memoized(self, cache, convert, key, default):
+        try:
+            value = cache[key, default] = convert(self.get(key, default))
+        except TypeError:  # unhashable default
+            value = convert(self.get(key, default))
+        return value
+
+    @staticmethod
+    def __to_bool(v, default):
+        if v != default:
+            v = v.strip().lower()
+            if v == 'true':
+                v = True
+            elif v == 'false':
+                v = False
+            elif default is None:
+                raise RuntimeError("invalid bool string: %s" % v)
+            else:
+                v = default
+        return v
+
     def get_int(self, key, default=None):
         """
         Same as :meth:`dict.get`, but the value is converted to an int.
         """
-        value = self.get(key, default)
-        return None if value is None else int(value)
+        try:
+            return self.__ints[key, default]
+        except (KeyError, TypeError):
+            return self.__memoized(self.__ints, _int, key, default)
 
     def get_float(self, key, default=None):
         """
         Same as :meth:`dict.get`, but the value is converted to a float.
         """
-        value = self.get(key, default)
-        return None if value is None else float(value)
+        try:
+            return self.__floats[key, default]
+        except (KeyError, TypeError):
+            return self.__memoized(self.__floats, _float, key, default)
 
     def get_bool(self, key, default=None):
         """
@@ -71,22 +214,91 @@ class JobConf(dict):
         :obj:`False` if the string is equal, ignoring case, to
         ``'true'`` or ``'false'``.
         """
-        v = self.get(key, default)
-        if v != default:
-            v = v.strip().lower()
-            if v == 'true':
-                v = True
-            elif v == 'false':
-                v = False
-            elif default is None:
-                raise RuntimeError("invalid bool string: %s" % v)
-            else:
-                v = default
-        return v
+        try:
+            return self.__bools[key, default]
+        except (KeyError, TypeError):
+            return self.__memoized(
+                self.__bools, lambda v: self.__to_bool(v, default),
+                key, default
+            )
 
     def get_json(self, key, default=None):
-        value = self.get(key, default)
-        return None if value is None else json.loads(value)
+        try:
+            return self.__jsons[key, default]
+        except (KeyError, TypeError):
+            return self.__memoized(self.__jsons, _json, key, default)
+
+    def typed(self, spec):
+        """\
+        Look up multiple properties at once, converting their values.
+
+        ``spec`` maps property names to either a type or a ``(type,
+        default)`` tuple, where type is one of ``int``, ``float``, ``bool``,
+        ``str`` or ``"json"``. Returns a dict that maps property names to
+        their converted values (:obj:`None` for missing properties without
+        a default). Typically called once, in a component's ``__init__``::
+
+          >>> params = jc.typed({"my.threshold": (float, 0.5), "a": int})
+          >>> params["a"]
+          1
+        """
+        getters = {
+            int: self.get_int,
+            float: self.get_float,
+            bool: self.get_bool,
+            str: self.get,
+            "json": self.get_json,
+        }
+        rval = {}
+        for key, t in spec.items():
+            t, default = t if isinstance(t, tuple) else (t, None)
+            try:
+                get = getters[t]
+            except (KeyError, TypeError):
+                raise ValueError("unsupported type for %s: %r" % (key, t))
+            rval[key] = get(key, default)
+        return rval
+
+
+def _int(value):
+    return None if value is None else int(value)
+
+
+def _float(value):
+    return None if value is None else float(value)
+
+
+def _json(value):
+    if value is None:
+        return None
+    import json
+    return json.loads(value)
+
+
+def _loading(name, mutating=False):
+    method = getattr(dict, name)
+
+    def wrapper(self, *args, **kwargs):
+        self._load()
+        if mutating:
+            self._reset_typed()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+# all other dict methods need the decoded properties
+for _name in ("__iter__", "__repr__", "__eq__", "__ne__", "__reversed__",
+              "__or__", "__ror__", "keys", "values", "items", "iterkeys",
+              "itervalues", "iteritems", "viewkeys", "viewvalues",
+              "viewitems"):
+    if hasattr(dict, _name):
+        setattr(JobConf, _name, _loading(_name))
+for _name in ("__ior__", "clear", "pop", "popitem", "setdefault", "update"):
+    if hasattr(dict, _name):
+        setattr(JobConf, _name, _loading(_name, mutating=True))
+del _name
 
 
 class InputSplit(object):
@@ -193,6 +405,10 @@ class Context(ABC):
     def values(self):
         """
         Iterator over all values for the current key (reduce tasks only).
+
+        With secondary sort, this iterates over the values for all keys
+        with the same prefix as the current one: see
+        :mod:`~pydoop.mapreduce.grouping`.
         """
         return self.get_input_values()
 
@@ -207,6 +423,16 @@ class Context(ABC):
         """
         pass
 
+    def emit_batch(self, keys, values):
+        """
+        Emit multiple key, value pairs to the framework.
+
+        Equivalent to calling :meth:`emit` for each pair in ``zip(keys,
+        values)``, but implementations can do it more efficiently.
+        """
+        for k, v in zip(keys, values):
+            self.emit(k, v)
+
     @abstractmethod
     def progress(self):
         pass
@@ -300,13 +526,145 @@ class Reducer(Component, Closable):
         pass
 
 
+class BatchMapper(Mapper):
+    """
+    A mapper that processes input records in batches.
+
+    Rather than calling :meth:`~Mapper.map` once per input record, the
+    framework collects up to :attr:`batch_size` records and calls
+    :meth:`map_batch` on them. This amortizes the per-record Python call
+    overhead and allows vectorized processing: if all keys (or values) in a
+    batch are numbers and NumPy is available, they are passed as a NumPy
+    array (set :attr:`use_numpy` to :obj:`False` to always get lists).
+    Output can be sent with :meth:`Context.emit_batch`::
+
+      class Mapper(api.BatchMapper):
+
+          def map_batch(self, context, keys, values):
+              context.emit_batch(keys, values * 2)
+    """
+
+    #: max number of records passed to :meth:`map_batch`
+    batch_size = 1024
+    #: pass numeric batches as NumPy arrays, if available
+    use_numpy = True
+
+    def map(self, context):
+        """
+        Process a single record as a batch of one.
+
+        Called by the framework only when records are not batched (e.g.,
+        when they come from a Python :class:`RecordReader`).
+        """
+        self.map_batch(
+            context,
+            _to_batch([context.key], self.use_numpy),
+            _to_batch([context.value], self.use_numpy),
+        )
+
+    @abstractmethod
+    def map_batch(self, context, keys, values):
+        """
+        Called by the framework for each batch of input records.
+
+        :type context: :class:`Context`
+        :param context: the context object passed by the framework.
+        :type keys: list or :class:`numpy.ndarray`
+        :param keys: the input keys.
+        :type values: list or :class:`numpy.ndarray`
+        :param values: the input values, with ``values[i]`` corresponding to
+          ``keys[i]``.
+        """
+        pass
+
+
+class ThreadedMapper(Mapper):
+    """
+    A mapper whose :meth:`~Mapper.map` method is run by a pool of threads.
+
+    This is useful when most of the time is spent waiting for I/O (e.g.,
+    reading side data from HDFS or querying a remote service) or in code
+    that releases the GIL. Each call to :meth:`~Mapper.map` gets its own
+    context object, with the input record's key and value; records emitted
+    through it are collected and passed to the task's context, from the
+    main thread, when the call completes. If :attr:`ordered` is
+    :obj:`True`, output records are emitted in input order; otherwise, they
+    are emitted as soon as possible. Counters and status updates are
+    serialized by the framework, but any other state shared between calls
+    (including instance attributes) must be protected by the application.
+
+    Input reading is suspended while :attr:`max_pending` records are being
+    processed or waiting to be emitted. Any mapper can be run in this way
+    by passing ``map_threads`` to :func:`~pydoop.mapreduce.pipes.run_task`.
+    """
+
+    #: number of threads that call :meth:`~Mapper.map`
+    threads = 4
+    #: emit outputs in input order
+    ordered = True
+    #: max number of records in progress (default: ``4 * threads``)
+    max_pending = None
+
+
+class BatchReducer(Reducer):
+    """
+    A reducer that processes multiple keys at a time.
+
+    The framework groups consecutive keys, together with all of their
+    values, until at least :attr:`batch_size` values have been collected,
+    then calls :meth:`reduce_batch`. Each value sequence is a NumPy array if
+    all of its items are numbers (and NumPy is available, see
+    :attr:`use_numpy`), else a list. Note that, unlike
+    :attr:`Context.values`, each value sequence is fully loaded into memory.
+    """
+
+    #: min number of values collected before calling :meth:`reduce_batch`
+    batch_size = 1024
+    #: pass numeric value sequences as NumPy arrays, if available
+    use_numpy = True
+
+    def reduce(self, context):
+        """
+        Process a single key as a batch of one.
+
+        Called by the framework when keys are not batched (e.g., when this
+        class is also used as a combiner).
+        """
+        self.reduce_batch(
+            context,
+            [context.key],
+            [_to_batch(list(context.values), self.use_numpy)],
+        )
+
+    @abstractmethod
+    def reduce_batch(self, context, keys, values):
+        """
+        Called by the framework for each batch of keys.
+
+        :type context: :class:`Context`
+        :param context: the context object passed by the framework.
+        :type keys: list
+        :param keys: the input keys.
+        :type values: list
+        :param values: the input values, with ``values[i]`` containing all
+          values for ``keys[i]`` as a list or :class:`numpy.ndarray`.
+        """
+        pass
+
+
 class Combiner(Reducer):
     """\
     A ``Combiner`` performs the same actions as a :class:`Reducer`, but it
     runs locally within a map task. This helps cutting down the amount of data
     sent to reducers across the network, with the downside that map tasks
     require extra memory to cache intermediate key/value pairs. The cache size
-    is controlled by ``"mapreduce.task.io.sort.mb"`` and defaults to 100 MB.
+    is controlled by ``"mapreduce.task.io.sort.mb"`` and defaults to 100 MB
+    (see :mod:`pydoop.mapreduce.memory` for how it's measured). If
+    ``"pydoop.mapreduce.pipes.combiner.rss.fraction"`` is set (e.g., to 0.5),
+    the cache is also spilled when the resident memory of the Python process
+    exceeds that fraction of ``"mapreduce.map.memory.mb"``. The number of
+    spills, spilled keys and spilled (estimated) bytes are reported in the
+    ``PYDOOP_COMBINER`` counter group.
 
     Note that it's not strictly necessary to extend this class in order to
     write a combiner: all that's required is that it has the same interface as
@@ -316,6 +674,69 @@ class Combiner(Reducer):
     pass
 
 
+class AggregatingCombiner(Combiner):
+    """\
+    A combiner that folds values into a running accumulator, one per key.
+
+    With an ordinary combiner, the framework keeps a list of all values
+    emitted for each key, and runs the combiner on them when the cache is
+    full. With an ``AggregatingCombiner``, each emitted value is folded into
+    its key's accumulator right away (see :meth:`initial` and
+    :meth:`combine`), so that memory usage depends on the number of distinct
+    keys rather than on the number of emitted records. When the cache is
+    full (and when the task ends), each key is emitted once, together with
+    its accumulator. For instance, a word count combiner looks like this::
+
+      class Combiner(api.AggregatingCombiner):
+
+          def combine(self, acc, value):
+              return acc + value
+
+    Note that the reducer gets accumulators as values: if they are not of
+    the same type as the mapper's output values (e.g., a ``(sum, count)``
+    pair for computing averages), the reducer must handle that.
+    """
+
+    def initial(self, value):
+        """\
+        Return the initial accumulator for a key, given its first value.
+
+        The default implementation returns ``value`` itself.
+        """
+        return value
+
+    @abstractmethod
+    def combine(self, acc, value):
+        """\
+        Fold ``value`` into ``acc`` and return the updated accumulator.
+
+        The accumulator can be updated in place, as long as it's returned.
+        """
+        pass
+
+    def merge(self, acc, other):
+        """\
+        Merge two accumulators for the same key and return the result.
+
+        The default implementation calls :meth:`combine`, which is correct
+        when accumulators and values have the same type (e.g., sums).
+        """
+        return self.combine(acc, other)
+
+    def reduce(self, context):
+        """\
+        Fold all values for the current key and emit the accumulator.
+
+        Called by the framework only when this class is used as an ordinary
+        reducer or combiner.
+        """
+        values = iter(context.values)
+        acc = self.initial(next(values))
+        for v in values:
+            acc = self.combine(acc, v)
+        context.emit(context.key, acc)
+
+
 class Partitioner(Component):
     r"""
     Controls the partitioning of intermediate keys output by the
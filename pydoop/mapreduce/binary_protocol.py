@@ -23,15 +23,16 @@ Ref: ``org.apache.hadoop.mapred.pipes.BinaryProtocol``.
 """
 
 import os
-try:
-    from cPickle import loads
-except ImportError:
-    from pickle import loads
-from itertools import groupby
-from operator import itemgetter
+from functools import partial
+from itertools import islice
 
 import pydoop.config as config
-from .api import AVRO_IO_MODES, JobConf
+from .api import (
+    AVRO_IO_MODES, BatchMapper, BatchReducer, JobConf, _to_batch
+)
+from .grouping import get_group_key
+from .threaded import MapDispatcher, get_map_threads
+from .workers import CHUNK_SIZE, MAP_WORKERS_KEY, MapWorkers
 
 
 PROTOCOL_VERSION = 0
@@ -108,6 +109,66 @@ DESERIALIZERS = {
     "org.apache.hadoop.io.Text": _get_Text,
 }
 
+# FileInStream.{read,run}_map_items format codes for map input types
+MAP_ITEM_FORMATS = {
+    "org.apache.hadoop.io.BooleanWritable": "o",
+    "org.apache.hadoop.io.BytesWritable": "b",
+    "org.apache.hadoop.io.DoubleWritable": "d",
+    "org.apache.hadoop.io.FloatWritable": "f",
+    "org.apache.hadoop.io.IntWritable": "i",
+    "org.apache.hadoop.io.LongWritable": "q",
+    "org.apache.hadoop.io.NullWritable": "n",
+    "org.apache.hadoop.io.Text": "s",
+    "org.apache.hadoop.io.VIntWritable": "v",
+    "org.apache.hadoop.io.VLongWritable": "v",
+}
+
+# Python deserializers for map input types, see register_deserializer
+PY_DESERIALIZERS = {}
+
+# ArrayWritable codes are the upper case versions of the item codes
+_FORMAT_CODES = frozenset("bsqivfdonSQIVFDO")
+
+
+def register_deserializer(type_name, deser):
+    """\
+    Register a deserializer for map input keys or values of the given Java
+    type (e.g., ``"org.apache.hadoop.io.IntWritable"``).
+
+    ``deser`` can be either a callable that takes the serialized object (as
+    a bytes object) and returns the corresponding Python object, or a format
+    code for the native decoder:
+
+    * ``"b"``: raw bytes (also used for ``BytesWritable``)
+    * ``"s"``: ``Text`` (returns a unicode string)
+    * ``"q"``: ``LongWritable``
+    * ``"i"``: ``IntWritable``
+    * ``"v"``: ``VIntWritable`` or ``VLongWritable``
+    * ``"f"``: ``FloatWritable``
+    * ``"d"``: ``DoubleWritable``
+    * ``"o"``: ``BooleanWritable``
+    * ``"n"``: ``NullWritable`` (always returns :obj:`None`)
+
+    The upper case versions of ``"sqivfdo"`` stand for an ``ArrayWritable``
+    of the corresponding type, decoded as a list. Since ``ArrayWritable``
+    needs to be subclassed to specify the item type, there is no default
+    mapping for it: for instance, given a ``com.example.IntArrayWritable``
+    subclass that holds ``IntWritable`` items, call::
+
+      register_deserializer("com.example.IntArrayWritable", "I")
+
+    Deserializers are not applied to keys or values for which raw mode has
+    been requested (see :func:`~.pipes.run_task`).
+    """
+    if callable(deser):
+        MAP_ITEM_FORMATS.pop(type_name, None)
+        PY_DESERIALIZERS[type_name] = deser
+    elif deser in _FORMAT_CODES:
+        PY_DESERIALIZERS.pop(type_name, None)
+        MAP_ITEM_FORMATS[type_name] = deser
+    else:
+        raise ValueError("invalid deserializer: %r" % (deser,))
+
 
 def _get_avro_key(downlink):
     raw = downlink.stream.read_bytes()
@@ -119,8 +180,94 @@ def _get_avro_value(downlink):
     return downlink.avro_value_deserializer.deserialize(raw)
 
 
-def _get_pickled(downlink):
-    return loads(downlink.stream.read_bytes())
+def _get_private(downlink):
+    return downlink.context._codec.decode(downlink.stream.read_bytes())
+
+
+class GroupedValues(object):
+    """\
+    Iterator over the values for a group of consecutive reduce keys with
+    the same grouping prefix (see :mod:`~.grouping`).
+
+    Values for each key are read by a native iterator. When it's exhausted,
+    the next command is read: if it's a REDUCE_KEY with the same prefix, the
+    group goes on with the values for the new key, which is stored in
+    :attr:`key`; otherwise, the group ends, and the command (plus the new
+    key, if any) is stored in :attr:`cmd` (and :attr:`next_key`) for the
+    downlink to handle.
+    """
+
+    def __init__(self, downlink, key, deser):
+        self.downlink = downlink
+        self.key = key
+        self.prefix = downlink.group_key(key)
+        self.deser = deser
+        self.cmd = None
+        self.next_key = None
+        self.__values = downlink.stream.reduce_values("b", deser)
+
+    def __advance(self):
+        if self.cmd is not None:
+            return False
+        cmd = self.downlink.stream.read_vint()
+        if cmd == REDUCE_KEY:
+            key = self.downlink.get_k()
+            if self.downlink.group_key(key) == self.prefix:
+                self.key = key
+                self.__values = self.downlink.stream.reduce_values(
+                    "b", self.deser
+                )
+                return True
+            self.next_key = key
+        self.cmd = cmd
+        return False
+
+    def skip(self):
+        """\
+        Discard all remaining values in the group, return their number.
+        """
+        count = self.__values.skip()
+        while self.__advance():
+            count += self.__values.skip()
+        return count
+
+    def __next__(self):
+        while True:
+            try:
+                return next(self.__values)
+            except StopIteration:
+                if not self.__advance():
+                    raise
+
+    def __iter__(self):
+        return self
+
+    # py2 compat
+    def next(self):
+        return self.__next__()
+
+
+class _TimedValues(object):
+    """\
+    Wraps the values iterator for a sampled reduce call, timing reads.
+    """
+
+    def __init__(self, values, timer):
+        self.values = values
+        self.__next = timer.nested(partial(next, values), "read")
+
+    def __getattr__(self, name):  # e.g., GroupedValues.key
+        return getattr(self.values, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.__next()
+
+    # py2 compat
+    def next(self):
+        return self.__next__()
 
 
 class Downlink(object):
@@ -176,8 +323,41 @@ class Downlink(object):
       * the Downlink object is not part of the client API (it's not passed to
         user code at all)
 
+    Moreover, a MAP_ITEM command, together with all immediately following
+    MAP_ITEM commands, is handled by a native loop
+    (``FileInStream.run_map_items``) that decodes keys and values, sets them
+    on the context and calls the mapper directly, skipping the per-command
+    Python dispatch. Since the native loop stops at the first command of a
+    different type, all other commands are still handled here. Key and value
+    deserialization in the native loop is controlled by ``map_items_fmt``
+    (see ``MAP_ITEM_FORMATS``) plus optional Python post-deserializers (e.g.,
+    for Avro). With ``zero_copy``, raw map input keys and values are read
+    directly into reusable memory blocks and passed to the mapper as
+    read-only memoryviews. On the reduce side, the values for each key are
+    read and deserialized by a native iterator (see ``run_reduce``).
+
+    If the mapper is a :class:`~.api.BatchMapper`, map items are instead read
+    in chunks of up to ``batch_size`` (``FileInStream.read_map_items``) and
+    passed to ``map_batch``. Similarly, if the reducer is a
+    :class:`~.api.BatchReducer`, keys and their values are accumulated and
+    passed to ``reduce_batch``.
+
+    With secondary sort (see :mod:`~.grouping`), the values for
+    consecutive keys with the same prefix are read as a single group
+    (:class:`GroupedValues`).
+
+    With ``map_workers`` greater than 1, map input records are read in
+    chunks and passed to a pool of forked worker processes
+    (:class:`~.workers.MapWorkers`) that run the mapper. With map threads,
+    the mapper is called by a :class:`~.threaded.MapDispatcher` (see
+    ``get_map_func``).
+
     Job conf deserialization also needs to be somewhat efficient, since it
     involves reading thousands of strings.
+
+    If the context has a :class:`~pydoop.utils.misc.PhaseTimer` (see
+    :meth:`setup_timer`), reading input is timed as a whole, while user
+    methods are timed on a sample of calls.
     """
 
     def __init__(self, istream, context, **kwargs):
@@ -185,10 +365,22 @@ class Downlink(object):
         self.context = context
         self.raw_k = kwargs.get("raw_keys", False)
         self.raw_v = kwargs.get("raw_values", False)
+        zero_copy = kwargs.get("zero_copy", False)
         self.password = get_password()
         self.auth_done = False
         self.avro_key_deserializer = None
         self.avro_value_deserializer = None
+        self.map_items_fmt = "%s%s" % (
+            "m" if zero_copy and self.raw_k else "b",
+            "m" if zero_copy and self.raw_v else "b",
+        )
+        self.key_deser = None
+        self.value_deser = None
+        self.group_key = None
+        self.map_workers = kwargs.get("map_workers")
+        self.map_threads = kwargs.get("map_threads")
+        self.workers = None
+        self.timer = None
 
     def close(self):
         self.stream.close()
@@ -197,8 +389,8 @@ class Downlink(object):
         n = self.stream.read_vint()
         if n & 1:
             raise RuntimeError("number of items is not even")
-        t = self.stream.read_tuple(n * 's')
-        return JobConf(t[i: i + 2] for i in range(0, n, 2))
+        t = self.stream.read_tuple(n * 'b')  # decoded on demand
+        return JobConf.fromraw(dict(zip(t[::2], t[1::2])))
 
     def verify_digest(self, digest, challenge):
         if self.password is not None:
@@ -213,6 +405,25 @@ class Downlink(object):
         if not writer and not piped_output:
             raise RuntimeError("record writer not defined")
 
+    def read_map_items(self, *args):
+        return self.stream.read_map_items(*args)
+
+    def setup_timer(self, timer):
+        """\
+        Time reading input with ``timer`` (phase ``"read"``), along with
+        calls to user methods (phases ``"map"``, ``"reduce"`` and
+        ``"record_reader"``) and map workers (phase ``"workers"``).
+        """
+        self.timer = timer
+        self.read_map_items = timer.timed(self.read_map_items, "read")
+        self.__map_batch = timer.timed(self.__map_batch, "map")
+
+    def __reduce_sampled(self, context):
+        # in sampled runs, time reading values separately
+        if self.timer.sampling:
+            context._values = _TimedValues(context._values, self.timer)
+        context.reducer.reduce(context)
+
     def get_k(self):
         return self.stream.read_bytes()
 
@@ -231,21 +442,266 @@ class Downlink(object):
         if avro_input == 'K' or avro_input == 'KV' and not self.raw_k:
             schema = jc.get(config.AVRO_KEY_INPUT_SCHEMA)
             self.avro_key_deserializer = AvroDeserializer(schema)
+            self.key_deser = self.avro_key_deserializer.deserialize
             self.__class__.get_k = _get_avro_key
         if avro_input == 'V' or avro_input == 'KV' and not self.raw_v:
             schema = jc.get(config.AVRO_VALUE_INPUT_SCHEMA)
             self.avro_value_deserializer = AvroDeserializer(schema)
+            self.value_deser = self.avro_value_deserializer.deserialize
             self.__class__.get_v = _get_avro_value
 
     def setup_deser(self, key_type, value_type):
+        k_fmt, v_fmt = self.map_items_fmt
         if not self.raw_k:
             d = DESERIALIZERS.get(key_type)
             if d is not None:
                 self.__class__.get_k = d
+            k_fmt = MAP_ITEM_FORMATS.get(key_type, k_fmt)
+            self.key_deser = PY_DESERIALIZERS.get(key_type)
         if not self.raw_v:
             d = DESERIALIZERS.get(value_type)
             if d is not None:
                 self.__class__.get_v = d
+            v_fmt = MAP_ITEM_FORMATS.get(value_type, v_fmt)
+            self.value_deser = PY_DESERIALIZERS.get(value_type)
+        self.map_items_fmt = k_fmt + v_fmt
+
+    def __map_batch(self, keys, values):
+        mapper = self.context.mapper
+        if self.key_deser:
+            keys = [self.key_deser(_) for _ in keys]
+        if self.value_deser:
+            values = [self.value_deser(_) for _ in values]
+        mapper.map_batch(
+            self.context,
+            _to_batch(keys, mapper.use_numpy),
+            _to_batch(values, mapper.use_numpy),
+        )
+
+    def get_map_func(self):
+        """\
+        Return the callable that runs the mapper on the context's current
+        record: either the mapper's ``map`` method or, with map threads, a
+        :class:`~.threaded.MapDispatcher`. The latter is created on first
+        use, so that threads are started after map workers are forked.
+        """
+        context = self.context
+        if context._map_dispatcher:
+            return context._map_dispatcher
+        mapper = context.mapper
+        n = get_map_threads(mapper, context.job_conf, self.map_threads)
+        if n < 1 or isinstance(mapper, BatchMapper):
+            return mapper.map
+        context._map_dispatcher = MapDispatcher(
+            context, mapper, n, ordered=getattr(mapper, "ordered", True),
+            max_pending=getattr(mapper, "max_pending", None)
+        )
+        return context._map_dispatcher
+
+    def progress(self):
+        # map threads can use the context concurrently
+        if self.context._map_dispatcher:
+            self.context._map_dispatcher.progress()
+        else:
+            self.context.progress()
+
+    def __map_chunk(self, items):
+        # called in map workers
+        if isinstance(self.context.mapper, BatchMapper):
+            self.__map_batch(*zip(*items))
+        else:
+            map_func = self.get_map_func()
+            if self.timer:
+                map_func = self.timer.sampled(map_func, "map")
+            for k, v in items:
+                if self.key_deser:
+                    k = self.key_deser(k)
+                if self.value_deser:
+                    v = self.value_deser(v)
+                self.context._key, self.context._value = k, v
+                map_func(self.context)
+        self.progress()
+
+    def __get_chunk_size(self):
+        mapper = self.context.mapper
+        if isinstance(mapper, BatchMapper):
+            return mapper.batch_size
+        return CHUNK_SIZE
+
+    def start_map_workers(self):
+        """\
+        Fork the map workers, if requested. This is done right before
+        running the mapper, so that workers inherit the fully configured
+        context and deserializers.
+        """
+        n = self.map_workers
+        if n is None:
+            n = self.context.job_conf.get_int(MAP_WORKERS_KEY, 1)
+        if n > 1:
+            self.workers = MapWorkers(self.context, n, self.__map_chunk)
+            if self.timer:
+                for name in "submit", "close":
+                    setattr(self.workers, name, self.timer.timed(
+                        getattr(self.workers, name), "workers"
+                    ))
+
+    def run_map_workers(self):
+        """\
+        Handle a pending MAP_ITEM, plus all immediately following ones, by
+        sending them to the map workers.
+        """
+        n = self.__get_chunk_size()
+        # memoryviews can't be sent to other processes
+        fmt = self.map_items_fmt.replace("m", "b")
+        pending = True
+        while True:
+            items = self.read_map_items(n, fmt, 0, pending)
+            if not items:
+                break
+            self.workers.submit(items)
+            if len(items) < n:
+                break
+            pending = False
+
+    def run_map_batches(self):
+        """\
+        Handle a pending MAP_ITEM, plus all immediately following ones, with
+        a :class:`~.api.BatchMapper`.
+        """
+        n = self.context.mapper.batch_size
+        pending = True
+        while True:
+            items = self.read_map_items(n, self.map_items_fmt, 0, pending)
+            if not items:
+                break
+            self.__map_batch(*zip(*items))
+            if len(items) < n:
+                break
+            pending = False
+
+    def run_map_items(self):
+        """\
+        Handle a pending MAP_ITEM, plus all immediately following ones, with
+        the native map loop.
+        """
+        map_func = self.get_map_func()
+        args = (self.map_items_fmt, self.key_deser, self.value_deser)
+        if self.timer is None:
+            self.stream.run_map_items(self.context, map_func, *args)
+        else:
+            with self.timer.time_block("read"):
+                self.stream.run_map_items(
+                    self.context, self.timer.sampled(map_func, "map"), *args
+                )
+
+    def run_map_reader(self, reader):
+        mapper = self.context.mapper
+        records = reader
+        if self.timer:
+            records = self.timer.sampled_iter(reader, "record_reader")
+        if self.workers:
+            it = iter(records)
+            n = self.__get_chunk_size()
+            while True:
+                items = list(islice(it, n))
+                if not items:
+                    break
+                self.workers.submit(items)
+                self.context.progress_value = reader.get_progress()
+                self.progress()
+            self.workers.close()
+        elif isinstance(mapper, BatchMapper):
+            it = iter(records)
+            map_batch = mapper.map_batch
+            if self.timer:
+                map_batch = self.timer.timed(map_batch, "map")
+            while True:
+                items = list(islice(it, mapper.batch_size))
+                if not items:
+                    break
+                keys, values = zip(*items)
+                map_batch(
+                    self.context,
+                    _to_batch(keys, mapper.use_numpy),
+                    _to_batch(values, mapper.use_numpy),
+                )
+                self.context.progress_value = reader.get_progress()
+                self.progress()
+        else:
+            map_func = self.get_map_func()
+            if self.timer:
+                map_func = self.timer.sampled(map_func, "map")
+            for self.context._key, self.context._value in records:
+                map_func(self.context)
+                self.context.progress_value = reader.get_progress()
+                self.progress()
+
+    def run_reduce(self):
+        """\
+        Handle all commands following RUN_REDUCE.
+
+        For each REDUCE_KEY, the values in the following REDUCE_VALUE
+        commands are read and deserialized by a native iterator
+        (``FileInStream.reduce_values``), which is passed to the reducer
+        via the context. Any values not consumed by the reducer are skipped.
+        If :attr:`group_key` is set, the reducer gets a
+        :class:`GroupedValues` iterator instead.
+        """
+        reducer = self.context.reducer
+        reduce, reduce_batch = reducer.reduce, None
+        if isinstance(reducer, BatchReducer):
+            n, use_numpy = reducer.batch_size, reducer.use_numpy
+            reduce_batch = reducer.reduce_batch
+        else:
+            n = None
+        if self.timer:
+            reduce = self.timer.sampled(self.__reduce_sampled, "reduce")
+            if reduce_batch:
+                reduce_batch = self.timer.timed(reduce_batch, "reduce")
+        if self.context._private_encoding:
+            deser = self.context._codec.decode
+        else:
+            deser = None
+        keys, values, count = [], [], 0
+        pending = None  # command already read by a GroupedValues
+        while True:
+            if pending:
+                cmd, key = pending
+                pending = None
+            else:
+                cmd = self.stream.read_vint()
+                key = self.get_k() if cmd == REDUCE_KEY else None
+            if cmd == REDUCE_KEY:
+                self.context._key = key
+                if self.group_key is None:
+                    vit = self.stream.reduce_values("b", deser)
+                else:
+                    vit = GroupedValues(self, key, deser)
+                if n is None:
+                    self.context._values = vit
+                    reduce(self.context)
+                    vit.skip()
+                else:
+                    vs = _to_batch(list(vit), use_numpy)
+                    keys.append(key)
+                    values.append(vs)
+                    count += len(vs)
+                    if count >= n:
+                        reduce_batch(self.context, keys, values)
+                        keys, values, count = [], [], 0
+                if self.group_key is not None:
+                    pending = vit.cmd, vit.next_key
+            elif cmd == CLOSE:
+                try:
+                    if keys:
+                        reduce_batch(self.context, keys, values)
+                    self.context.close()
+                finally:
+                    raise StopIteration
+            elif cmd == ABORT:
+                raise RuntimeError("received ABORT command")
+            else:
+                raise RuntimeError("unexpected command: %d" % cmd)
 
     def __next__(self):
         cmd = self.stream.read_vint()
@@ -260,6 +716,10 @@ class Downlink(object):
                 raise RuntimeError("Unknown protocol id: %d" % v)
         elif cmd == SET_JOB_CONF:
             self.context._job_conf = self.read_job_conf()
+            self.context._setup_intermediate_codec()
+            self.context._setup_instrumentation()
+            if self.context._timer:
+                self.setup_timer(self.context._timer)
             if config.AVRO_OUTPUT in self.context.job_conf:
                 self.context._setup_avro_ser()
         elif cmd == RUN_MAP:
@@ -282,10 +742,8 @@ class Downlink(object):
             self.context.create_mapper()
             self.context.create_partitioner()
             if reader:
-                for self.context._key, self.context._value in reader:
-                    self.context.mapper.map(self.context)
-                    self.context.progress_value = reader.get_progress()
-                    self.context.progress()
+                self.start_map_workers()
+                self.run_map_reader(reader)
                 # no more commands from upstream, not even CLOSE
                 try:
                     self.context.close()
@@ -298,9 +756,14 @@ class Downlink(object):
             else:
                 self.setup_deser(key_type, value_type)
         elif cmd == MAP_ITEM:
-            self.context._key = self.get_k()
-            self.context._value = self.get_v()
-            self.context.mapper.map(self.context)
+            if self.workers is None:
+                self.start_map_workers()
+            if self.workers:
+                self.run_map_workers()
+            elif isinstance(self.context.mapper, BatchMapper):
+                self.run_map_batches()
+            else:
+                self.run_map_items()
         elif cmd == RUN_REDUCE:
             self.context.task_type = "r"
             part, piped_output = self.stream.read_tuple('ii')
@@ -308,35 +771,22 @@ class Downlink(object):
             self.context.create_reducer()
             self.setup_record_writer(piped_output)
             if self.context._private_encoding:
-                self.__class__.get_k = _get_pickled
-                self.__class__.get_v = _get_pickled
-            for cmd, subs in groupby(self, itemgetter(0)):
-                if cmd == REDUCE_KEY:
-                    _, self.context._key = next(subs)
-                if cmd == REDUCE_VALUE:
-                    self.context._values = (v for _, v in subs)
-                    self.context.reducer.reduce(self.context)
-                if cmd == CLOSE:
-                    try:
-                        self.context.close()
-                    finally:
-                        raise StopIteration
-        elif cmd == REDUCE_KEY:
-            k = self.get_k()
-            return cmd, k  # pass on to RUN_REDUCE iterator
-        elif cmd == REDUCE_VALUE:
-            v = self.get_v()
-            return cmd, v  # pass on to RUN_REDUCE iterator
+                self.__class__.get_k = _get_private
+            self.group_key = get_group_key(self.context)
+            if self.timer:
+                with self.timer.time_block("read"):
+                    self.run_reduce()
+            else:
+                self.run_reduce()
         elif cmd == ABORT:
             raise RuntimeError("received ABORT command")
         elif cmd == CLOSE:
-            if self.context.mapper:
-                try:
-                    self.context.close()
-                finally:
-                    raise StopIteration
-            else:
-                return cmd, None  # pass on to RUN_REDUCE iterator
+            try:
+                if self.workers:
+                    self.workers.close()
+                self.context.close()
+            finally:
+                raise StopIteration
         else:
             raise RuntimeError("unknown command: %d" % cmd)
 
@@ -373,6 +823,13 @@ class Uplink(object):
     def partitioned_output(self, part, k, v):
         self.stream.write_output(k, v, part)
 
+    def outputs(self, keys, values):
+        self.stream.write_outputs(keys, values)
+
+    def partitioned_outputs(self, parts, keys, values, num_partitions=0):
+        # parts can also be a sercore.Partitioner
+        self.stream.write_outputs(keys, values, parts, num_partitions)
+
     def status(self, msg):
         self.stream.write_tuple("is", (STATUS, msg))
 
@@ -21,11 +21,23 @@ Set up communication channels with the MapReduce framework.
 
 If "mapreduce.pipes.command.port" is in the env, this is a "real" Hadoop task:
 we have to connect to the given port and use the socket for live communication
-with the Java submitter.
-
-If the above env variable is not defined, but "mapreduce.pipes.commandfile"
-is, a pre-compiled binary file containing the entire command list from
-upstream is available at the specified (local) filesystem path.
+with the Java submitter. If "mapreduce.pipes.command.socket" is in the env,
+the Java side is listening on a Unix domain socket at the given path instead
+(this is enabled by setting "pydoop.mapreduce.pipes.unix.socket" to true in
+the job configuration). Finally, if "mapreduce.pipes.command.shm.downlink"
+and "mapreduce.pipes.command.shm.uplink" are both in the env, the Java side
+has created a pair of shared memory ring buffers at the given paths, to be
+used in place of the socket (enabled by setting "pydoop.mapreduce.pipes.shm"
+to true in the job configuration).
+
+If "pydoop.mapreduce.pipes.command.fd" is in the env, the connection to the
+Java side has already been set up (see :mod:`~pydoop.mapreduce.zygote`), and
+the given file descriptor refers to the connected socket.
+
+If none of the above env variables is defined, but
+"mapreduce.pipes.commandfile" is, a pre-compiled binary file containing the
+entire command list from upstream is available at the specified (local)
+filesystem path.
 """
 
 import os
@@ -34,6 +46,8 @@ import socket
 import pydoop.sercore as sercore
 from .binary_protocol import Downlink, Uplink
 
+FD_ENV = "pydoop.mapreduce.pipes.command.fd"
+
 
 class Connection(object):
     """\
@@ -70,20 +84,68 @@ class Connection(object):
 
 class NetworkConnection(Connection):
 
+    FAMILY = socket.AF_INET
+
     def __init__(self, context, host, port, **kwargs):
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.connect((host, port))
+        self._connect((host, port))
         istream = sercore.FileInStream(self.socket)
         ostream = sercore.FileOutStream(self.socket)
         super(NetworkConnection, self).__init__(
             context, istream, ostream, **kwargs
         )
 
+    def _connect(self, address):
+        self.socket = socket.socket(self.FAMILY, socket.SOCK_STREAM)
+        self.socket.connect(address)
+
     def close(self):
         super(NetworkConnection, self).close()
         self.socket.close()
 
 
+class UnixConnection(NetworkConnection):
+
+    FAMILY = getattr(socket, "AF_UNIX", None)
+
+    def __init__(self, context, path, **kwargs):
+        if self.FAMILY is None:
+            raise RuntimeError("Unix domain sockets not supported")
+        self._connect(path)
+        istream = sercore.FileInStream(self.socket)
+        ostream = sercore.FileOutStream(self.socket)
+        Connection.__init__(self, context, istream, ostream, **kwargs)
+
+
+class FdConnection(NetworkConnection):
+
+    def __init__(self, context, fd, **kwargs):
+        address = socket_address()
+        family = address[0] if address else socket.AF_INET
+        self.socket = socket.fromfd(fd, family, socket.SOCK_STREAM)
+        os.close(fd)  # fromfd makes a copy
+        istream = sercore.FileInStream(self.socket)
+        ostream = sercore.FileOutStream(self.socket)
+        Connection.__init__(self, context, istream, ostream, **kwargs)
+
+
+class ShmConnection(Connection):
+
+    def __init__(self, context, down_path, up_path, **kwargs):
+        self.rings = (
+            sercore.ShmRing(down_path, "r"), sercore.ShmRing(up_path, "w")
+        )
+        istream = sercore.FileInStream(self.rings[0])
+        ostream = sercore.FileOutStream(self.rings[1])
+        super(ShmConnection, self).__init__(
+            context, istream, ostream, **kwargs
+        )
+
+    def close(self):
+        super(ShmConnection, self).close()
+        for r in self.rings:
+            r.close()
+
+
 class FileConnection(Connection):
 
     def __init__(self, context, in_fn, out_fn, **kwargs):
@@ -94,7 +156,34 @@ class FileConnection(Connection):
         )
 
 
+def socket_address():
+    """\
+    Return the ``(family, address)`` of the socket the Java side is
+    listening on, or :obj:`None` if it's not using a socket.
+    """
+    if (os.getenv("mapreduce.pipes.command.shm.downlink") and
+            os.getenv("mapreduce.pipes.command.shm.uplink")):
+        return None
+    path = os.getenv("mapreduce.pipes.command.socket")
+    if path:
+        return UnixConnection.FAMILY, path
+    port = os.getenv("mapreduce.pipes.command.port")
+    if port:
+        return socket.AF_INET, ("localhost", int(port))
+    return None
+
+
 def get_connection(context, **kwargs):
+    fd = os.environ.pop(FD_ENV, None)  # can only be used once
+    if fd:
+        return FdConnection(context, int(fd), **kwargs)
+    down_path = os.getenv("mapreduce.pipes.command.shm.downlink")
+    up_path = os.getenv("mapreduce.pipes.command.shm.uplink")
+    if down_path and up_path:
+        return ShmConnection(context, down_path, up_path, **kwargs)
+    path = os.getenv("mapreduce.pipes.command.socket")
+    if path:
+        return UnixConnection(context, path, **kwargs)
     port = os.getenv("mapreduce.pipes.command.port")
     if port:
         return NetworkConnection(context, "localhost", int(port), **kwargs)
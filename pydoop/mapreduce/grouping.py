@@ -0,0 +1,117 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+"""\
+Secondary sort: reduce values grouped by a key prefix, in key order.
+
+To get the values for a "natural" key in a given order (e.g., events by
+timestamp), emit composite keys that start with the natural key, followed
+by the fields that determine the order, and set the number of leading key
+fields that form the natural key (the *grouping prefix*) in the
+``pydoop.mapreduce.grouping.fields`` job conf property (``pydoop submit
+--group-fields N``). Then:
+
+* the framework sorts map output keys on the Java side, so the reducer
+  gets all keys with the same prefix next to each other, ordered by the
+  remaining fields;
+* unless a different partitioner is set, map output keys are partitioned
+  by their prefix with :class:`~.partitioners.KeyFieldPartitioner`;
+* the reducer is called once for each distinct prefix, with
+  :attr:`~.api.Context.key` set to the first key with that prefix, while
+  :attr:`~.api.Context.values` streams the values for all keys with that
+  prefix, in key order. The full key of the values being read is available
+  as ``context.values.key``.
+
+Values are never loaded into memory all at once, so there is no need to
+sort them in the reducer.
+
+Keys can be in one of two formats (as for
+:class:`~.partitioners.KeyFieldPartitioner`):
+
+* with private encoding and the ``"ordered"`` intermediate codec, keys are
+  tuples (the prefix consists of their first N items). The codec preserves
+  the order of keys, so the Java default byte-wise sort does the rest
+  (``pydoop submit --group-fields N`` sets the codec to ``"ordered"``);
+* otherwise, keys are text, with fields separated by the value of
+  ``mapreduce.map.output.key.field.separator`` (default: tab). In this
+  case, Java must compare the prefix as a whole before the rest of the key:
+  see :func:`java_properties` (applied automatically by ``pydoop submit
+  --group-fields N --group-key-format text``).
+
+Note that grouping on the Java side is left on the full key, so that the
+reducer can see every key: consecutive keys with the same prefix are
+merged into a single group by the Python side.
+"""
+
+import pydoop.mapreduce.partitioners as partitioners
+
+GROUPING_FIELDS_KEY = "pydoop.mapreduce.grouping.fields"
+KEY_COMPARATOR_KEY = "mapreduce.job.output.key.comparator.class"
+KEY_COMPARATOR_OPTIONS_KEY = "mapreduce.partition.keycomparator.options"
+KEY_FIELD_COMPARATOR = (
+    "org.apache.hadoop.mapreduce.lib.partition.KeyFieldBasedComparator"
+)
+
+
+def get_grouping_fields(job_conf):
+    """\
+    Return the length of the grouping prefix set in ``job_conf``, or 0 if
+    secondary sort is not enabled.
+    """
+    n = job_conf.get_int(GROUPING_FIELDS_KEY, 0)
+    if n < 0:
+        raise ValueError("%s must be non-negative" % GROUPING_FIELDS_KEY)
+    return n
+
+
+def get_group_key(context):
+    """\
+    Return a function that computes the grouping prefix of keys read by
+    ``context``, or :obj:`None` if secondary sort is not enabled. Two
+    reduce keys belong to the same group if the function returns equal
+    values for them.
+    """
+    n = get_grouping_fields(context.job_conf)
+    if not n:
+        return None
+    sep = partitioners.get_separator(context)
+    if sep is None:
+        def group_key(key):
+            return key[:n] if isinstance(key, tuple) else key
+    else:
+        sep = sep.encode("utf-8")
+
+        def group_key(key):
+            return key.split(sep, n)[:n]
+    return group_key
+
+
+def java_properties(fields, separator=None):
+    """\
+    Return the Java job conf properties that sort text keys by their first
+    ``fields`` fields (as a single string) first, and by the rest of the
+    key next. ``separator`` defaults to tab.
+    """
+    props = {
+        GROUPING_FIELDS_KEY: str(fields),
+        KEY_COMPARATOR_KEY: KEY_FIELD_COMPARATOR,
+        KEY_COMPARATOR_OPTIONS_KEY: "-k1,%d -k%d" % (fields, fields + 1),
+    }
+    if separator is not None:
+        props[partitioners.SEPARATOR_KEY] = separator
+    return props
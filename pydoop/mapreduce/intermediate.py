@@ -0,0 +1,116 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+"""\
+Codecs for intermediate (map output / reduce input) keys and values.
+
+With private encoding (see :func:`~pydoop.mapreduce.pipes.run_task`), map
+output keys and values are serialized by the framework before being sent to
+the Java side, and deserialized before being passed to the reducer. The codec
+used for this can be selected with the ``intermediate_codec`` argument of
+``run_task`` or, with lower precedence, with the
+``pydoop.mapreduce.pipes.intermediate.codec`` job conf property. Built-in
+codecs are:
+
+* ``"pickle"`` (default): :class:`PickleCodec`
+* ``"ordered"``: :class:`OrderedCodec`
+
+Custom codecs can be passed to ``run_task`` as :class:`Codec` instances.
+"""
+
+from abc import abstractmethod
+
+import pydoop.sercore as sercore
+from pydoop.utils.py3compat import ABC, pickle
+
+
+class Codec(ABC):
+    """\
+    Converts intermediate keys and values to and from bytes.
+
+    The encoding of keys is used by the framework to group (byte-wise
+    equality) and sort (byte-wise comparison) them, so equal keys must be
+    encoded to equal byte strings.
+    """
+
+    @abstractmethod
+    def encode(self, obj):
+        """\
+        Serialize ``obj`` to a byte string.
+        """
+        pass
+
+    @abstractmethod
+    def decode(self, data):
+        """\
+        Deserialize ``data`` (a byte string) to an object.
+        """
+        pass
+
+
+class PickleCodec(Codec):
+    """\
+    Serialize everything with pickle.
+
+    Supports any picklable object, but the sort order of keys seen by the
+    reducer is unrelated to their Python order.
+    """
+
+    def encode(self, obj):
+        return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+    decode = staticmethod(pickle.loads)
+
+
+class OrderedCodec(Codec):
+    """\
+    Fast, order-preserving encoding for common types.
+
+    Objects of type :class:`bytes`, :class:`str` (:class:`unicode` in Python
+    2), :class:`int` and :class:`float`, and tuples of them (including nested
+    tuples), are encoded so that the byte-wise order of the encoded keys is
+    the same as the Python order of the original ones. This means that the
+    reducer sees keys in sorted order, and that a :class:`~.api.Partitioner`
+    that splits the encoded key space into ranges produces sorted output
+    partitions. Any other object is pickled.
+
+    Keys of different types (e.g., :class:`int` and :class:`float`) are
+    ordered by type first, and :obj:`-0.0` is decoded as :obj:`0.0`.
+    """
+
+    encode = staticmethod(sercore.ordered_encode)
+    decode = staticmethod(sercore.ordered_decode)
+
+
+CODECS = {
+    "pickle": PickleCodec,
+    "ordered": OrderedCodec,
+}
+
+
+def get_codec(spec):
+    """\
+    Return the codec corresponding to ``spec``, which can be either a
+    :class:`Codec` instance or the name of a built-in codec.
+    """
+    if isinstance(spec, Codec):
+        return spec
+    try:
+        return CODECS[spec]()
+    except (KeyError, TypeError):
+        raise ValueError("unknown intermediate codec: %r" % (spec,))
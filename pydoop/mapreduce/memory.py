@@ -0,0 +1,149 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+"""\
+Memory usage estimates for the map-side combiner cache.
+
+:func:`sys.getsizeof` only measures the outermost object, so it misses the
+contents of containers (e.g., the values stored in a per-key list, or the
+items of tuple keys). Measuring everything on each emit would be too slow,
+so the task context keeps a cheap running sum of :func:`sys.getsizeof` and,
+from time to time, compares it with an estimate of the actual footprint
+computed by :func:`cache_sizeof` on a sample of the cache. See
+:class:`CacheMeter`.
+"""
+
+import os
+from itertools import islice
+from sys import getsizeof as sizeof
+
+from pydoop.utils.py3compat import bintype, unicode
+
+# types whose size does not depend on referenced objects
+_ATOMIC_TYPES = (bintype, unicode, str, int, float, bool, type(None))
+try:
+    _ATOMIC_TYPES += (long,)
+except NameError:
+    pass
+_SEQUENCE_TYPES = (tuple, list, set, frozenset)
+
+#: max number of items measured per container / cache
+SAMPLE_SIZE = 100
+
+
+def deep_sizeof(obj, sample_size=SAMPLE_SIZE):
+    """\
+    Estimate the memory used by ``obj``, including the objects it contains.
+
+    Lists, tuples, sets and dicts are traversed recursively (instance
+    attributes are not); for containers with more than ``sample_size``
+    items, the size of the contents is extrapolated from the first
+    ``sample_size`` ones. Objects referenced more than once are counted
+    each time, so the result is an upper bound if there is a lot of sharing.
+    """
+    size = sizeof(obj)
+    if isinstance(obj, _ATOMIC_TYPES):
+        return size
+    if isinstance(obj, dict):
+        n = len(obj)
+        items = [deep_sizeof(k, sample_size) + deep_sizeof(v, sample_size)
+                 for k, v in islice(obj.items(), sample_size)]
+    elif isinstance(obj, _SEQUENCE_TYPES):
+        n = len(obj)
+        items = [deep_sizeof(_, sample_size) for _ in islice(obj, sample_size)]
+    else:
+        return size
+    if not items:
+        return size
+    return size + sum(items) * n // len(items)
+
+
+def cache_sizeof(cache, sample_size=SAMPLE_SIZE):
+    """\
+    Estimate the memory used by ``cache``, a dictionary (e.g., mapping keys
+    to lists of values), from the deep size of up to ``sample_size`` of its
+    items, evenly spaced in iteration (i.e., insertion) order.
+    """
+    n = len(cache)
+    step = max(1, n // sample_size)
+    items = [deep_sizeof(k) + deep_sizeof(v)
+             for k, v in islice(cache.items(), 0, None, step)]
+    if not items:
+        return sizeof(cache)
+    return sizeof(cache) + sum(items) * n // len(items)
+
+
+def get_rss():
+    """\
+    Return the resident set size of the current process in bytes, or
+    :obj:`None` if it's not available (only supported on Linux).
+    """
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            pages = int(f.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+class CacheMeter(object):
+    """\
+    Decides when the combiner cache must be spilled.
+
+    The caller keeps a running sum of :func:`sys.getsizeof` for emitted keys
+    and values (the "shallow" size) and calls :meth:`check` when it reaches
+    :attr:`next_check`. The meter then estimates the actual footprint of the
+    cache with :func:`cache_sizeof`, uses the ratio between the two to
+    convert the remaining room into shallow size units, and sets the next
+    check point halfway through it. Thus, the cache can grow close to
+    ``limit`` with only a few (logarithmic) full estimates.
+
+    If ``rss_limit`` is set, a spill is also requested when the resident
+    set size of the process exceeds it.
+    """
+
+    #: min shallow size increment between checks
+    MIN_STEP = 64 * 1024
+
+    def __init__(self, limit, rss_limit=None, sample_size=SAMPLE_SIZE):
+        self.limit = limit
+        self.rss_limit = rss_limit
+        self.sample_size = sample_size
+        self.estimate = 0
+        self.reset()
+
+    def reset(self):
+        """\
+        Start over with an empty cache.
+        """
+        self.next_check = min(self.limit, self.MIN_STEP)
+
+    def check(self, cache, shallow_size):
+        """\
+        Return :obj:`True` if the cache must be spilled.
+        """
+        self.estimate = est = cache_sizeof(cache, self.sample_size)
+        if est >= self.limit:
+            return True
+        if self.rss_limit:
+            rss = get_rss()
+            if rss is not None and rss >= self.rss_limit:
+                return True
+        room = (self.limit - est) * shallow_size // max(est, 1)
+        self.next_check = shallow_size + max(room // 2, self.MIN_STEP)
+        return False
@@ -0,0 +1,232 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+"""\
+Built-in partitioners, implemented in C.
+
+A :class:`~.api.Partitioner` written in Python is called once for each map
+output record. The partitioners defined here can be used in the same way
+(e.g., ``Factory(Mapper, partitioner_class=KeyFieldPartitioner)``), but
+partitions are computed without running any Python code: with a batch size
+greater than 1 (see ``emit_batch_size`` in
+:func:`~pydoop.mapreduce.pipes.run_task`), they are computed by the same
+call that serializes the output batch.
+
+Partitioners work on serialized keys. The ones that look at individual key
+fields support two formats:
+
+* with private encoding and the ``"ordered"`` intermediate codec (see
+  :mod:`pydoop.mapreduce.intermediate`), keys are tuples and fields are
+  their items (a key that is not a tuple has a single field);
+* otherwise, keys are text, with fields separated by the value of
+  ``mapreduce.map.output.key.field.separator`` (default: tab).
+
+Fields are numbered from 0. Field ranges can be set either as constructor
+arguments, or via job conf properties.
+
+:class:`TotalOrderPartitioner` sends keys to reducers according to split
+points read from a partition file, so that the concatenation of all reduce
+outputs is sorted. The partition file is usually created by sampling the
+input with :mod:`pydoop.mapreduce.sampler`.
+"""
+
+import struct
+
+import pydoop.sercore as sercore
+import pydoop.mapreduce.api as api
+from pydoop.mapreduce.intermediate import OrderedCodec
+
+FIELDS_KEY = "pydoop.mapreduce.partitioner.fields"
+RANGE_FIELD_KEY = "pydoop.mapreduce.partitioner.range.field"
+RANGE_SPLITS_KEY = "pydoop.mapreduce.partitioner.range.splits"
+SEPARATOR_KEY = "mapreduce.map.output.key.field.separator"
+PARTITION_FILE_KEY = "pydoop.mapreduce.partitioner.total.order.path"
+
+_INT_FMT = ">i"
+_INT_SIZE = struct.calcsize(_INT_FMT)
+
+
+def write_partition_file(split_points, f):
+    """\
+    Write ``split_points`` (a sorted sequence of serialized keys) to the
+    file object ``f``: the number of keys, followed by each key as a length
+    and the key bytes (all lengths are big-endian 32-bit integers).
+    """
+    f.write(struct.pack(_INT_FMT, len(split_points)))
+    for k in split_points:
+        f.write(struct.pack(_INT_FMT, len(k)))
+        f.write(k)
+
+
+def read_partition_file(f):
+    """\
+    Read split points written by :func:`write_partition_file`.
+    """
+    def read(n):
+        buf = f.read(n)
+        if len(buf) < n:
+            raise RuntimeError("truncated partition file")
+        return buf
+
+    def read_int():
+        return struct.unpack(_INT_FMT, read(_INT_SIZE))[0]
+
+    return [read(read_int()) for _ in range(read_int())]
+
+
+def get_separator(context):
+    """\
+    Return the field separator for keys emitted by ``context``, or
+    :obj:`None` if keys are encoded with the ordered codec.
+    """
+    if getattr(context, "_private_encoding", False):
+        if not isinstance(getattr(context, "_codec", None), OrderedCodec):
+            raise ValueError(
+                "key fields are only supported for the ordered codec"
+            )
+        return None
+    return context.job_conf.get(SEPARATOR_KEY, "\t")
+
+
+def parse_fields(spec):
+    """\
+    Convert a field range spec to a ``(start, stop)`` tuple. The spec can
+    be a single field (e.g., ``"1"``) or a slice (e.g., ``"0:2"`` or
+    ``"1:"``).
+    """
+    try:
+        start, stop = spec.split(":", 1)
+    except ValueError:
+        start = int(spec)
+        return start, start + 1
+    return int(start or 0), (int(stop) if stop else None)
+
+
+class NativePartitioner(api.Partitioner):
+    """\
+    Base class for partitioners implemented by a
+    :class:`pydoop.sercore.Partitioner` (:attr:`native`), which the task
+    context calls directly.
+    """
+
+    def __init__(self, context, native):
+        super(NativePartitioner, self).__init__(context)
+        self.native = native
+        self.partition = native.partition  # skip the method below
+
+    def partition(self, key, num_of_reduces):
+        return self.native.partition(key, num_of_reduces)
+
+
+class HashPartitioner(NativePartitioner):
+    """\
+    Partition by the hash of the whole serialized key, computed like
+    Hadoop's ``HashPartitioner`` does for ``Text`` and ``BytesWritable``
+    keys.
+    """
+
+    def __init__(self, context):
+        super(HashPartitioner, self).__init__(context, sercore.Partitioner())
+
+
+class KeyFieldPartitioner(NativePartitioner):
+    """\
+    Partition by the hash of the key fields in ``[start, stop)``, where
+    ``fields`` is either a ``(start, stop)`` tuple (``stop`` can be
+    :obj:`None`) or a string in the format accepted by
+    :func:`parse_fields`. By default, ``fields`` is read from the
+    ``pydoop.mapreduce.partitioner.fields`` job conf property and, if that
+    is not set, only the first field is used.
+
+    This is useful with composite keys, e.g., to make sure that all keys
+    with the same first item go to the same reducer. For text keys, the
+    result is the same as Hadoop's ``KeyFieldBasedPartitioner`` with
+    ``-k<start + 1>,<stop>``.
+    """
+
+    def __init__(self, context, fields=None):
+        if fields is None:
+            fields = context.job_conf.get(FIELDS_KEY, "0")
+        start, stop = parse_fields(fields) if hasattr(fields, "split") \
+            else fields
+        kwargs = {"start": start, "separator": get_separator(context)}
+        if stop is not None:
+            kwargs["stop"] = stop
+        super(KeyFieldPartitioner, self).__init__(
+            context, sercore.Partitioner("fields", **kwargs)
+        )
+
+
+class RangePartitioner(NativePartitioner):
+    """\
+    Partition by the numeric value of a key field: keys lower than
+    ``splits[0]`` go to partition 0, keys greater than or equal to
+    ``splits[i - 1]`` and lower than ``splits[i]`` go to partition ``i``,
+    and so on (if there are fewer reducers than intervals, the last one
+    gets all the rest). ``splits`` must be sorted.
+
+    By default, ``field`` and ``splits`` are read from the
+    ``pydoop.mapreduce.partitioner.range.field`` (default: 0) and
+    ``pydoop.mapreduce.partitioner.range.splits`` (comma-separated numbers)
+    job conf properties. The field must be an :class:`int` or
+    :class:`float` for ordered keys, and a valid number for text keys.
+    """
+
+    def __init__(self, context, splits=None, field=None):
+        jc = context.job_conf
+        if field is None:
+            field = jc.get_int(RANGE_FIELD_KEY, 0)
+        if splits is None:
+            splits = [float(_) for _ in jc.get(RANGE_SPLITS_KEY, "").split(",")
+                      if _.strip()]
+        super(RangePartitioner, self).__init__(context, sercore.Partitioner(
+            "range", start=field, separator=get_separator(context),
+            splits=splits
+        ))
+
+
+class TotalOrderPartitioner(NativePartitioner):
+    """\
+    Partition by comparing (byte-wise) the serialized key to a sorted list
+    of split points, which is read from ``path`` once per task: keys lower
+    than the first split point go to partition 0, keys between the first
+    (included) and the second (excluded) go to partition 1, and so on. Since
+    the ordered codec and utf-8 text preserve the order of keys, each
+    reducer gets a contiguous key range, and the reduce outputs, taken in
+    order, are globally sorted.
+
+    By default, ``path`` is read from the
+    ``pydoop.mapreduce.partitioner.total.order.path`` job conf property
+    (set automatically by ``pydoop submit --sample-partitions``). There
+    should be one split point less than the number of reducers: with fewer
+    split points, the last reducers get no data, while any extra ones are
+    ignored (all keys beyond the last usable split point go to the last
+    reducer).
+    """
+
+    def __init__(self, context, path=None):
+        import pydoop.hdfs as hdfs
+        if path is None:
+            path = context.job_conf.get(PARTITION_FILE_KEY)
+            if not path:
+                raise RuntimeError("%s not set" % PARTITION_FILE_KEY)
+        with hdfs.open(path, "rb") as f:
+            self.split_points = read_partition_file(f)
+        super(TotalOrderPartitioner, self).__init__(
+            context, sercore.Partitioner("order", splits=self.split_points)
+        )
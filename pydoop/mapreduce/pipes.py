@@ -24,24 +24,25 @@ The intended usage is to import this module in the executable script passed to
 appropriate arguments (see the docs and examples for further details).
 """
 
-import base64
-import hashlib
-import hmac
 import io
 import os
 import struct
+import threading
 
 try:
     from cPickle import dumps, loads, HIGHEST_PROTOCOL
 except ImportError:
     from pickle import dumps, loads, HIGHEST_PROTOCOL
-from time import time
+from operator import itemgetter
 from sys import getsizeof as sizeof
 
 import pydoop.config as config
 import pydoop.sercore as sercore
 
-from . import api, connections
+from . import (
+    api, connections, grouping, intermediate, memory, partitioners, spill
+)
+from .binary_protocol import register_deserializer  # noqa: F401
 
 # py2 compat
 try:
@@ -54,12 +55,26 @@ PSTATS_FMT = "PYDOOP_PSTATS_FMT"
 DEFAULT_PSTATS_FMT = "%s_%05d_%s"  # task_type, task_id, random suffix
 
 EXTERNALSPLITS_URI_KEY = "pydoop.mapreduce.pipes.externalsplits.uri"
+INTERMEDIATE_CODEC_KEY = "pydoop.mapreduce.pipes.intermediate.codec"
+DEFAULT_INTERMEDIATE_CODEC = "pickle"
+COMBINER_RSS_FRACTION_KEY = "pydoop.mapreduce.pipes.combiner.rss.fraction"
+COMBINER_LOCAL_SPILL_KEY = "pydoop.mapreduce.pipes.combiner.local.spill"
+COMBINER_COUNTER_GROUP = "PYDOOP_COMBINER"
+INSTRUMENT_KEY = "pydoop.mapreduce.pipes.instrument"
+INSTRUMENT_SAMPLE_KEY = "pydoop.mapreduce.pipes.instrument.sample"
+INSTRUMENT_DIR_KEY = "pydoop.mapreduce.pipes.instrument.dir"
+DEFAULT_INSTRUMENT_SAMPLE = 100
+PHASE_COUNTER_GROUP = "PYDOOP_PHASES"
+PROGRESS_INTERVAL = 1.0  # seconds between progress reports
 
 INT_WRITABLE_FMT = ">i"
 INT_WRITABLE_SIZE = struct.calcsize(INT_WRITABLE_FMT)
 
 
 def create_digest(key, msg):
+    import base64
+    import hashlib
+    import hmac
     h = hmac.new(key, msg, hashlib.sha1)
     return base64.b64encode(h.digest())
 
@@ -122,6 +137,32 @@ def read_opaque_splits(f):
     return [OpaqueSplit.read(f) for _ in range(n)]
 
 
+class Heartbeat(object):
+    """\
+    Sets :attr:`beat` to :obj:`True` every ``interval`` seconds, from a
+    background thread.
+
+    Checking the flag is much cheaper than reading the clock, which matters
+    for code that runs once per record (see :meth:`TaskContext.progress`).
+    The flag is only set in the background: the consumer must clear it.
+    """
+
+    def __init__(self, interval):
+        self.beat = True
+        self.interval = interval
+        self.__stop = threading.Event()
+        t = threading.Thread(target=self.__run)
+        t.daemon = True
+        t.start()
+
+    def __run(self):
+        while not self.__stop.wait(self.interval):
+            self.beat = True
+
+    def stop(self):
+        self.__stop.set()
+
+
 class TaskContext(api.Context):
 
     JOB_OUTPUT_DIR = "mapreduce.output.fileoutputformat.outputdir"
@@ -134,18 +175,24 @@ class TaskContext(api.Context):
         self.combiner = None
         self.mapper = None
         self.partitioner = None
+        self.__native_partitioner = None
         self.record_reader = None
         self.record_writer = None
         self.reducer = None
         self.nred = None
         self.progress_value = 0.0
-        self.last_progress_t = 0.0
         self.status = None
-        self.counters = {}
+        self.counters = []  # unreported amounts, by counter id
+        self.__dirty_counters = []  # ids of counters with nonzero amounts
+        self.__heartbeat = None  # started by the first progress call
         self.task_type = None
         self.avro_key_serializer = None
         self.avro_value_serializer = None
         self._private_encoding = kwargs.get("private_encoding", True)
+        self.__codec_spec = kwargs.get("intermediate_codec")
+        self._codec = intermediate.get_codec(
+            self.__codec_spec or DEFAULT_INTERMEDIATE_CODEC
+        )
         self._raw_split = None
         self._input_split = None
         self._job_conf = {}
@@ -157,6 +204,20 @@ class TaskContext(api.Context):
         self.__cache_size = 0
         self.__spill_size = None  # delayed until (if) create_combiner
         self.__spilling = True  # enable actual emit
+        self.__aggregating = False  # AggregatingCombiner mode
+        self.__meter = None
+        self.__combiner_counters = None
+        self.__local_spill = kwargs.get("local_spill")
+        self.__runs = None  # on-disk runs, created on first local spill
+        self.__capture = None  # collects combiner output for local spills
+        self.__emit_batch_size = kwargs.get("emit_batch_size", 1)
+        self.__out_keys = []
+        self.__out_values = []
+        self.__out_parts = []
+        self._map_dispatcher = None  # set by the downlink for map threads
+        self.__instrument = kwargs.get("instrument")
+        self.__instrument_sample = kwargs.get("instrument_sample")
+        self._timer = None  # see _setup_instrumentation
 
     def get_input_split(self, raw=False):
         if raw:
@@ -187,14 +248,73 @@ class TaskContext(api.Context):
                 "mapreduce.task.io.sort.mb", 100
             )
             self.__spilling = False
+            self.__aggregating = isinstance(
+                self.combiner, api.AggregatingCombiner
+            )
+            self.__meter = memory.CacheMeter(
+                self.__spill_size, rss_limit=self.__get_rss_limit()
+            )
+            self.__combiner_counters = [
+                self.get_counter(COMBINER_COUNTER_GROUP, _)
+                for _ in ("SPILLS", "SPILLED_KEYS", "SPILLED_BYTES")
+            ]
+            if self.__local_spill is None:
+                self.__local_spill = self.job_conf.get_bool(
+                    COMBINER_LOCAL_SPILL_KEY, False
+                )
+            if self._timer:
+                self.emit = self._timer.nested(self.emit, "combine")
         return self.combiner
 
+    def _setup_map_worker(self, uplink, num_workers):
+        """\
+        Prepare this context (a copy inherited by a forked map worker) to
+        run the mapper as one of ``num_workers`` workers, sending all
+        output to ``uplink``.
+
+        The record reader is owned by the driver, which reads input records
+        and closes it: it's removed from the worker's context, so that only
+        the mapper and combiner are closed by the worker.
+        """
+        self.uplink = uplink
+        self.record_reader = None
+        # unreported amounts belong to the driver; threads are not inherited
+        self.counters = [0] * len(self.counters)
+        del self.__dirty_counters[:]
+        self.__heartbeat = None
+        if self._timer:
+            self._timer.reset()
+            self.__time_uplink()
+        if self.__meter:
+            rss_limit = self.__meter.rss_limit
+            self.__spill_size //= num_workers
+            self.__meter = memory.CacheMeter(
+                self.__spill_size,
+                rss_limit=rss_limit and rss_limit // (num_workers + 1)
+            )
+
+    def __get_rss_limit(self):
+        fraction = self.job_conf.get_float(COMBINER_RSS_FRACTION_KEY, 0.0)
+        if fraction <= 0:
+            return None
+        container_mb = self.job_conf.get_int("mapreduce.map.memory.mb", 1024)
+        return int(fraction * container_mb * 1024 * 1024)
+
     def create_mapper(self):
         self.mapper = self.factory.create_mapper(self)
         return self.mapper
 
     def create_partitioner(self):
         self.partitioner = self.factory.create_partitioner(self)
+        if self.partitioner is None and self.nred > 1:
+            # secondary sort: keep keys with the same prefix together
+            n = grouping.get_grouping_fields(self.job_conf)
+            if n:
+                self.partitioner = partitioners.KeyFieldPartitioner(
+                    self, (0, n)
+                )
+        if isinstance(self.partitioner, partitioners.NativePartitioner):
+            self.__native_partitioner = self.partitioner.native
         return self.partitioner
 
     def create_record_reader(self):
@@ -203,6 +323,12 @@ class TaskContext(api.Context):
 
     def create_record_writer(self):
         self.record_writer = self.factory.create_record_writer(self)
+        if self.record_writer:
+            self.__write_record = self.record_writer.emit
+            if self._timer:
+                self.__write_record = self._timer.nested(
+                    self.__write_record, "record_writer"
+                )
         return self.record_writer
 
     def create_reducer(self):
@@ -215,13 +341,18 @@ class TaskContext(api.Context):
 
         This needs to flush the uplink stream, but too many flushes can
         disrupt performance, so we actually talk to upstream once per second.
+        Since this is called for every output record, the time is not read
+        here: a :class:`Heartbeat` thread sets a flag when a report is due.
         """
-        now = time()
-        if now - self.last_progress_t > 1:
-            self.last_progress_t = now
+        heartbeat = self.__heartbeat
+        if heartbeat is None:
+            heartbeat = self.__heartbeat = Heartbeat(PROGRESS_INTERVAL)
+        if heartbeat.beat:
+            heartbeat.beat = False
             if self.status:
                 self.uplink.status(self.status)
                 self.status = None
+            self.__flush_outputs()
             self.__spill_counters()
             self.uplink.progress(self.progress_value)
             self.uplink.flush()
@@ -231,23 +362,39 @@ class TaskContext(api.Context):
         self.progress()
 
     def get_counter(self, group, name):
+        """\
+        Register a new counter and return its id.
+
+        The registration is not flushed: it's buffered in the uplink stream
+        and sent along with the next progress report, so registering many
+        counters costs a single flush.
+        """
         id = len(self.counters)
         self.uplink.register_counter(id, group, name)
-        self.uplink.flush()
-        self.counters[id] = 0
+        self.counters.append(0)
         return id
 
     def increment_counter(self, counter, amount):
         try:
-            self.counters[counter] += amount
-        except KeyError:
+            old = self.counters[counter] if counter >= 0 else None
+        except (IndexError, TypeError):
+            old = None
+        if old is None:
             raise ValueError("invalid counter: %r" % (counter,))
+        if not old:
+            self.__dirty_counters.append(counter)
+        self.counters[counter] = old + amount
 
     def __spill_counters(self):
-        for c, amount in self.counters.items():
+        # only counters incremented since the last spill are visited (some
+        # more than once, if their amount went back to zero in between)
+        counters = self.counters
+        for c in self.__dirty_counters:
+            amount = counters[c]
             if amount:
                 self.uplink.increment_counter(c, amount)
-                self.counters[c] = 0
+                counters[c] = 0
+        del self.__dirty_counters[:]
 
     def _authenticate(self, password, digest, challenge):
         if create_digest(password, challenge) != digest:
@@ -272,9 +419,50 @@ class TaskContext(api.Context):
             schema = jc.get(config.AVRO_VALUE_OUTPUT_SCHEMA)
             self.avro_value_serializer = AvroSerializer(schema)
 
+    def _setup_intermediate_codec(self):
+        # run_task arg has precedence over job conf
+        spec = self.job_conf.get(INTERMEDIATE_CODEC_KEY)
+        if self.__codec_spec is None and spec:
+            self._codec = intermediate.get_codec(spec)
+
+    def _setup_instrumentation(self):
+        """\
+        If requested, create a :class:`~pydoop.utils.misc.PhaseTimer`
+        (:attr:`_timer`) and use it to time serialization, uplink writes,
+        combiner spills and record writer calls (the downlink times its own
+        phases). Methods are replaced by their timed versions on the
+        instance, so that there is no overhead without instrumentation.
+        """
+        instrument = self.__instrument
+        if instrument is None:
+            instrument = self.job_conf.get_bool(INSTRUMENT_KEY, False)
+        if not instrument:
+            return
+        from pydoop.utils.misc import PhaseTimer
+        sample = self.__instrument_sample
+        if sample is None:
+            sample = self.job_conf.get_int(
+                INSTRUMENT_SAMPLE_KEY, DEFAULT_INSTRUMENT_SAMPLE
+            )
+        timer = self._timer = PhaseTimer(self, PHASE_COUNTER_GROUP, sample)
+        self.__maybe_serialize = timer.nested(
+            self.__maybe_serialize, "serialize"
+        )
+        self.__spill_all = timer.timed(self.__spill_all, "spill")
+        self.__merge_runs = timer.timed(self.__merge_runs, "spill")
+        self.close = timer.timed(self.close, timer.OTHER)
+        self.__time_uplink()
+
+    def __time_uplink(self):
+        timer, uplink = self._timer, self.uplink
+        for name in ("output", "partitioned_output", "outputs",
+                     "partitioned_outputs"):
+            setattr(uplink, name, timer.nested(getattr(uplink, name), "write"))
+        uplink.flush = timer.timed(uplink.flush, "write")
+
     def __maybe_serialize(self, key, value):
         if self.task_type == "m" and self._private_encoding:
-            return dumps(key, HIGHEST_PROTOCOL), dumps(value, HIGHEST_PROTOCOL)
+            return self._codec.encode(key), self._codec.encode(value)
         if self.avro_key_serializer:
             key = self.avro_key_serializer.serialize(key)
         elif self.__auto_serialize:
@@ -300,43 +488,180 @@ class TaskContext(api.Context):
         """
         if self.__spilling:
             self.__actual_emit(key, value)
+        elif self.__capture is not None:
+            self.__capture.append((key, value))
+        elif self.__aggregating:
+            # key must be hashable
+            try:
+                acc = self.__cache[key]
+            except KeyError:
+                self.__cache[key] = self.combiner.initial(value)
+            else:
+                self.__cache[key] = self.combiner.combine(acc, value)
+            self.__cache_size += sizeof(key) + sizeof(value)
+            if self.__cache_size >= self.__meter.next_check:
+                self.__check_cache()
         else:
             # key must be hashable
             self.__cache.setdefault(key, []).append(value)
             self.__cache_size += sizeof(key) + sizeof(value)
-            if self.__cache_size >= self.__spill_size:
-                self.__spill_all()
+            if self.__cache_size >= self.__meter.next_check:
+                self.__check_cache()
+        self.progress()
+
+    def __check_cache(self):
+        # self.__cache_size is just a running sum of sys.getsizeof: the
+        # actual footprint is estimated, from time to time, by the meter
+        if self.__meter.check(self.__cache, self.__cache_size):
+            self.__spill_all()
+
+    def emit_batch(self, keys, values):
+        """\
+        Handle multiple output key/value pairs.
+
+        If output goes straight to the uplink (no caching combiner, no Python
+        record writer), all pairs are serialized and sent with a single call.
+        """
+        if not self.__spilling or self.record_writer:
+            for k, v in zip(keys, values):
+                self.emit(k, v)
+            return
+        self.__flush_outputs()  # preserve ordering wrt single emits
+        out_keys, out_values = [], []
+        for k, v in zip(keys, values):
+            k, v = self.__maybe_serialize(k, v)
+            out_keys.append(k)
+            out_values.append(v)
+        if self.__native_partitioner:
+            self.uplink.partitioned_outputs(
+                self.__native_partitioner, out_keys, out_values, self.nred
+            )
+        elif self.partitioner:
+            self.uplink.partitioned_outputs(
+                [self.partitioner.partition(k, self.nred) for k in out_keys],
+                out_keys, out_values
+            )
+        else:
+            self.uplink.outputs(out_keys, out_values)
         self.progress()
 
     def __actual_emit(self, key, value):
         if self.record_writer:
-            self.record_writer.emit(key, value)
+            self.__write_record(key, value)
             return
         key, value = self.__maybe_serialize(key, value)
-        if self.partitioner:
+        if self.__emit_batch_size > 1:
+            self.__out_keys.append(key)
+            self.__out_values.append(value)
+            if self.partitioner and not self.__native_partitioner:
+                self.__out_parts.append(
+                    self.partitioner.partition(key, self.nred)
+                )
+            if len(self.__out_keys) >= self.__emit_batch_size:
+                self.__flush_outputs()
+        elif self.partitioner:
             part = self.partitioner.partition(key, self.nred)
             self.uplink.partitioned_output(part, key, value)
         else:
             self.uplink.output(key, value)
 
+    def __flush_outputs(self):
+        if not self.__out_keys:
+            return
+        if self.__native_partitioner:
+            # partitions are computed by the writer
+            self.uplink.partitioned_outputs(
+                self.__native_partitioner, self.__out_keys, self.__out_values,
+                self.nred
+            )
+        elif self.partitioner:
+            self.uplink.partitioned_outputs(
+                self.__out_parts, self.__out_keys, self.__out_values
+            )
+            del self.__out_parts[:]
+        else:
+            self.uplink.outputs(self.__out_keys, self.__out_values)
+        del self.__out_keys[:]
+        del self.__out_values[:]
+
+    def __count_spill(self):
+        spills, keys, nbytes = self.__combiner_counters
+        self.increment_counter(spills, 1)
+        self.increment_counter(keys, len(self.__cache))
+        self.increment_counter(nbytes, memory.cache_sizeof(self.__cache))
+
     def __spill_all(self):
-        self.__spilling = True
-        for k in sorted(self.__cache):
-            self._key = k
-            self._values = iter(self.__cache[k])
-            self.combiner.reduce(self)
+        self.__count_spill()
+        if self.__local_spill:
+            if self.__runs is None:
+                self.__runs = spill.RunStore()
+            self.__runs.write(self.__combined_records())
+        else:
+            self.__spilling = True
+            if self.__aggregating:
+                for k in sorted(self.__cache):
+                    self.__actual_emit(k, self.__cache[k])
+            else:
+                for k in sorted(self.__cache):
+                    self._key = k
+                    self._values = iter(self.__cache[k])
+                    self.combiner.reduce(self)
+            self.__spilling = False
         self.__cache.clear()
         self.__cache_size = 0
-        self.__spilling = False
+        self.__meter.reset()
+
+    # combined contents of the cache, sorted by key
+    def __combined_records(self):
+        if self.__aggregating:
+            return ((k, self.__cache[k]) for k in sorted(self.__cache))
+        self.__capture = records = []
+        try:
+            for k in sorted(self.__cache):
+                self._key = k
+                self._values = iter(self.__cache[k])
+                self.combiner.reduce(self)
+        finally:
+            self.__capture = None
+        # the combiner might change keys (cheap if it doesn't)
+        records.sort(key=itemgetter(0))
+        return records
+
+    # merge on-disk runs and the cache, combine and send upstream
+    def __merge_runs(self):
+        try:
+            last = ()
+            if self.__cache:
+                self.__count_spill()
+                last = self.__combined_records()
+            self.__spilling = True
+            for k, values in self.__runs.merge(last):
+                if self.__aggregating:
+                    acc = next(values)
+                    for v in values:
+                        acc = self.combiner.merge(acc, v)
+                    self.__actual_emit(k, acc)
+                else:
+                    self._key = k
+                    self._values = values
+                    self.combiner.reduce(self)
+        finally:
+            self.__runs.close()
+        self.__cache.clear()
 
     def close(self):
         self.uplink.flush()
         # do *not* call uplink.done while user components are still active
         try:
+            if self._map_dispatcher:
+                self._map_dispatcher.close()
             if self.mapper:
                 self.mapper.close()
             # handle combiner after mapper (mapper.close can call emit)
-            if self.__cache:
+            if self.__runs is not None:
+                self.__merge_runs()
+                self.combiner.close()
+            elif self.__cache:
                 self.__spill_all()
                 self.__spilling = True  # re-enable emit for combiner.close
                 self.combiner.close()
@@ -346,8 +671,13 @@ class TaskContext(api.Context):
                 self.record_writer.close()
             if self.reducer:
                 self.reducer.close()
+            self.__flush_outputs()
+            if self._timer:
+                self._timer.report()
             self.__spill_counters()
         finally:
+            if self.__heartbeat:
+                self.__heartbeat.stop()
             self.uplink.done()
             self.uplink.flush()
 
@@ -424,10 +754,73 @@ def run_task(factory, **kwargs):
     * ``raw_values`` (default: :obj:`False`): pass map input values to context
       as byte strings (ignore any type information)
     * ``private_encoding`` (default: :obj:`True`): automatically serialize map
-      output k/v and deserialize reduce input k/v (pickle)
+      output k/v and deserialize reduce input k/v (see ``intermediate_codec``)
+    * ``intermediate_codec`` (default: ``"pickle"``): the codec used for
+      private encoding: either the name of a built-in codec or a
+      :class:`~pydoop.mapreduce.intermediate.Codec` instance. With
+      ``"ordered"``, common key types (bytes, str, int, float and tuples of
+      them) are serialized faster than with pickle, and the reducer gets keys
+      in sorted order. If not set, the codec name is read from the
+      ``pydoop.mapreduce.pipes.intermediate.codec`` job conf property
     * ``auto_serialize`` (default: :obj:`True`): automatically serialize reduce
       output (map output in map-only jobs) k/v (call str/unicode then encode as
       utf-8)
+    * ``emit_batch_size`` (default: 1): buffer up to this many serialized
+      output k/v pairs and send them upstream with a single call. This cuts
+      the per-emit overhead for applications that emit many records for each
+      input record (e.g., tokenizers). Buffered output is sent at least once
+      per second, and in any case before the task ends
+    * ``local_spill`` (default: :obj:`False`): when the combiner cache is
+      full, write its combined contents to a sorted run on local disk
+      instead of sending them upstream. All runs are merged, and combined
+      again, at the end of the task, so each key is sent upstream only once.
+      This is useful when many keys are repeated across spills. If not set,
+      the value is read from the
+      ``pydoop.mapreduce.pipes.combiner.local.spill`` job conf property
+    * ``zero_copy`` (default: :obj:`False`): together with ``raw_keys``
+      and/or ``raw_values``, pass raw map input keys and/or values as
+      read-only :class:`memoryview` objects instead of byte strings. This
+      saves one copy and one allocation per field, which is noticeable with
+      large (e.g., hundreds of KB) binary records. The underlying memory is
+      recycled as soon as all views on it have been released: to keep data
+      around after ``map`` returns, make a copy with ``bytes(view)``
+    * ``map_workers`` (default: 1): if greater than 1, fork this many
+      worker processes that run the mapper (see
+      :mod:`pydoop.mapreduce.workers`), so that a CPU-bound mapper can use
+      multiple cores. If not set, the value is read from the
+      ``pydoop.mapreduce.pipes.map.workers`` job conf property
+    * ``map_threads``: call the mapper from this many threads (see
+      :class:`~pydoop.mapreduce.api.ThreadedMapper`), which is useful for
+      I/O-bound mappers. If not set, the value is read from the
+      ``pydoop.mapreduce.pipes.map.threads`` job conf property or, for a
+      :class:`~pydoop.mapreduce.api.ThreadedMapper`, from its ``threads``
+      attribute. This can be combined with ``map_workers``
+    * ``instrument`` (default: :obj:`False`): attribute the task's wall
+      clock and CPU time to its phases, and report them in the
+      ``PYDOOP_PHASES`` counter group as ``TIME_<PHASE> (ms)`` and
+      ``CPU_<PHASE> (ms)``. Phases are: ``read`` (reading and decoding
+      input records), ``record_reader``, ``map``, ``reduce`` (user code,
+      excluding the other phases), ``combine`` (combiner caching),
+      ``spill`` (combiner spills), ``serialize``, ``write`` (sending output
+      upstream), ``record_writer``, ``workers`` (waiting for map workers)
+      and ``other``. Per-record phases are timed on a random sample of
+      records, so that the overhead is low enough to leave this on. If not
+      set, the value is read from the ``pydoop.mapreduce.pipes.instrument``
+      job conf property
+    * ``instrument_sample`` (default: 100): with ``instrument``, time about
+      one record in this many (1 means all of them). If not set, the value
+      is read from the ``pydoop.mapreduce.pipes.instrument.sample`` job
+      conf property
+    * ``instrument_dir``: with ``instrument``, also store the phase times in
+      a JSON file in this HDFS dir, one for each task attempt. If not set,
+      the value is read from the ``pydoop.mapreduce.pipes.instrument.dir``
+      job conf property. With map workers, phases for each worker are only
+      reported as counters
+
+    Map input keys and values of common ``org.apache.hadoop.io`` types
+    (``Text``, ``IntWritable``, ``LongWritable``, ``DoubleWritable``, etc.)
+    are decoded natively unless raw mode is requested. To handle other types,
+    see :func:`~pydoop.mapreduce.pipes.register_deserializer`.
 
     Advanced keyword arguments:
 
@@ -462,3 +855,32 @@ def run_task(factory, **kwargs):
         hdfs.put(pstats_fn, hdfs.path.join(pstats_dir, name))
     else:
         _run(context, **kwargs)
+    if context._timer:
+        instrument_dir = kwargs.get(
+            "instrument_dir", context.job_conf.get(INSTRUMENT_DIR_KEY)
+        )
+        if instrument_dir:
+            _dump_phases(context, instrument_dir)
+
+
+def _dump_phases(context, instrument_dir):
+    import json
+    import uuid
+    import pydoop.hdfs as hdfs
+    attempt_id = context.job_conf.get("mapreduce.task.attempt.id")
+    summary = {
+        "attempt_id": attempt_id,
+        "task_type": context.task_type,
+        "task_partition": context.get_task_partition(),
+        "sample": context._timer.sample,
+        "phases": dict(
+            (p, {"wall": w, "cpu": c})
+            for p, (w, c) in context._timer.totals().items()
+        ),
+    }
+    name = attempt_id or "%s_%s" % (context.task_type, uuid.uuid4().hex)
+    hdfs.mkdir(instrument_dir)
+    hdfs.dump(
+        json.dumps(summary, sort_keys=True),
+        hdfs.path.join(instrument_dir, "%s.json" % name)
+    )
@@ -0,0 +1,192 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+"""\
+Input sampling for total order partitioning.
+
+:class:`~.partitioners.TotalOrderPartitioner` needs split points that
+divide the key space into ranges holding approximately the same number of
+keys. These are estimated by reading records from a random subset of the
+input splits (in parallel), extracting a key from each record and picking
+evenly spaced keys from the sorted sample.
+
+Input files are assumed to be text, with one record per line (as in the
+default Java record reader). By default, the key of a record is the whole
+line, as a :class:`str` encoded with the ordered codec, which matches jobs
+that emit the line (or a key derived from it in an order-preserving way)
+with ``intermediate_codec="ordered"``. Use the ``key`` and ``encode``
+arguments of :func:`create_partition_file` for other cases.
+
+The sampler can be run before submitting the job, or automatically by
+``pydoop submit --sample-partitions FRACTION``.
+"""
+
+import math
+import random
+from multiprocessing.pool import ThreadPool
+
+from pydoop.mapreduce.intermediate import OrderedCodec
+from pydoop.mapreduce.partitioners import write_partition_file
+
+#: fraction of the input splits to read
+DEFAULT_FRACTION = 0.05
+#: max number of records read from each split
+DEFAULT_MAX_RECORDS = 10000
+#: number of splits read in parallel
+DEFAULT_THREADS = 8
+#: split size used if the file system does not report block sizes
+DEFAULT_SPLIT_SIZE = 128 * 1024 * 1024
+
+
+def _strip_eol(line):
+    if line.endswith(b"\n"):
+        line = line[:-1]
+        if line.endswith(b"\r"):
+            line = line[:-1]
+    return line
+
+
+def read_split(f, offset, length, max_records=None):
+    """\
+    Yield the lines (without line terminators) of the split of the open
+    (binary) file ``f`` that starts at ``offset`` and is ``length`` bytes
+    long, with the same convention as Hadoop's ``LineRecordReader``: all
+    splits but the first one skip their first (possibly partial) line, and
+    all splits read the line that crosses their end.
+    """
+    f.seek(offset)
+    if offset:
+        f.readline()
+    end = offset + length
+    n = 0
+    while f.tell() <= end and (max_records is None or n < max_records):
+        line = f.readline()
+        if not line:
+            break
+        yield _strip_eol(line)
+        n += 1
+
+
+def get_splits(paths, split_size=None):
+    """\
+    Return a list of ``(path, offset, length)`` tuples for all files under
+    ``paths``, each divided in chunks of ``split_size`` bytes (by default,
+    the block size of the file). Hidden files (whose name starts with
+    ``"_"`` or ``"."``) are skipped.
+    """
+    import pydoop.hdfs as hdfs
+    splits = []
+    for p in paths:
+        for info in hdfs.lsl(p, recursive=True):
+            bn = hdfs.path.basename(info["name"])
+            if info["kind"] != "file" or bn.startswith(("_", ".")):
+                continue
+            size = info["size"]
+            step = split_size or info.get("block_size") or DEFAULT_SPLIT_SIZE
+            splits.extend(
+                (info["name"], off, min(step, size - off))
+                for off in range(0, size, step)
+            )
+    return splits
+
+
+def sample(paths, fraction=DEFAULT_FRACTION, max_records=DEFAULT_MAX_RECORDS,
+           key=None, threads=DEFAULT_THREADS, split_size=None, seed=None):
+    """\
+    Read up to ``max_records`` records from each split in a random subset
+    (a ``fraction`` of the total, but at least one) of the input splits of
+    ``paths``, and return the list of their keys, as computed by ``key``
+    (a function of the line, as a byte string), or the line decoded as
+    utf-8 if ``key`` is not set.
+    """
+    import pydoop.hdfs as hdfs
+    if key is None:
+        def key(line):
+            return line.decode("utf-8")
+    splits = get_splits(paths, split_size)
+    if not splits:
+        return []
+    n = min(len(splits), max(1, int(math.ceil(fraction * len(splits)))))
+    chosen = random.Random(seed).sample(splits, n)
+    # hdfs instances are cached in a non thread-safe way
+    files = []
+    try:
+        for name, _, _ in chosen:
+            files.append(hdfs.open(name, "rb"))
+
+        def read(i):
+            _, offset, length = chosen[i]
+            records = read_split(files[i], offset, length, max_records)
+            return [key(_) for _ in records]
+
+        pool = ThreadPool(min(threads, n))
+        try:
+            results = pool.map(read, range(n))
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        for f in files:
+            f.close()
+    return [k for r in results for k in r]
+
+
+def pick_split_points(samples, num_partitions):
+    """\
+    Pick ``num_partitions - 1`` split points, evenly spaced among the sorted
+    ``samples`` (serialized keys). Duplicate points are skipped, so fewer
+    points are returned if the sample does not have enough distinct keys.
+    """
+    samples = sorted(samples)
+    points = []
+    if not samples:
+        return points
+    step = len(samples) / float(num_partitions)
+    last = None
+    for i in range(1, num_partitions):
+        k = int(round(step * i))
+        while last is not None and k < len(samples) and \
+                samples[k] <= samples[last]:
+            k += 1
+        if k >= len(samples):
+            break
+        points.append(samples[k])
+        last = k
+    return points
+
+
+def create_partition_file(paths, path, num_partitions,
+                          fraction=DEFAULT_FRACTION,
+                          max_records=DEFAULT_MAX_RECORDS, key=None,
+                          encode=None, threads=DEFAULT_THREADS,
+                          split_size=None, seed=None):
+    """\
+    Sample the input ``paths`` (see :func:`sample`), serialize sampled keys
+    with ``encode`` (by default, the ordered codec's encoder) and write the
+    split points for ``num_partitions`` partitions to ``path``. Return the
+    split points.
+    """
+    import pydoop.hdfs as hdfs
+    if encode is None:
+        encode = OrderedCodec().encode
+    keys = sample(paths, fraction=fraction, max_records=max_records, key=key,
+                  threads=threads, split_size=split_size, seed=seed)
+    points = pick_split_points([encode(_) for _ in keys], num_partitions)
+    with hdfs.open(path, "wb") as f:
+        write_partition_file(points, f)
+    return points
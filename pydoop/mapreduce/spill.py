@@ -0,0 +1,107 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+"""\
+Sorted on-disk runs for the map-side combiner.
+
+By default, each time the combiner cache is full, its contents are combined
+and sent upstream, so a key that is emitted again after a spill is sent
+again. With local spilling, combined records are instead written to a
+sorted run on local disk, and all runs are merged (applying the combiner
+again) when the task ends, so that each key is sent upstream only once.
+"""
+
+import heapq
+import io
+import os
+from itertools import groupby
+from operator import itemgetter
+
+from pydoop.utils.py3compat import pickle
+
+#: number of records pickled together
+CHUNK_SIZE = 1024
+
+
+def _read_run(path):
+    with io.open(path, "rb") as f:
+        while True:
+            try:
+                chunk = pickle.load(f)
+            except EOFError:
+                break
+            for record in chunk:
+                yield record
+
+
+def _decorate(records, i):
+    # ties must never get to the values, which might not be comparable
+    for n, (k, v) in enumerate(records):
+        yield k, i, n, v
+
+
+class RunStore(object):
+    """\
+    A collection of sorted runs of ``(key, value)`` records, stored in a
+    temporary directory under ``dir`` (by default, the system's temporary
+    directory, which for pipes tasks is under the container's working
+    directory).
+    """
+
+    def __init__(self, dir=None):
+        import tempfile
+        self.dir = tempfile.mkdtemp(prefix="pydoop_spill_", dir=dir)
+        self.paths = []
+
+    def write(self, records):
+        """\
+        Write a new run. Records must be sorted by key.
+        """
+        path = os.path.join(self.dir, "run_%06d" % len(self.paths))
+        chunk = []
+        with io.open(path, "wb") as f:
+            for r in records:
+                chunk.append(r)
+                if len(chunk) >= CHUNK_SIZE:
+                    pickle.dump(chunk, f, pickle.HIGHEST_PROTOCOL)
+                    chunk = []
+            if chunk:
+                pickle.dump(chunk, f, pickle.HIGHEST_PROTOCOL)
+        self.paths.append(path)
+
+    def merge(self, last=()):
+        """\
+        Merge all runs, plus the optional in-memory sorted run ``last``.
+
+        Yield ``(key, values)`` tuples in key order, where ``values`` is an
+        iterator over all values for ``key`` (run by run, in the order they
+        were written).
+        """
+        runs = [_read_run(_) for _ in self.paths]
+        runs.append(iter(last))
+        merged = heapq.merge(*[_decorate(r, i) for i, r in enumerate(runs)])
+        for k, group in groupby(merged, itemgetter(0)):
+            yield k, (_[3] for _ in group)
+
+    def close(self):
+        """\
+        Remove all runs.
+        """
+        import shutil
+        shutil.rmtree(self.dir, ignore_errors=True)
+        self.paths = []
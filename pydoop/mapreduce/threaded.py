@@ -0,0 +1,213 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+"""\
+Threaded map execution (see :class:`~.api.ThreadedMapper`).
+
+The framework calls a :class:`MapDispatcher` in place of the mapper's
+``map`` method. The dispatcher queues input records for a pool of threads,
+each of which calls ``map`` with a :class:`RecordContext`. Records emitted
+through the latter are passed to the task context by the main thread, so
+the rest of the output path (combiner, partitioner, serialization) is
+unchanged and does not need to be thread-safe.
+"""
+
+import threading
+from collections import deque
+
+from .api import ThreadedMapper
+
+MAP_THREADS_KEY = "pydoop.mapreduce.pipes.map.threads"
+
+
+def get_map_threads(mapper, job_conf, n=None):
+    """\
+    Return the number of map threads: ``n`` if not :obj:`None`, else the
+    value of the ``pydoop.mapreduce.pipes.map.threads`` job conf property,
+    else :attr:`~.api.ThreadedMapper.threads` for a threaded mapper. 0 means
+    that the mapper must be called directly.
+    """
+    if n is None:
+        n = job_conf.get_int(MAP_THREADS_KEY)
+    if n is None:
+        n = mapper.threads if isinstance(mapper, ThreadedMapper) else 0
+    return max(n, 0)
+
+
+class RecordContext(object):
+    """\
+    The context passed to ``map`` by a map thread. Holds the input record
+    and collects output records. Counter and status updates are forwarded
+    to the task context, one thread at a time; any other attribute is read
+    from the task context.
+    """
+
+    def __init__(self, dispatcher, key, value):
+        self.dispatcher = dispatcher
+        self.key = key
+        self.value = value
+        self.outputs = []
+
+    def __getattr__(self, name):
+        return getattr(self.dispatcher.context, name)
+
+    def get_input_key(self):
+        return self.key
+
+    def get_input_value(self):
+        return self.value
+
+    def emit(self, key, value):
+        self.outputs.append((key, value))
+
+    def emit_batch(self, keys, values):
+        self.outputs.extend(zip(keys, values))
+
+    def progress(self):
+        with self.dispatcher.lock:
+            self.dispatcher.context.progress()
+
+    def set_status(self, status):
+        with self.dispatcher.lock:
+            self.dispatcher.context.set_status(status)
+
+    def get_counter(self, group, name):
+        with self.dispatcher.lock:
+            return self.dispatcher.context.get_counter(group, name)
+
+    def increment_counter(self, counter, amount):
+        with self.dispatcher.lock:
+            self.dispatcher.context.increment_counter(counter, amount)
+
+
+class MapDispatcher(object):
+    """\
+    Runs ``mapper.map`` for each input record in one of ``threads`` threads.
+
+    Called (instead of ``mapper.map``) with the task context, from which it
+    reads the current key and value. Blocks, emitting completed outputs,
+    while ``max_pending`` records are in progress or waiting to be emitted.
+    If ``ordered`` is :obj:`True`, outputs are emitted in input order. Any
+    exception raised by ``map`` is re-raised in the main thread.
+
+    :attr:`lock` must be held by the main thread while it uses the task
+    context, since map threads can update counters and status.
+    """
+
+    def __init__(self, context, mapper, threads, ordered=True,
+                 max_pending=None):
+        self.context = context
+        self.mapper = mapper
+        self.ordered = ordered
+        self.max_pending = max_pending or 4 * threads
+        self.lock = threading.Lock()  # task context
+        cond_lock = threading.Lock()  # queues
+        self.has_work = threading.Condition(cond_lock)
+        self.has_result = threading.Condition(cond_lock)
+        self.todo = deque()
+        self.done = {}
+        self.seq = 0  # sequence number of the next input record
+        self.next_seq = 0  # sequence number of the next output, if ordered
+        self.pending = 0
+        self.closing = False
+        self.threads = []
+        for _ in range(threads):
+            t = threading.Thread(target=self.__run)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def __run(self):
+        while True:
+            with self.has_work:
+                while not self.todo and not self.closing:
+                    self.has_work.wait()
+                if not self.todo:
+                    return
+                seq, key, value = self.todo.popleft()
+            ctx = RecordContext(self, key, value)
+            try:
+                self.mapper.map(ctx)
+                result = ctx.outputs, None
+            except BaseException as e:
+                result = None, e
+            with self.has_result:
+                self.done[seq] = result
+                self.has_result.notify()
+
+    def __pop_ready(self):
+        # call with the condition lock held
+        if not self.ordered:
+            ready = list(self.done.values())
+            self.done.clear()
+            return ready
+        ready = []
+        while self.next_seq in self.done:
+            ready.append(self.done.pop(self.next_seq))
+            self.next_seq += 1
+        return ready
+
+    def __emit_ready(self, block):
+        while True:
+            with self.has_result:
+                ready = self.__pop_ready()
+                while block and not ready:
+                    self.has_result.wait()
+                    ready = self.__pop_ready()
+            if not ready:
+                return
+            with self.lock:
+                for outputs, error in ready:
+                    if error is not None:
+                        raise error
+                    for k, v in outputs:
+                        self.context.emit(k, v)
+                self.context.progress()
+            self.pending -= len(ready)
+            block = self.pending >= self.max_pending
+
+    def __call__(self, context):
+        with self.has_work:
+            self.todo.append((self.seq, context._key, context._value))
+            self.has_work.notify()
+        self.seq += 1
+        self.pending += 1
+        self.__emit_ready(self.pending >= self.max_pending)
+
+    def progress(self):
+        """\
+        Call the task context's ``progress``, holding :attr:`lock`.
+        """
+        with self.lock:
+            self.context.progress()
+
+    def close(self):
+        """\
+        Wait for all pending records, emit their outputs and stop the
+        threads.
+        """
+        try:
+            while self.pending:
+                self.__emit_ready(True)
+        finally:
+            with self.has_work:
+                self.closing = True
+                self.todo.clear()
+                self.has_work.notify_all()
+            for t in self.threads:
+                t.join()
@@ -0,0 +1,284 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+"""\
+Multi-process map execution.
+
+A pipes task is a single process, so a CPU-bound mapper can only use one
+core. With ``map_workers=N`` (see :func:`~.pipes.run_task`), the task
+process (the *driver*) forks N worker processes right before the first map
+input record. The driver reads input records in chunks and sends them to
+the workers, each of which runs its own copy of the mapper (plus
+partitioner and combiner, if any) on them. Output records, counter
+increments and status messages are sent back to the driver, which forwards
+them upstream (there is still a single connection to the Java side).
+
+Since workers are forked, all components are created (and their
+``__init__`` run) once, in the driver, and inherited by the workers. Each
+worker closes its own copy of the mapper and combiner, while the record
+reader (if any) is only used, and closed, by the driver. Each worker has
+its own combiner cache, with a size limit of 1/N of the configured one.
+
+Results are received by one thread per worker in the driver, so that
+workers are never blocked sending output while the driver is sending them
+input (processing results, i.e., forwarding them upstream, is still done
+by the main thread).
+
+The order in which outputs are sent upstream is not preserved, which
+does not matter for map output that goes through the shuffle. Map workers
+cannot be used with a Python record writer.
+"""
+
+import os
+import sys
+import threading
+
+try:
+    from queue import Queue
+except ImportError:  # Python 2
+    from Queue import Queue
+
+MAP_WORKERS_KEY = "pydoop.mapreduce.pipes.map.workers"
+#: number of input records sent to a worker at a time
+CHUNK_SIZE = 256
+#: max number of chunks each worker can have pending
+MAX_PENDING = 2
+
+
+class CaptureUplink(object):
+    """\
+    Stands in for the :class:`~.binary_protocol.Uplink` in map workers:
+    collects outputs, counter increments and status messages so that they
+    can be sent to the driver.
+
+    Counters registered by the worker are identified by their group and
+    name, since their ids are not valid in the driver.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.counters = {}
+        self.status_msg = None
+        self.__registered = {}
+
+    def collect(self):
+        """\
+        Return all data collected so far, and reset.
+        """
+        rval = self.records, self.counters, self.status_msg
+        self.records, self.counters, self.status_msg = [], {}, None
+        return rval
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def output(self, k, v):
+        self.records.append((None, [k], [v]))
+
+    def partitioned_output(self, part, k, v):
+        self.records.append(([part], [k], [v]))
+
+    def outputs(self, keys, values):
+        self.records.append((None, list(keys), list(values)))
+
+    def partitioned_outputs(self, parts, keys, values, num_partitions=0):
+        if hasattr(parts, "partition"):  # sercore.Partitioner
+            parts = [parts.partition(_, num_partitions) for _ in keys]
+        self.records.append((list(parts), list(keys), list(values)))
+
+    def status(self, msg):
+        self.status_msg = msg
+
+    def progress(self, p):
+        pass
+
+    def done(self):
+        pass
+
+    def register_counter(self, id, group, name):
+        self.__registered[id] = (group, name)
+
+    def increment_counter(self, id, amount):
+        key = self.__registered.get(id, id)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+
+class MapWorkers(object):
+    """\
+    A pool of forked map worker processes.
+
+    ``map_items`` is called, in a worker, with each chunk of input records
+    (a list of ``(key, value)`` tuples) passed to :meth:`submit`. It must
+    set them on the context, call the mapper and report progress (so that
+    buffered outputs and counters are flushed).
+    """
+
+    def __init__(self, context, n, map_items):
+        if context.record_writer:
+            raise RuntimeError("map workers used with a record writer")
+        from multiprocessing import Pipe
+        self.context = context
+        self.map_items = map_items
+        self.conns = []
+        self.pids = []
+        self.pending = []
+        self.next = 0
+        self.results = []
+        self.__counter_ids = {}
+        self.__readers = []
+        context.uplink.flush()  # don't duplicate buffered data
+        for i in range(n):
+            parent_conn, child_conn = Pipe()
+            pid = os.fork()
+            if pid == 0:
+                parent_conn.close()
+                for c in self.conns:
+                    c.close()
+                self.__run_worker(child_conn, n)  # does not return
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.pids.append(pid)
+            self.pending.append(0)
+            self.results.append(Queue())
+        # start threads after all forks
+        for conn, results in zip(self.conns, self.results):
+            t = threading.Thread(target=self.__read, args=(conn, results))
+            t.daemon = True
+            t.start()
+            self.__readers.append(t)
+
+    @staticmethod
+    def __read(conn, results):
+        # put each result from a worker in its queue, then None at EOF
+        try:
+            while True:
+                results.put(conn.recv())
+        except (EOFError, IOError, OSError):
+            results.put(None)
+
+    def __run_worker(self, conn, n):
+        code = 1
+        try:
+            uplink = CaptureUplink()
+            self.context._setup_map_worker(uplink, n)
+            while True:
+                items = conn.recv()
+                if items is None:
+                    break
+                self.map_items(items)
+                conn.send(uplink.collect())
+            self.context.close()
+            conn.send(uplink.collect())
+            code = 0
+        except BaseException:
+            import traceback
+            try:
+                conn.send(traceback.format_exc())
+            except Exception:
+                pass
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)  # skip all cleanup inherited from the driver
+
+    def __get_counter(self, key):
+        try:
+            return self.__counter_ids[key]
+        except KeyError:
+            id = self.__counter_ids[key] = self.context.get_counter(*key)
+            return id
+
+    def __receive(self, i):
+        result = self.results[i].get()
+        if result is None:
+            self.results[i].put(None)  # for any further calls
+            raise RuntimeError("map worker %d exited unexpectedly" % i)
+        if not isinstance(result, tuple):
+            raise RuntimeError("error in map worker %d:\n%s" % (i, result))
+        self.pending[i] -= 1
+        outputs, counters, status = result
+        uplink = self.context.uplink
+        for parts, keys, values in outputs:
+            if parts is None:
+                uplink.outputs(keys, values)
+            else:
+                uplink.partitioned_outputs(parts, keys, values)
+        for key, amount in counters.items():
+            if isinstance(key, tuple):
+                key = self.__get_counter(key)
+            self.context.increment_counter(key, amount)
+        if status:
+            self.context.status = status
+        self.context.progress()
+
+    def __send(self, i, obj):
+        try:
+            self.conns[i].send(obj)
+        except (IOError, OSError):
+            # the worker is gone: forward its results up to the error
+            # message (or EOF), which raises RuntimeError
+            while True:
+                self.__receive(i)
+
+    def submit(self, items):
+        """\
+        Send a chunk of input records to the next worker (round robin),
+        first waiting for one of its pending results if it's too busy.
+        """
+        i = self.next
+        self.next = (i + 1) % len(self.conns)
+        while self.pending[i] >= MAX_PENDING:
+            self.__receive(i)
+        self.__send(i, items)
+        self.pending[i] += 1
+
+    def close(self):
+        """\
+        Tell all workers to finish (closing their components), forward
+        all remaining results and wait for the workers to exit.
+
+        Since the mapper has been run (and closed) by the workers, it's
+        removed from the driver's context.
+        """
+        done = False
+        try:
+            for i in range(len(self.conns)):
+                self.__send(i, None)
+            for i in range(len(self.conns)):
+                self.pending[i] += 1  # final result
+                while self.pending[i]:
+                    self.__receive(i)
+            done = True
+        finally:
+            if not done:  # workers might be blocked on the connection
+                import signal
+                for pid in self.pids:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+            for pid in self.pids:
+                os.waitpid(pid, 0)
+            for t in self.__readers:
+                t.join()
+            for c in self.conns:
+                c.close()
+            self.context.mapper = None
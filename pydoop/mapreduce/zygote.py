@@ -0,0 +1,343 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+"""\
+Warm workers: run pipes tasks in processes forked from a pre-loaded server.
+
+Each pipes task normally starts a new interpreter, which imports the job
+module (and everything it loads at module level, e.g., NumPy or a trained
+model) before calling the entry point. With ``pydoop submit
+--warm-workers``, the launcher script calls :func:`run` instead, which
+hands the task over to a node-local server for the job (the *zygote*):
+
+* the first task on a node that finds no zygote running starts one, then
+  runs as usual. The zygote imports the job module and listens on a Unix
+  socket in :func:`zygote_dir`;
+* later tasks connect to the zygote and send it their standard streams
+  and, if the Java side uses a socket, the pipes socket (already
+  connected), as file descriptors, together with their environment,
+  working directory and arguments. The zygote forks a child that takes
+  all of these over and calls the entry point. The child's exit status is
+  sent back to the task process, which exits with it;
+* the zygote exits after ``timeout`` seconds without new tasks.
+
+Only what runs at module level is shared by tasks: the entry point
+(including the creation of the factory and of the components) is still
+run once per task, so task-independent setup that takes a long time
+should be done at module level.
+
+Warm workers need Unix domain sockets with file descriptor passing
+(Python 3 on a Unix system): elsewhere, and whenever the zygote cannot be
+reached, :func:`run` calls the entry point in the task process. Since the
+zygote runs outside of the container of the task that started it, warm
+workers are not useful if the NodeManager confines all of a task's
+processes (e.g., with cgroups).
+"""
+
+import errno
+import os
+import socket
+import struct
+import sys
+from importlib import import_module
+
+from .connections import FD_ENV, socket_address
+
+ZYGOTE_DIR_ENV = "PYDOOP_ZYGOTE_DIR"
+#: default number of seconds without new tasks after which the zygote exits
+IDLE_TIMEOUT = 300
+STREAMS = ("stdin", "stdout", "stderr")
+
+
+def supported():
+    """\
+    Return :obj:`True` if warm workers can be used on this system.
+    """
+    return (
+        hasattr(os, "fork") and hasattr(socket, "AF_UNIX") and
+        hasattr(socket.socket, "sendmsg")
+    )
+
+
+def zygote_dir():
+    """\
+    Return the directory where zygote sockets are created: the value of the
+    ``PYDOOP_ZYGOTE_DIR`` env var or, if not set, a per-user directory in
+    the system's temporary dir. It's created if it does not exist, and
+    must not be accessible by other users.
+    """
+    d = os.getenv(ZYGOTE_DIR_ENV)
+    if not d:
+        import tempfile
+        d = os.path.join(
+            tempfile.gettempdir(), "pydoop-zygote-%d" % os.getuid()
+        )
+    try:
+        os.mkdir(d, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    st = os.stat(d)
+    if st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise RuntimeError("%r is accessible by other users" % (d,))
+    return d
+
+
+def socket_path(key):
+    """\
+    Return the path of the zygote socket for ``key``.
+    """
+    import hashlib
+    name = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(zygote_dir(), "%s.sock" % name)
+
+
+def _recv_all(sock, n):
+    chunks = []
+    while n:
+        chunk = sock.recv(n)
+        if not chunk:
+            raise EOFError("connection closed")
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b"".join(chunks)
+
+
+def _send_fds(sock, fds, data):
+    import array
+    sock.sendmsg([b"\0"], [
+        (socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))
+    ])
+    sock.sendall(struct.pack("!I", len(data)) + data)
+
+
+def _recv_fds(sock, maxfds):
+    import array
+    fds = array.array("i")
+    msg, ancdata, _, _ = sock.recvmsg(
+        1, socket.CMSG_SPACE(maxfds * fds.itemsize)
+    )
+    if not msg:
+        raise EOFError("connection closed")
+    for level, type_, data in ancdata:
+        if level == socket.SOL_SOCKET and type_ == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - len(data) % fds.itemsize])
+    size, = struct.unpack("!I", _recv_all(sock, 4))
+    return list(fds), _recv_all(sock, size)
+
+
+def _peer_uid(conn):
+    opt = getattr(socket, "SO_PEERCRED", None)
+    if opt is None:  # rely on the permissions of the zygote dir
+        return os.getuid()
+    creds = conn.getsockopt(socket.SOL_SOCKET, opt, struct.calcsize("3i"))
+    return struct.unpack("3i", creds)[1]
+
+
+def _exit_code(code):
+    # same as the interpreter does for an uncaught SystemExit
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    sys.stderr.write("%s\n" % (code,))
+    return 1
+
+
+def _connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (IOError, OSError):
+        sock.close()
+        return None
+    return sock
+
+
+def _start(path, module, entry_point, timeout):
+    import fcntl
+    import subprocess
+    with open("%s.lock" % path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            return  # already starting
+        fcntl.flock(f, fcntl.LOCK_UN)
+    with open(os.devnull, "rb") as stdin, open("%s.log" % path, "ab") as log:
+        subprocess.Popen(
+            [sys.executable, "-m", __name__, path, module, entry_point,
+             str(timeout)],
+            stdin=stdin, stdout=log, stderr=subprocess.STDOUT,
+            start_new_session=True
+        )
+
+
+def _hand_over(conn):
+    # send the task to the zygote and return the exit status of its child.
+    # If the Java side uses a socket, connect to it here, so that it
+    # doesn't matter who does what from the Java side's point of view
+    import json
+    fds = [getattr(sys, _).fileno() for _ in STREAMS]
+    pipes_sock = None
+    address = socket_address()
+    if address:
+        pipes_sock = socket.socket(address[0], socket.SOCK_STREAM)
+        pipes_sock.connect(address[1])
+        fds.append(pipes_sock.fileno())
+    task = {"env": dict(os.environ), "cwd": os.getcwd(), "argv": sys.argv}
+    try:
+        _send_fds(conn, fds, json.dumps(task).encode("utf-8"))
+    except (IOError, OSError):
+        if pipes_sock is not None:
+            os.environ[FD_ENV] = str(pipes_sock.detach())
+        return None
+    if pipes_sock is not None:
+        pipes_sock.close()
+    try:
+        return struct.unpack("!i", _recv_all(conn, 4))[0]
+    except (EOFError, IOError, OSError):
+        return 1  # child died without reporting
+
+
+def run(module, entry_point, key, timeout=IDLE_TIMEOUT):
+    """\
+    Run a pipes task by calling ``module.entry_point()``, in a child of the
+    zygote for ``key`` if possible (see above). ``key`` must be unique to
+    the job. Exits with the child's exit status if it's not zero.
+    """
+    if supported():
+        path = socket_path("%s:%s:%s" % (key, module, entry_point))
+        conn = _connect(path)
+        if conn is None:
+            _start(path, module, entry_point, timeout)
+        else:
+            with conn:
+                code = _hand_over(conn)
+            if code is not None:
+                if code:
+                    raise SystemExit(code)
+                return
+    getattr(import_module(module), entry_point)()
+
+
+def _watch(conn):
+    # the task process sends nothing else: if it exits (e.g., because its
+    # container is killed), the task must go away too
+    try:
+        conn.recv(1)
+    finally:
+        os._exit(1)
+
+
+def _run_child(conn, main):
+    import json
+    import random
+    import signal
+    import threading
+    import traceback
+    code = 1
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        conn.settimeout(None)
+        fds, data = _recv_fds(conn, len(STREAMS) + 1)
+        task = json.loads(data.decode("utf-8"))
+        for target, fd in enumerate(fds[:len(STREAMS)]):
+            os.dup2(fd, target)
+            os.close(fd)
+        os.chdir(task["cwd"])
+        os.environ.clear()
+        os.environ.update(task["env"])
+        if len(fds) > len(STREAMS):
+            os.environ[FD_ENV] = str(fds[len(STREAMS)])
+        sys.argv[:] = task["argv"]
+        pythonpath = os.getenv("PYTHONPATH", "").split(os.pathsep)
+        sys.path[:0] = [
+            p for p in (os.path.abspath(_) for _ in pythonpath if _)
+            if p not in sys.path
+        ]
+        random.seed()  # don't share the zygote's state with other tasks
+        watcher = threading.Thread(target=_watch, args=(conn,))
+        watcher.daemon = True
+        watcher.start()
+        try:
+            main()
+            code = 0
+        except SystemExit as e:
+            code = _exit_code(e.code)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            conn.sendall(struct.pack("!i", code))
+        finally:
+            os._exit(code)
+
+
+def serve(path, module, entry_point, timeout=IDLE_TIMEOUT):
+    """\
+    Run a zygote for ``module.entry_point`` at ``path``, until no task
+    connects for ``timeout`` seconds. Returns immediately if another
+    zygote for the same path is running.
+    """
+    import fcntl
+    import signal
+    lock = open("%s.lock" % path, "a")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        lock.close()
+        return
+    lock.truncate(0)
+    lock.write("%d\n" % os.getpid())
+    lock.flush()
+    main = getattr(import_module(module), entry_point)
+    os.chdir(os.path.dirname(path))  # the task's dir can go away
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    tmp_path = "%s.%d" % (path, os.getpid())
+    server.bind(tmp_path)
+    server.listen(socket.SOMAXCONN)
+    os.rename(tmp_path, path)  # replaces any stale socket
+    server.settimeout(timeout)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # reap children
+    try:
+        while True:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                break
+            if _peer_uid(conn) != os.getuid():
+                conn.close()
+                continue
+            if os.fork() == 0:
+                server.close()
+                lock.close()
+                _run_child(conn, main)  # does not return
+            conn.close()
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        server.close()
+        lock.close()
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1], sys.argv[2], sys.argv[3], float(sys.argv[4]))
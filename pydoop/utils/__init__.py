@@ -26,4 +26,20 @@ __all__ = [
     'make_random_str',
 ]
 
-from .misc import NullHandler, NullLogger, make_random_str
+import sys
+from importlib import import_module
+
+
+def __getattr__(name):
+    # PEP 562: misc pulls in logging, uuid, etc., which are not needed by
+    # modules that only import submodules (e.g., py3compat)
+    if name not in __all__:
+        raise AttributeError("module %r has no attribute %r" % (
+            __name__, name
+        ))
+    value = globals()[name] = getattr(import_module(".misc", __name__), name)
+    return value
+
+
+if sys.version_info < (3, 7):  # no PEP 562
+    from .misc import NullHandler, NullLogger, make_random_str  # noqa: F401
@@ -21,8 +21,19 @@ Miscellaneous utilities.
 """
 
 import logging
+import random
 import time
 import uuid
+from functools import partial
+
+try:
+    from threading import get_ident
+except ImportError:  # Python 2
+    from thread import get_ident
+try:
+    from time import perf_counter as _wall, process_time as _cpu
+except ImportError:  # Python 2
+    from time import time as _wall, clock as _cpu
 
 
 DEFAULT_LOG_LEVEL = "WARNING"
@@ -86,3 +97,186 @@ class Timer(object):
         def __exit__(self, exception_type, exception_val, exception_tb):
             self._timer.stop(self._event_name)
             return False
+
+
+class PhaseTimer(Timer):
+    """\
+    Attribute wall clock and CPU time to the *phases* of a task.
+
+    Phases can be nested: each phase gets only the time not spent in the
+    phases it contains, and the time not spent in any phase goes to
+    ``"other"``. Phases that run many times, such as calls to a mapper's
+    ``map`` method, can be timed on a random sample of about one run in
+    ``sample`` (see :meth:`sampled`): their times are then multiplied by
+    ``sample``, so that totals are estimated at a fraction of the cost.
+    Nested phases that are only worth timing within a sampled run (see
+    :meth:`nested`) get the same treatment.
+
+    Only calls from the thread that created (or last reset) the timer are
+    timed. :meth:`report` adds the times to ``TIME_<PHASE> (ms)`` (wall
+    clock) and ``CPU_<PHASE> (ms)`` counters.
+    """
+
+    OTHER = "other"
+
+    def __init__(self, ctx, counter_group=None, sample=1):
+        super(PhaseTimer, self).__init__(ctx, counter_group)
+        self.sample = max(int(sample), 1)
+        self.reset()
+
+    def reset(self):
+        """\
+        Discard all times and start over (e.g., in a forked process).
+        """
+        self.wall = {}  # seconds, by phase
+        self.cpu = {}
+        #: weight of the sampled run in progress, if any, else 0
+        self.sampling = 0
+        self._countdown = self.__interval()
+        self._owner = get_ident()
+        self.__reported = {}  # ms, by counter id
+        # [phase, weight, sampling, wall, cpu, children's wall, children's
+        # cpu, children's estimated wall, children's estimated cpu]
+        self.__stack = [[self.OTHER, 0, 0, _wall(), _cpu(), 0., 0., 0., 0.]]
+
+    def __interval(self):
+        return random.randint(1, 2 * self.sample - 1)
+
+    def start(self, s, weight=0):
+        """\
+        Enter phase ``s``. A positive ``weight`` means that this is a sampled
+        run, standing for ``weight`` runs.
+        """
+        self.__stack.append(
+            [s, weight, self.sampling, _wall(), _cpu(), 0., 0., 0., 0.]
+        )
+        self.sampling = weight
+
+    def stop(self, s):
+        """\
+        Exit phase ``s``, which must be the last one entered.
+        """
+        wall, cpu = _wall(), _cpu()
+        frame = self.__stack.pop()
+        if frame[0] != s:
+            raise RuntimeError("stopping %r while in %r" % (s, frame[0]))
+        self.sampling = frame[2]
+        est_wall, est_cpu = self.__account(frame, wall, cpu, self.wall,
+                                           self.cpu)
+        parent = self.__stack[-1]
+        parent[5] += wall - frame[3]
+        parent[6] += cpu - frame[4]
+        parent[7] += est_wall
+        parent[8] += est_cpu
+
+    @staticmethod
+    def __account(frame, wall, cpu, wall_totals, cpu_totals):
+        # add the frame's own (weighted) time to the totals; return its
+        # estimated overall time
+        phase, weight = frame[0], frame[1] or 1
+        own_wall = (wall - frame[3] - frame[5]) * weight
+        own_cpu = (cpu - frame[4] - frame[6]) * weight
+        wall_totals[phase] = wall_totals.get(phase, 0.) + own_wall
+        cpu_totals[phase] = cpu_totals.get(phase, 0.) + own_cpu
+        return own_wall + frame[7], own_cpu + frame[8]
+
+    def sampled(self, func, phase):
+        """\
+        Return a wrapper for ``func`` that times a random sample of its
+        calls as runs of ``phase``. Sampled runs must not be nested.
+        """
+        def sampled_func(*args):
+            self._countdown -= 1
+            if self._countdown > 0:
+                return func(*args)
+            self._countdown = self.__interval()
+            self.start(phase, self.sample)
+            try:
+                return func(*args)
+            finally:
+                self.stop(phase)
+        return sampled_func
+
+    def sampled_iter(self, iterable, phase):
+        """\
+        Iterate over ``iterable``, timing a random sample of the calls to
+        its ``next`` method as runs of ``phase``.
+        """
+        next_item = self.sampled(partial(next, iter(iterable)), phase)
+        while True:
+            try:
+                item = next_item()
+            except StopIteration:
+                return
+            yield item
+
+    def nested(self, func, phase):
+        """\
+        Return a wrapper for ``func`` that times its calls as ``phase``, but
+        only within a sampled run.
+        """
+        def nested_func(*args, **kwargs):
+            weight = self.sampling
+            if not weight or get_ident() != self._owner:
+                return func(*args, **kwargs)
+            self.start(phase, weight)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.stop(phase)
+        return nested_func
+
+    def timed(self, func, phase):
+        """\
+        Return a wrapper for ``func`` that times all of its calls as
+        ``phase``.
+        """
+        def timed_func(*args, **kwargs):
+            if get_ident() != self._owner:
+                return func(*args, **kwargs)
+            self.start(phase)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.stop(phase)
+        return timed_func
+
+    def totals(self):
+        """\
+        Return a ``{phase: (wall, cpu)}`` dict with the estimated seconds
+        spent in each phase so far, including the ones still in progress.
+        """
+        wall_totals, cpu_totals = dict(self.wall), dict(self.cpu)
+        wall, cpu = _wall(), _cpu()
+        inner = None
+        for frame in reversed(self.__stack):
+            frame = list(frame)
+            if inner:
+                for i, t in enumerate(inner):
+                    frame[5 + i] += t
+            est_wall, est_cpu = self.__account(frame, wall, cpu, wall_totals,
+                                               cpu_totals)
+            inner = (wall - frame[3], cpu - frame[4], est_wall, est_cpu)
+        # estimates can make "other" slightly negative
+        return dict((p, (max(wall_totals[p], 0.), max(cpu_totals[p], 0.)))
+                    for p in wall_totals)
+
+    def _get_cpu_counter(self, name):
+        key = (name, "cpu")
+        if key not in self._counters:
+            self._counters[key] = self.ctx.get_counter(
+                self._counter_group, "CPU_%s (ms)" % name.upper()
+            )
+        return self._counters[key]
+
+    def report(self):
+        """\
+        Add the time spent in each phase since the last report to the
+        corresponding counters.
+        """
+        for phase, times in sorted(self.totals().items()):
+            for c, t in zip((self._get_time_counter(phase),
+                             self._get_cpu_counter(phase)), times):
+                ms = int(1000 * t)
+                self.ctx.increment_counter(c, ms - self.__reported.get(c, 0))
+                self.__reported[c] = ms
@@ -71,9 +71,7 @@ def __parser_read_3(parser, f):
 if _is_py3:
     from io import BytesIO as StringIO
     from abc import ABC
-    import configparser
     import pickle
-    import socketserver
     clong = int
     #  something that should be interpreted as a string
     basestring = str
@@ -102,3 +100,20 @@ else:
     iteritems = __iteritems_2
     bintype = str
     ABC = Py2ABC
+
+# rarely needed modules, imported on first access (PEP 562)
+_LAZY_MODULES = frozenset(("configparser", "socketserver"))
+
+
+def __getattr__(name):
+    if name not in _LAZY_MODULES:
+        raise AttributeError("module %r has no attribute %r" % (
+            __name__, name
+        ))
+    value = globals()[name] = __import__(name)
+    return value
+
+
+if _is_py3 and sys.version_info < (3, 7):  # no PEP 562
+    import configparser  # noqa: F811
+    import socketserver  # noqa: F811
@@ -178,8 +178,12 @@ EXTENSION_MODULES = [
     Extension(
         'pydoop.sercore',
         sources=[
+            "src/sercore/arena.cpp",
             "src/sercore/hu_extras.cpp",
+            "src/sercore/ordered.cpp",
+            "src/sercore/partition.cpp",
             "src/sercore/sercore.cpp",
+            "src/sercore/shm.cpp",
             "src/sercore/streams.cpp",
             "src/sercore/HadoopUtils/SerialUtils.cc",
         ],
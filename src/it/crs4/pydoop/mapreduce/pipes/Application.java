@@ -63,6 +63,7 @@ import org.apache.hadoop.mapreduce.security.TokenCache;
 import org.apache.hadoop.mapreduce.security.token.JobTokenIdentifier;
 import org.apache.hadoop.mapreduce.security.token.JobTokenSecretManager;
 import org.apache.hadoop.mapreduce.lib.output.FileOutputCommitter;
+import org.apache.hadoop.net.unix.DomainSocket;
 import org.apache.hadoop.security.token.Token;
 import org.apache.hadoop.util.ReflectionUtils;
 import org.apache.hadoop.util.StringUtils;
@@ -77,10 +78,16 @@ class Application<K1 extends Writable, V1 extends Writable,
     private ServerSocket serverSocket;
     private Process process;
     private Socket clientSocket;
+    private DomainSocket domainServerSocket;
+    private DomainSocket domainClientSocket;
+    private File domainSocketFile;
+    private ShmRing downRing;
+    private ShmRing upRing;
     private OutputHandler<K2, V2> handler;
     private DownwardProtocol<K1, V1> downlink;
     static final boolean WINDOWS 
         = System.getProperty("os.name").startsWith("Windows");
+    private static final File SHM_DIR = new File("/dev/shm");
 
     /**
      * Start the child process to handle the task for us.
@@ -97,11 +104,26 @@ class Application<K1 extends Writable, V1 extends Writable,
           conf.set(MRJobConfig.TASK_OUTPUT_DIR,
                    ((FileOutputCommitter)committer).getWorkPath().toString());
         }
-        serverSocket = new ServerSocket(0);
         Map<String, String> env = new HashMap<String,String>();
         // add TMPDIR environment variable with the value of java.io.tmpdir
         env.put("TMPDIR", System.getProperty("java.io.tmpdir"));
-        env.put(Submitter.PORT, Integer.toString(serverSocket.getLocalPort()));
+        if (Submitter.getUseSharedMemory(conf)) {
+            createRings(context.getTaskAttemptID(),
+                        Submitter.getSharedMemoryCapacity(conf));
+        }
+        if (downRing == null && Submitter.getUseUnixSocket(conf)) {
+            bindDomainSocket(context.getTaskAttemptID());
+        }
+        if (downRing != null) {
+            env.put(Submitter.SHM_DOWNLINK, downRing.getFile().getPath());
+            env.put(Submitter.SHM_UPLINK, upRing.getFile().getPath());
+        } else if (domainServerSocket != null) {
+            env.put(Submitter.SOCKET_PATH, domainSocketFile.getPath());
+        } else {
+            serverSocket = new ServerSocket(0);
+            env.put(Submitter.PORT,
+                    Integer.toString(serverSocket.getLocalPort()));
+        }
     
         //Add token to the environment if security is enabled
         Token<JobTokenIdentifier> jobToken = 
@@ -138,7 +160,6 @@ class Application<K1 extends Writable, V1 extends Writable,
         cmd = TaskLog.captureOutAndError(null, cmd, stdout, stderr, logLength,
                                          false);
         process = runClient(cmd, env);
-        clientSocket = serverSocket.accept();
     
         String challenge = getSecurityChallenge();
         String digestToSend = createDigest(password, challenge);
@@ -149,8 +170,23 @@ class Application<K1 extends Writable, V1 extends Writable,
             ReflectionUtils.newInstance(context.getOutputKeyClass(), conf);
         V2 outputValue = (V2) 
             ReflectionUtils.newInstance(context.getOutputValueClass(), conf);
-        downlink = new BinaryProtocol<K1, V1, K2, V2>(clientSocket, handler, 
-                                                      outputKey, outputValue, conf);
+        if (downRing != null) {
+            downRing.setPeer(process);
+            upRing.setPeer(process);
+            downlink = new BinaryProtocol<K1, V1, K2, V2>(
+                upRing.getInputStream(), downRing.getOutputStream(),
+                handler, outputKey, outputValue, conf);
+        } else if (domainServerSocket != null) {
+            domainClientSocket = domainServerSocket.accept();
+            downlink = new BinaryProtocol<K1, V1, K2, V2>(
+                domainClientSocket.getInputStream(),
+                domainClientSocket.getOutputStream(),
+                handler, outputKey, outputValue, conf);
+        } else {
+            clientSocket = serverSocket.accept();
+            downlink = new BinaryProtocol<K1, V1, K2, V2>(clientSocket, handler, 
+                                                          outputKey, outputValue, conf);
+        }
 
         downlink.authenticate(digestToSend, challenge);
         waitForAuthentication();
@@ -159,6 +195,70 @@ class Application<K1 extends Writable, V1 extends Writable,
         downlink.setJobConf(conf); 
     }
 
+    /**
+     * Try to create a Unix domain socket for talking to the child process.
+     * On failure, leave domainServerSocket unset, so that we fall back to
+     * TCP. The socket file is created in the working directory, with a
+     * relative path, to stay within the (short) max socket path length.
+     * @param taskid the current task attempt id
+     */
+    private void bindDomainSocket(TaskAttemptID taskid) {
+        String reason = DomainSocket.getLoadingFailureReason();
+        if (reason != null) {
+            LOG.warn("Unix domain sockets not available (" + reason
+                     + "), using TCP");
+            return;
+        }
+        File f = new File("pipes_" + taskid + ".sock");
+        try {
+            f.delete();  // stale file from a previous attempt
+            domainServerSocket = DomainSocket.bindAndListen(f.getPath());
+            domainSocketFile = f;
+        } catch (IOException e) {
+            LOG.warn("could not create Unix domain socket " + f
+                     + ", using TCP", e);
+        }
+    }
+
+    /**
+     * Try to create the shared memory ring buffers for talking to the child
+     * process. On failure, leave them unset, so that we fall back to a
+     * socket. The files are created in /dev/shm if possible, otherwise in
+     * the working directory.
+     * @param taskid the current task attempt id
+     * @param capacity the size of each ring buffer
+     */
+    private void createRings(TaskAttemptID taskid, int capacity) {
+        String reason = ShmRing.getLoadingFailureReason();
+        if (reason != null) {
+            LOG.warn("shared memory not available (" + reason
+                     + "), using a socket");
+            return;
+        }
+        File dir = (SHM_DIR.isDirectory() && SHM_DIR.canWrite()) ?
+            SHM_DIR : new File(".").getAbsoluteFile();
+        String prefix = "pydoop_pipes_" + taskid;
+        ShmRing down = null;
+        ShmRing up = null;
+        try {
+            down = ShmRing.create(new File(dir, prefix + "_down"),
+                                  capacity, true);
+            up = ShmRing.create(new File(dir, prefix + "_up"),
+                                capacity, false);
+        } catch (IOException e) {
+            LOG.warn("could not create shared memory rings in " + dir
+                     + ", using a socket", e);
+        } finally {
+            // on any failure, close (and delete) the ring that was created
+            if (up == null && down != null) {
+                down.close();
+                down = null;
+            }
+        }
+        downRing = down;
+        upRing = up;
+    }
+
     private String getSecurityChallenge() {
         Random rand = new Random(System.currentTimeMillis());
         //Use 4 random integers so as to have 16 random bytes.
@@ -240,12 +340,24 @@ class Application<K1 extends Writable, V1 extends Writable,
      * @throws IOException
      */
     void cleanup() throws IOException {
-        serverSocket.close();
+        if (serverSocket != null) {
+            serverSocket.close();
+        }
+        if (domainServerSocket != null) {
+            domainServerSocket.close();
+            domainSocketFile.delete();
+        }
         try {
             downlink.close();
         } catch (InterruptedException ie) {
             Thread.currentThread().interrupt();
-        }      
+        } finally {
+            // no-op if already closed by the downlink
+            if (downRing != null) {
+                downRing.close();
+                upRing.close();
+            }
+        }
     }
 
     /**
@@ -238,15 +238,35 @@ class BinaryProtocol<K1 extends Writable, V1 extends Writable,
                           K2 key,
                           V2 value,
                           Configuration config) throws IOException {
-        OutputStream raw = sock.getOutputStream();
+        this(sock.getInputStream(), sock.getOutputStream(), handler, key,
+             value, config);
+    }
+
+    /**
+     * Create a proxy object that will speak the binary protocol on the
+     * given streams (e.g., those of a Unix domain socket).
+     * @param in The stream to read upward messages from.
+     * @param out The stream to write downward messages to.
+     * @param handler The handler for the received messages.
+     * @param key The object to read keys into.
+     * @param value The object to read values into.
+     * @param config The job's configuration
+     * @throws IOException
+     */
+    public BinaryProtocol(InputStream in,
+                          OutputStream out,
+                          UpwardProtocol<K2, V2> handler,
+                          K2 key,
+                          V2 value,
+                          Configuration config) throws IOException {
+        OutputStream raw = out;
         // If we are debugging, save a copy of the downlink commands to a file
         if (Submitter.getKeepCommandFile(config)) {
             raw = new TeeOutputStream("downlink.data", raw);
         }
         stream = new DataOutputStream(new BufferedOutputStream(raw, 
                                                                BUFFER_SIZE)) ;
-        uplink = new UplinkReaderThread<K2, V2>(sock.getInputStream(),
-                                                handler, key, value);
+        uplink = new UplinkReaderThread<K2, V2>(in, handler, key, value);
         uplink.setName("pipe-uplink-handler");
         uplink.start();
     }
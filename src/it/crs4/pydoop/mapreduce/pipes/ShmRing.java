@@ -0,0 +1,381 @@
+/**
+ * Licensed to the Apache Software Foundation (ASF) under one
+ * or more contributor license agreements.  See the NOTICE file
+ * distributed with this work for additional information
+ * regarding copyright ownership.  The ASF licenses this file
+ * to you under the Apache License, Version 2.0 (the
+ * "License"); you may not use this file except in compliance
+ * with the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package it.crs4.pydoop.mapreduce.pipes;
+
+import java.io.Closeable;
+import java.io.File;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.InterruptedIOException;
+import java.io.OutputStream;
+import java.lang.reflect.Field;
+import java.nio.Buffer;
+import java.nio.MappedByteBuffer;
+import java.nio.channels.FileChannel;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.StandardOpenOption;
+import java.nio.file.attribute.FileAttribute;
+import java.nio.file.attribute.PosixFilePermission;
+import java.nio.file.attribute.PosixFilePermissions;
+import java.util.Set;
+import java.util.concurrent.locks.LockSupport;
+
+import sun.misc.Unsafe;
+
+/**
+ * A single-producer, single-consumer byte ring buffer in a memory-mapped
+ * file, shared with the child process. See src/sercore/shm.h for the
+ * layout, which must be kept in sync with the one used here.
+ *
+ * There are no kernel wakeups: a side that has to wait spins for a while,
+ * then yields, then sleeps for increasingly longer intervals. A side also
+ * stops waiting when the other one is closed, or when the peer process (if
+ * set) exits.
+ */
+class ShmRing implements Closeable {
+
+    private static final int MAGIC = 0x50445242;  // "PDRB"
+    private static final int VERSION = 1;
+
+    private static final int MAGIC_OFFSET = 0;
+    private static final int VERSION_OFFSET = 4;
+    private static final int CAPACITY_OFFSET = 8;
+    private static final int HEAD_OFFSET = 64;
+    private static final int TAIL_OFFSET = 128;
+    private static final int PRODUCER_CLOSED_OFFSET = 192;
+    private static final int CONSUMER_CLOSED_OFFSET = 196;
+    private static final int HEADER_SIZE = 256;
+
+    private static final int SPIN_ROUNDS = 1000;
+    private static final int YIELD_ROUNDS = 2000;  // including the spin ones
+    private static final long MIN_SLEEP_NS = 10000;
+    private static final long MAX_SLEEP_NS = 1000000;
+
+    // busy-waiting only makes sense if the other side can run at the same
+    // time
+    private static final int spinRounds =
+        (Runtime.getRuntime().availableProcessors() > 1) ? SPIN_ROUNDS : 0;
+
+    // ring files hold task records and the authentication handshake
+    private static final FileAttribute<Set<PosixFilePermission>>
+        OWNER_ONLY = PosixFilePermissions.asFileAttribute(
+            PosixFilePermissions.fromString("rw-------"));
+
+    private static final Unsafe UNSAFE;
+    private static final long BYTE_ARRAY_OFFSET;
+    // offset of java.nio.Buffer.address, the start of a direct buffer's
+    // memory (sun.nio.ch.DirectBuffer is not exported on JDK 9+)
+    private static final long BUFFER_ADDRESS_OFFSET;
+    private static final String loadingFailureReason;
+
+    static {
+        Unsafe unsafe = null;
+        long addressOffset = 0;
+        String reason = null;
+        try {
+            Field f = Unsafe.class.getDeclaredField("theUnsafe");
+            f.setAccessible(true);
+            unsafe = (Unsafe) f.get(null);
+        } catch (Throwable t) {
+            reason = "cannot access sun.misc.Unsafe: " + t;
+        }
+        if (unsafe != null) {
+            try {
+                addressOffset = unsafe.objectFieldOffset(
+                    Buffer.class.getDeclaredField("address"));
+            } catch (Throwable t) {
+                unsafe = null;
+                reason = "cannot get direct buffer addresses: " + t;
+            }
+        }
+        UNSAFE = unsafe;
+        BYTE_ARRAY_OFFSET = (unsafe == null) ?
+            0 : unsafe.arrayBaseOffset(byte[].class);
+        BUFFER_ADDRESS_OFFSET = addressOffset;
+        loadingFailureReason = reason;
+    }
+
+    private final File file;
+    private final MappedByteBuffer buffer;  // keeps the mapping alive
+    private final long address;
+    private final int capacity;
+    private final boolean writer;
+    private volatile Process peer;
+    private volatile boolean closed;
+
+    /**
+     * @return null if shared memory rings can be used, otherwise the reason
+     * why they can't.
+     */
+    static String getLoadingFailureReason() {
+        return loadingFailureReason;
+    }
+
+    /**
+     * Create the given file, readable and writable only by the owner, and
+     * initialize a ring in it. Fails if the file already exists. The file
+     * is deleted if the ring cannot be created.
+     * @param file the file to map, preferably on a tmpfs
+     * @param capacity the size of the data area in bytes
+     * @param writer will we write to this ring (or read from it)?
+     * @return the new ring
+     * @throws IOException
+     */
+    static ShmRing create(File file, int capacity, boolean writer)
+        throws IOException {
+        if (loadingFailureReason != null) {
+            throw new IOException(loadingFailureReason);
+        }
+        if (capacity <= 0) {
+            throw new IllegalArgumentException("invalid capacity: " + capacity);
+        }
+        Path path = file.toPath();
+        try {
+            // O_EXCL: don't reuse a file someone else may have opened
+            Files.createFile(path, OWNER_ONLY);
+        } catch (UnsupportedOperationException e) {
+            throw new IOException("cannot restrict permissions of " + file, e);
+        }
+        ShmRing ring = null;
+        try {
+            FileChannel channel = FileChannel.open(
+                path, StandardOpenOption.READ, StandardOpenOption.WRITE);
+            try {
+                // the file is extended to the mapped size
+                MappedByteBuffer buffer = channel.map(
+                    FileChannel.MapMode.READ_WRITE, 0,
+                    HEADER_SIZE + (long) capacity);
+                ring = new ShmRing(file, buffer, capacity, writer);
+            } finally {
+                channel.close();
+            }
+        } finally {
+            if (ring == null) {
+                file.delete();
+            }
+        }
+        return ring;
+    }
+
+    private ShmRing(File file, MappedByteBuffer buffer, int capacity,
+                    boolean writer) {
+        this.file = file;
+        this.buffer = buffer;
+        this.address = UNSAFE.getLong(buffer, BUFFER_ADDRESS_OFFSET);
+        this.capacity = capacity;
+        this.writer = writer;
+        UNSAFE.setMemory(address, HEADER_SIZE, (byte) 0);
+        UNSAFE.putLong(address + CAPACITY_OFFSET, capacity);
+        UNSAFE.putInt(address + VERSION_OFFSET, VERSION);
+        UNSAFE.putIntVolatile(null, address + MAGIC_OFFSET, MAGIC);
+    }
+
+    File getFile() {
+        return file;
+    }
+
+    /**
+     * Stop waiting for the other side when the given process exits.
+     * @param peer the process at the other end of the ring
+     */
+    void setPeer(Process peer) {
+        this.peer = peer;
+    }
+
+    /**
+     * @return a stream that reads from this ring (which must not be a
+     * writer one)
+     */
+    InputStream getInputStream() {
+        if (writer) {
+            throw new IllegalStateException("not a reader ring");
+        }
+        return new InputStream() {
+            private final byte[] oneByte = new byte[1];
+
+            @Override
+            public int read() throws IOException {
+                return (ShmRing.this.read(oneByte, 0, 1) == -1) ?
+                    -1 : (oneByte[0] & 0xff);
+            }
+
+            @Override
+            public int read(byte[] b, int off, int len) throws IOException {
+                return ShmRing.this.read(b, off, len);
+            }
+
+            @Override
+            public void close() {
+                ShmRing.this.close();
+            }
+        };
+    }
+
+    /**
+     * @return a stream that writes to this ring (which must not be a
+     * reader one)
+     */
+    OutputStream getOutputStream() {
+        if (!writer) {
+            throw new IllegalStateException("not a writer ring");
+        }
+        return new OutputStream() {
+            private final byte[] oneByte = new byte[1];
+
+            @Override
+            public void write(int b) throws IOException {
+                oneByte[0] = (byte) b;
+                ShmRing.this.write(oneByte, 0, 1);
+            }
+
+            @Override
+            public void write(byte[] b, int off, int len) throws IOException {
+                ShmRing.this.write(b, off, len);
+            }
+
+            @Override
+            public void close() {
+                ShmRing.this.close();
+            }
+        };
+    }
+
+    private int read(byte[] b, int off, int len) throws IOException {
+        checkBounds(b, off, len);
+        if (closed) {
+            throw new IOException("ring closed");
+        }
+        if (len == 0) {
+            return 0;
+        }
+        long tail = UNSAFE.getLong(address + TAIL_OFFSET);  // only ours
+        long head;
+        int round = 0;
+        while ((head = getLongVolatile(HEAD_OFFSET)) == tail) {
+            // check the head again, the producer might have closed after
+            // writing
+            if (peerGone(round) && getLongVolatile(HEAD_OFFSET) == tail) {
+                return -1;
+            }
+            backoff(round++);
+        }
+        int n = (int) Math.min(len, head - tail);
+        int pos = (int) (tail % capacity);
+        int first = Math.min(n, capacity - pos);
+        long data = address + HEADER_SIZE;
+        UNSAFE.copyMemory(null, data + pos, b, BYTE_ARRAY_OFFSET + off, first);
+        UNSAFE.copyMemory(null, data, b, BYTE_ARRAY_OFFSET + off + first,
+                          n - first);
+        UNSAFE.putOrderedLong(null, address + TAIL_OFFSET, tail + n);
+        return n;
+    }
+
+    private void write(byte[] b, int off, int len) throws IOException {
+        checkBounds(b, off, len);
+        if (closed) {
+            throw new IOException("ring closed");
+        }
+        if (peerGone(0)) {
+            throw new IOException("ring consumer has gone away");
+        }
+        long head = UNSAFE.getLong(address + HEAD_OFFSET);  // only ours
+        long data = address + HEADER_SIZE;
+        while (len > 0) {
+            long avail;
+            int round = 0;
+            while ((avail = capacity - (head - getLongVolatile(TAIL_OFFSET)))
+                   == 0) {
+                if (peerGone(round)) {
+                    throw new IOException("ring consumer has gone away");
+                }
+                backoff(round++);
+            }
+            int n = (int) Math.min(len, avail);
+            int pos = (int) (head % capacity);
+            int first = Math.min(n, capacity - pos);
+            UNSAFE.copyMemory(b, BYTE_ARRAY_OFFSET + off, null, data + pos,
+                              first);
+            UNSAFE.copyMemory(b, BYTE_ARRAY_OFFSET + off + first, null, data,
+                              n - first);
+            head += n;
+            UNSAFE.putOrderedLong(null, address + HEAD_OFFSET, head);
+            off += n;
+            len -= n;
+        }
+    }
+
+    /**
+     * Mark this side of the ring as closed. The file is deleted (the
+     * mapping stays valid for the other side).
+     */
+    @Override
+    public void close() {
+        if (!closed) {
+            closed = true;
+            UNSAFE.putIntVolatile(null, address + (writer ?
+                PRODUCER_CLOSED_OFFSET : CONSUMER_CLOSED_OFFSET), 1);
+            file.delete();
+        }
+    }
+
+    private long getLongVolatile(int offset) {
+        return UNSAFE.getLongVolatile(null, address + offset);
+    }
+
+    // checking the peer process is relatively expensive, so we only do it
+    // while sleeping
+    private boolean peerGone(int round) {
+        if (UNSAFE.getIntVolatile(null, address + (writer ?
+                CONSUMER_CLOSED_OFFSET : PRODUCER_CLOSED_OFFSET)) != 0) {
+            return true;
+        }
+        Process p = peer;
+        if (round < YIELD_ROUNDS || p == null) {
+            return false;
+        }
+        try {
+            p.exitValue();
+            return true;
+        } catch (IllegalThreadStateException e) {
+            return false;
+        }
+    }
+
+    private static void backoff(int round) throws InterruptedIOException {
+        if (round < spinRounds) {
+            return;
+        }
+        if (Thread.currentThread().isInterrupted()) {
+            throw new InterruptedIOException("interrupted while waiting");
+        }
+        if (round < YIELD_ROUNDS) {
+            Thread.yield();
+        } else {
+            int shift = Math.min(round - YIELD_ROUNDS, 7);
+            LockSupport.parkNanos(Math.min(MIN_SLEEP_NS << shift,
+                                           MAX_SLEEP_NS));
+        }
+    }
+
+    private static void checkBounds(byte[] b, int off, int len) {
+        if (off < 0 || len < 0 || len > b.length - off) {
+            throw new IndexOutOfBoundsException();
+        }
+    }
+}
@@ -158,6 +158,16 @@ public class Submitter extends Configured implements Tool {
   public static final String INPUT_FORMAT = "mapreduce.pipes.inputformat";
   public static final String OUTPUT_FORMAT = "mapreduce.pipes.outputformat";
   public static final String PORT = "mapreduce.pipes.command.port";
+  public static final String SOCKET_PATH = "mapreduce.pipes.command.socket";
+  public static final String UNIX_SOCKET =
+      "pydoop.mapreduce.pipes.unix.socket";
+  public static final String SHM_DOWNLINK =
+      "mapreduce.pipes.command.shm.downlink";
+  public static final String SHM_UPLINK = "mapreduce.pipes.command.shm.uplink";
+  public static final String SHARED_MEMORY = "pydoop.mapreduce.pipes.shm";
+  public static final String SHM_CAPACITY =
+      "pydoop.mapreduce.pipes.shm.capacity";
+  public static final int DEFAULT_SHM_CAPACITY = 4 * 1024 * 1024;
 
   public static Properties getPydoopProperties() {
     Properties properties = new Properties();
@@ -308,6 +318,55 @@ public class Submitter extends Configured implements Tool {
     return conf.getClassByName(cl.getOptionValue(key)).asSubclass(cls);
   }
 
+  /**
+   * Should the child process be contacted via a Unix domain socket rather
+   * than a TCP socket? This requires the native hadoop library: if it's not
+   * available, or if the socket cannot be created, TCP is used instead.
+   * @param conf the configuration to check
+   * @return is a Unix domain socket requested?
+   */
+  public static boolean getUseUnixSocket(Configuration conf) {
+    return conf.getBoolean(Submitter.UNIX_SOCKET, false);
+  }
+
+  /**
+   * Set whether to use a Unix domain socket to talk to the child process.
+   * @param conf the configuration to modify
+   * @param value the new value
+   */
+  public static void setUseUnixSocket(Configuration conf, boolean value) {
+    conf.setBoolean(Submitter.UNIX_SOCKET, value);
+  }
+
+  /**
+   * Should the child process be contacted via a pair of shared memory ring
+   * buffers rather than a socket? If the buffers cannot be created, a
+   * socket is used instead.
+   * @param conf the configuration to check
+   * @return is shared memory requested?
+   */
+  public static boolean getUseSharedMemory(Configuration conf) {
+    return conf.getBoolean(Submitter.SHARED_MEMORY, false);
+  }
+
+  /**
+   * Set whether to use shared memory to talk to the child process.
+   * @param conf the configuration to modify
+   * @param value the new value
+   */
+  public static void setUseSharedMemory(Configuration conf, boolean value) {
+    conf.setBoolean(Submitter.SHARED_MEMORY, value);
+  }
+
+  /**
+   * Get the size of the data area of each shared memory ring buffer.
+   * @param conf the configuration to check
+   * @return the ring buffer capacity in bytes
+   */
+  public static int getSharedMemoryCapacity(Configuration conf) {
+    return conf.getInt(Submitter.SHM_CAPACITY, DEFAULT_SHM_CAPACITY);
+  }
+
   /**
    * Does the user want to keep the command file for debugging? If
    * this is true, pipes will write a copy of the command data to a
@@ -73,6 +73,15 @@ namespace HadoopUtils {
     }
   }
 
+  int FileInStream::peek()
+  {
+    int c = getc(mFile);
+    if (c != EOF) {
+      ungetc(c, mFile);
+    }
+    return c;
+  }
+
   bool FileInStream::skip(size_t nbytes)
   {
     return (0==fseek(mFile, nbytes, SEEK_CUR));
@@ -279,19 +288,9 @@ namespace HadoopUtils {
   {
     int32_t len = deserializeInt(stream);
     if (len > 0) {
-      // resize the string to the right length
+      // resize the string to the right length and read directly into it
       t.resize(len);
-      // read into the string in 64k chunks
-      const int bufSize = 65536;
-      int offset = 0;
-      char buf[bufSize];
-      while (len > 0) {
-        int chunkLength = len > bufSize ? bufSize : len;
-        stream.read(buf, chunkLength);
-        t.replace(offset, chunkLength, buf, chunkLength);
-        offset += chunkLength;
-        len -= chunkLength;
-      }
+      stream.read(&t[0], len);
     } else {
       t.clear();
     }
@@ -105,6 +105,10 @@ namespace HadoopUtils {
     bool open(const std::string& name);
     bool open(FILE* file);
     void read(void *buf, size_t buflen);
+    /**
+     * Return the next byte without consuming it, or EOF.
+     */
+    int peek();
     bool skip(size_t nbytes);
     bool close();
     virtual ~FileInStream();
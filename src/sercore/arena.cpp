@@ -0,0 +1,153 @@
+// BEGIN_COPYRIGHT
+//
+// Copyright 2009-2019 CRS4.
+//
+// Licensed under the Apache License, Version 2.0 (the "License"); you may not
+// use this file except in compliance with the License. You may obtain a copy
+// of the License at
+//
+//   http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+// WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+// License for the specific language governing permissions and limitations
+// under the License.
+//
+// END_COPYRIGHT
+
+#define PY_SSIZE_T_CLEAN  // must be defined before including Python.h
+
+#include <Python.h>
+
+#include <algorithm>
+#include <new>
+
+#include "arena.h"
+
+// max number of standard-size blocks kept for reuse
+#define ARENA_POOL_SIZE 4
+
+
+Arena::Arena(std::size_t block_size) : block_size(block_size), offset(0) {}
+
+
+char *
+Arena::alloc(std::size_t len, std::shared_ptr<ArenaBlock>& block) {
+  if (!current || offset + len > current->size) {
+    current.reset();
+    for (auto& b : pool) {
+      if (b.use_count() == 1 && b->size >= len) {
+        current = b;
+        break;
+      }
+    }
+    if (!current) {
+      current = std::make_shared<ArenaBlock>(std::max(block_size, len));
+      if (current->size == block_size && pool.size() < ARENA_POOL_SIZE) {
+        pool.push_back(current);
+      }
+    }
+    offset = 0;
+  }
+  block = current;
+  char *rval = current->data.get() + offset;
+  offset += len;
+  return rval;
+}
+
+
+// Memory is allocated by PyType_GenericAlloc, so we have to explicitly run
+// the constructor and destructor of the C++ member.
+
+PyObject *
+ArenaBuffer_New(const std::shared_ptr<ArenaBlock>& block) {
+  ArenaBufferObj *self;
+  self = PyObject_New(ArenaBufferObj, &ArenaBufferType);
+  if (!self) {
+    return NULL;
+  }
+  new (&self->block) std::shared_ptr<ArenaBlock>(block);
+  self->next_buf = NULL;
+  self->next_len = 0;
+  return (PyObject*)self;
+}
+
+
+static void
+ArenaBuffer_dealloc(ArenaBufferObj *self) {
+  self->block.~shared_ptr<ArenaBlock>();
+  PyObject_Del(self);
+}
+
+
+// The buffer protocol has no notion of offsets, so ArenaBuffer_View sets the
+// boundaries of the next export right before creating the memoryview. Any
+// other attempt to get a buffer from the exporter fails.
+static int
+ArenaBuffer_getbuffer(ArenaBufferObj *self, Py_buffer *view, int flags) {
+  if (!self->next_buf) {
+    PyErr_SetString(PyExc_BufferError, "arena buffers cannot be re-exported");
+    view->obj = NULL;
+    return -1;
+  }
+  int rval = PyBuffer_FillInfo(
+    view, (PyObject*)self, self->next_buf, self->next_len, 1, flags
+  );
+  self->next_buf = NULL;
+  self->next_len = 0;
+  return rval;
+}
+
+
+PyObject *
+ArenaBuffer_View(PyObject *exporter, char *buf, std::size_t len) {
+  ArenaBufferObj *self = (ArenaBufferObj*)exporter;
+  self->next_buf = buf;
+  self->next_len = len;
+  PyObject *rval = PyMemoryView_FromObject(exporter);
+  self->next_buf = NULL;
+  self->next_len = 0;
+  return rval;
+}
+
+
+static PyBufferProcs ArenaBuffer_as_buffer = {
+#if PY_MAJOR_VERSION < 3
+  0,                                                  /* bf_getreadbuffer */
+  0,                                                  /* bf_getwritebuffer */
+  0,                                                  /* bf_getsegcount */
+  0,                                                  /* bf_getcharbuffer */
+#endif
+  (getbufferproc)ArenaBuffer_getbuffer,               /* bf_getbuffer */
+  0,                                                  /* bf_releasebuffer */
+};
+
+
+PyTypeObject ArenaBufferType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "sercore.ArenaBuffer",                            /* tp_name */
+    sizeof(ArenaBufferObj),                           /* tp_basicsize */
+    0,                                                /* tp_itemsize */
+    (destructor)ArenaBuffer_dealloc,                  /* tp_dealloc */
+    0,                                                /* tp_print */
+    0,                                                /* tp_getattr */
+    0,                                                /* tp_setattr */
+    0,                                                /* tp_compare */
+    0,                                                /* tp_repr */
+    0,                                                /* tp_as_number */
+    0,                                                /* tp_as_sequence */
+    0,                                                /* tp_as_mapping */
+    0,                                                /* tp_hash */
+    0,                                                /* tp_call */
+    0,                                                /* tp_str */
+    0,                                                /* tp_getattro */
+    0,                                                /* tp_setattro */
+    &ArenaBuffer_as_buffer,                           /* tp_as_buffer */
+#if PY_MAJOR_VERSION < 3
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_NEWBUFFER,   /* tp_flags */
+#else
+    Py_TPFLAGS_DEFAULT,                               /* tp_flags */
+#endif
+    "Memory block holding zero-copy keys and values", /* tp_doc */
+};
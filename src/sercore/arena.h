@@ -0,0 +1,73 @@
+// BEGIN_COPYRIGHT
+//
+// Copyright 2009-2019 CRS4.
+//
+// Licensed under the Apache License, Version 2.0 (the "License"); you may not
+// use this file except in compliance with the License. You may obtain a copy
+// of the License at
+//
+//   http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+// WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+// License for the specific language governing permissions and limitations
+// under the License.
+//
+// END_COPYRIGHT
+
+#pragma once
+
+#include <Python.h>
+#include <cstddef>
+#include <memory>
+#include <vector>
+
+/**
+ * A chunk of memory where raw keys and values are read in zero-copy mode.
+ */
+struct ArenaBlock {
+  explicit ArenaBlock(std::size_t size) : data(new char[size]), size(size) {}
+  std::unique_ptr<char[]> data;
+  std::size_t size;
+};
+
+/**
+ * Hands out memory from a small pool of reusable blocks.
+ *
+ * Each allocation returns, together with the address, a reference to the
+ * block it belongs to: whoever exposes the memory (e.g., a memoryview) must
+ * hold that reference for as long as the memory is in use. A block is
+ * recycled only when the arena holds the sole reference to it. Does not need
+ * the GIL.
+ */
+class Arena {
+public:
+  explicit Arena(std::size_t block_size);
+  char *alloc(std::size_t len, std::shared_ptr<ArenaBlock>& block);
+private:
+  std::size_t block_size;
+  std::size_t offset;
+  std::shared_ptr<ArenaBlock> current;
+  std::vector<std::shared_ptr<ArenaBlock>> pool;
+};
+
+/**
+ * Python-level exporter for an ArenaBlock (see ArenaBuffer_View).
+ */
+typedef struct {
+  PyObject_HEAD
+  std::shared_ptr<ArenaBlock> block;
+  char *next_buf;
+  Py_ssize_t next_len;
+} ArenaBufferObj;
+
+extern PyTypeObject ArenaBufferType;
+
+PyObject *ArenaBuffer_New(const std::shared_ptr<ArenaBlock>& block);
+
+/**
+ * Return a read-only memoryview on [buf, buf + len), which must be within
+ * the exporter's block. The view keeps the block alive until released.
+ */
+PyObject *ArenaBuffer_View(PyObject *exporter, char *buf, std::size_t len);
@@ -16,7 +16,10 @@
 //
 // END_COPYRIGHT
 
+#include <cstring>
+
 #include "HadoopUtils/SerialUtils.hh"
+#include "hu_extras.h"
 
 #define INT64_SIZE sizeof(int64_t)
 
@@ -30,3 +33,47 @@ int64_t deserializeLongWritable(HadoopUtils::InStream& stream) {
   }
   return rval;
 }
+
+
+int32_t deserializeIntWritable(HadoopUtils::InStream& stream) {
+  uint32_t rval = 0;
+  unsigned char bytes[sizeof(int32_t)];
+  stream.read(bytes, sizeof(int32_t));
+  for (std::size_t i = 0; i < sizeof(int32_t); ++i) {
+    rval = (rval << 8) | bytes[i];
+  }
+  return (int32_t)rval;
+}
+
+
+double deserializeDoubleWritable(HadoopUtils::InStream& stream) {
+  uint64_t bits = (uint64_t)deserializeLongWritable(stream);
+  double rval;
+  std::memcpy(&rval, &bits, sizeof(double));
+  return rval;
+}
+
+
+BufferInStream::BufferInStream(const char *buf, std::size_t len) :
+  pos(buf), end(buf + len) {}
+
+
+void BufferInStream::read(void *buf, size_t buflen) {
+  HADOOP_ASSERT(buflen <= remaining(), "unexpected end of buffer reached");
+  std::memcpy(buf, pos, buflen);
+  pos += buflen;
+}
+
+
+std::size_t BufferInStream::remaining() const {
+  return end - pos;
+}
+
+
+void serializeBuffer(const void *buf, std::size_t len,
+                     HadoopUtils::OutStream& stream) {
+  HadoopUtils::serializeInt(len, stream);
+  if (len > 0) {
+    stream.write(buf, len);
+  }
+}
@@ -24,3 +24,33 @@
  * Read a hadoop.io.LongWritable (java.io.DataInput.readLong).
  */
 int64_t deserializeLongWritable(HadoopUtils::InStream& stream);
+
+/**
+ * Read a hadoop.io.IntWritable (java.io.DataInput.readInt).
+ */
+int32_t deserializeIntWritable(HadoopUtils::InStream& stream);
+
+/**
+ * Read a hadoop.io.DoubleWritable (java.io.DataInput.readDouble).
+ */
+double deserializeDoubleWritable(HadoopUtils::InStream& stream);
+
+/**
+ * An InStream over a memory buffer (no copies). Reading past the end of the
+ * buffer throws a HadoopUtils::Error.
+ */
+class BufferInStream: public HadoopUtils::InStream {
+public:
+  BufferInStream(const char *buf, std::size_t len);
+  virtual void read(void *buf, size_t buflen);
+  std::size_t remaining() const;
+private:
+  const char *pos;
+  const char *end;
+};
+
+/**
+ * Same as HadoopUtils::serializeString, but from a raw buffer (no copies).
+ */
+void serializeBuffer(const void *buf, std::size_t len,
+                     HadoopUtils::OutStream& stream);
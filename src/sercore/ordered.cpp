@@ -0,0 +1,491 @@
+// BEGIN_COPYRIGHT
+//
+// Copyright 2009-2019 CRS4.
+//
+// Licensed under the Apache License, Version 2.0 (the "License"); you may not
+// use this file except in compliance with the License. You may obtain a copy
+// of the License at
+//
+//   http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+// WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+// License for the specific language governing permissions and limitations
+// under the License.
+//
+// END_COPYRIGHT
+
+// Encoding format: a type tag, followed by the payload.
+//
+//   int: a header byte with the sign and the number of bytes of the
+//     magnitude, followed by the big-endian magnitude. For negative numbers,
+//     the magnitude is that of ~n, with all bits inverted.
+//   float: the IEEE 754 bits, big-endian, with the sign bit flipped for
+//     positive numbers and all bits flipped for negative ones.
+//   str (utf-8), bytes, pickle: the raw data. Within tuples, each 0x00 byte
+//     is escaped as 0x00 0xff, and the data is terminated by 0x00 0x01.
+//   tuple: the encoded items, followed by 0x00.
+
+#define PY_SSIZE_T_CLEAN  // must be defined before including Python.h
+
+#include <Python.h>
+
+#include <cstdint>
+#include <cstring>
+#include <string>
+
+#include "ordered.h"
+
+#if PY_MAJOR_VERSION < 3
+#define PICKLE_MODULE "cPickle"
+#define BYTES_FMT "s#"
+#else
+#define PICKLE_MODULE "pickle"
+#define BYTES_FMT "y#"
+#endif
+
+static PyObject *pickle_dumps = NULL;
+static PyObject *pickle_loads = NULL;
+static PyObject *pickle_protocol = NULL;
+
+
+static bool
+_import_pickle() {
+  if (pickle_dumps) {
+    return true;
+  }
+  PyObject *mod = PyImport_ImportModule(PICKLE_MODULE);
+  if (!mod) {
+    return false;
+  }
+  pickle_dumps = PyObject_GetAttrString(mod, "dumps");
+  pickle_loads = PyObject_GetAttrString(mod, "loads");
+  pickle_protocol = PyObject_GetAttrString(mod, "HIGHEST_PROTOCOL");
+  Py_DECREF(mod);
+  if (!pickle_dumps || !pickle_loads || !pickle_protocol) {
+    Py_CLEAR(pickle_dumps);
+    Py_CLEAR(pickle_loads);
+    Py_CLEAR(pickle_protocol);
+    return false;
+  }
+  return true;
+}
+
+
+static void
+_append_data(std::string& out, const char *data, std::size_t len,
+             bool nested) {
+  if (!nested) {
+    out.append(data, len);
+    return;
+  }
+  const char *end = data + len;
+  const char *p;
+  while ((p = (const char*)memchr(data, END, end - data))) {
+    out.append(data, p - data);
+    out.push_back((char)END);
+    out.push_back((char)ESC);
+    data = p + 1;
+  }
+  out.append(data, end - data);
+  out.push_back((char)END);
+  out.push_back((char)TERM);
+}
+
+
+static void
+_append_uint(std::string& out, uint64_t c, bool invert) {
+  int len = 0;
+  for (uint64_t x = c; x; x >>= 8) {
+    len++;
+  }
+  out.push_back((char)(invert ? INT_BASE - 1 - len : INT_BASE + len));
+  for (int i = len - 1; i >= 0; --i) {
+    unsigned char b = (c >> (8 * i)) & 0xff;
+    out.push_back((char)(invert ? ~b : b));
+  }
+}
+
+
+// ints that don't fit in 64 bits. Returns 0 on success, -1 on error, 1 if
+// the number is too large (or to_bytes is not available)
+static int
+_append_big_int(std::string& out, PyObject *obj) {
+  PyObject *zero = PyLong_FromLong(0);
+  if (!zero) {
+    return -1;
+  }
+  int negative = PyObject_RichCompareBool(obj, zero, Py_LT);
+  Py_DECREF(zero);
+  if (negative < 0) {
+    return -1;
+  }
+  PyObject *c = negative ? PyNumber_Invert(obj) : (Py_INCREF(obj), obj);
+  if (!c) {
+    return -1;
+  }
+  int rval = 1;
+  PyObject *nbits = NULL, *bytes = NULL;
+  Py_ssize_t len;
+  if (!(nbits = PyObject_CallMethod(c, (char*)"bit_length", NULL))) {
+    rval = -1;
+    goto done;
+  }
+  len = (PyLong_AsSsize_t(nbits) + 7) / 8;
+  if (len > MAX_INT_LEN) {
+    goto done;
+  }
+  if (!(bytes = PyObject_CallMethod(c, (char*)"to_bytes", (char*)"ns",
+                                    len, "big"))) {
+    if (PyErr_ExceptionMatches(PyExc_AttributeError)) {
+      PyErr_Clear();  // Python 2
+    } else {
+      rval = -1;
+    }
+    goto done;
+  }
+  out.push_back((char)(negative ? INT_BASE - 1 - len : INT_BASE + len));
+  for (Py_ssize_t i = 0; i < len; ++i) {
+    char b = PyBytes_AS_STRING(bytes)[i];
+    out.push_back(negative ? ~b : b);
+  }
+  rval = 0;
+done:
+  Py_XDECREF(bytes);
+  Py_XDECREF(nbits);
+  Py_DECREF(c);
+  return rval;
+}
+
+
+static bool
+_encode(std::string& out, PyObject *obj, bool nested) {
+  std::size_t start = out.size();
+  if (PyBytes_CheckExact(obj)) {
+    out.push_back((char)T_BYTES);
+    _append_data(out, PyBytes_AS_STRING(obj), PyBytes_GET_SIZE(obj), nested);
+    return true;
+  }
+  if (PyUnicode_CheckExact(obj)) {
+#if PY_MAJOR_VERSION < 3
+    PyObject *b = PyUnicode_AsUTF8String(obj);
+    if (b) {
+      out.push_back((char)T_STR);
+      _append_data(out, PyBytes_AS_STRING(b), PyBytes_GET_SIZE(b), nested);
+      Py_DECREF(b);
+      return true;
+    }
+#else
+    Py_ssize_t len;
+    const char *data = PyUnicode_AsUTF8AndSize(obj, &len);
+    if (data) {
+      out.push_back((char)T_STR);
+      _append_data(out, data, len, nested);
+      return true;
+    }
+#endif
+    if (!PyErr_ExceptionMatches(PyExc_UnicodeError)) {
+      return false;
+    }
+    PyErr_Clear();  // e.g., lone surrogates: pickle it
+  }
+#if PY_MAJOR_VERSION < 3
+  else if (PyInt_CheckExact(obj)) {
+    long n = PyInt_AS_LONG(obj);
+    out.push_back((char)T_INT);
+    _append_uint(out, n >= 0 ? n : ~n, n < 0);
+    return true;
+  }
+#endif
+  else if (PyLong_CheckExact(obj)) {
+    int overflow;
+    long long n = PyLong_AsLongLongAndOverflow(obj, &overflow);
+    if (n == -1 && PyErr_Occurred()) {
+      return false;
+    }
+    out.push_back((char)T_INT);
+    if (!overflow) {
+      _append_uint(out, n >= 0 ? n : ~n, n < 0);
+      return true;
+    }
+    int res = _append_big_int(out, obj);
+    if (res < 0) {
+      return false;
+    }
+    if (res == 0) {
+      return true;
+    }
+    out.resize(start);
+  } else if (PyFloat_CheckExact(obj)) {
+    double d = PyFloat_AS_DOUBLE(obj);
+    if (d == 0) {
+      d = 0.0;  // -0.0 == 0.0, so they must be encoded the same way
+    }
+    uint64_t bits;
+    memcpy(&bits, &d, sizeof bits);
+    bits = (bits & SIGN_BIT) ? ~bits : bits | SIGN_BIT;
+    out.push_back((char)T_FLOAT);
+    for (int i = 7; i >= 0; --i) {
+      out.push_back((char)((bits >> (8 * i)) & 0xff));
+    }
+    return true;
+  } else if (PyTuple_CheckExact(obj)) {
+    if (Py_EnterRecursiveCall(" while encoding a tuple")) {
+      return false;
+    }
+    out.push_back((char)T_TUPLE);
+    for (Py_ssize_t i = 0; i < PyTuple_GET_SIZE(obj); ++i) {
+      if (!_encode(out, PyTuple_GET_ITEM(obj, i), true)) {
+        Py_LeaveRecursiveCall();
+        return false;
+      }
+    }
+    Py_LeaveRecursiveCall();
+    out.push_back((char)END);
+    return true;
+  }
+  if (!_import_pickle()) {
+    return false;
+  }
+  PyObject *b = PyObject_CallFunctionObjArgs(
+    pickle_dumps, obj, pickle_protocol, NULL
+  );
+  if (!b) {
+    return false;
+  }
+  if (!PyBytes_Check(b)) {
+    Py_DECREF(b);
+    PyErr_SetString(PyExc_TypeError, "pickle.dumps did not return bytes");
+    return false;
+  }
+  out.push_back((char)T_PICKLE);
+  _append_data(out, PyBytes_AS_STRING(b), PyBytes_GET_SIZE(b), nested);
+  Py_DECREF(b);
+  return true;
+}
+
+
+PyObject *
+orderedEncode(PyObject *self, PyObject *args) {
+  PyObject *obj;
+  if (!PyArg_ParseTuple(args, "O", &obj)) {
+    return NULL;
+  }
+  std::string out;
+  if (!_encode(out, obj, false)) {
+    return NULL;
+  }
+  return PyBytes_FromStringAndSize(out.data(), out.size());
+}
+
+
+class Decoder {
+public:
+  Decoder(const char *buf, std::size_t len) :
+    p((const unsigned char*)buf), end((const unsigned char*)buf + len) {}
+  PyObject *decode(bool nested);
+  bool at_end() const { return p == end; }
+private:
+  PyObject *error() {
+    return PyErr_Format(PyExc_ValueError, "bad encoded data");
+  }
+  bool data(const char *&buf, std::size_t& len, std::string& tmp,
+            bool nested);
+  PyObject *decode_int();
+  PyObject *decode_float();
+  PyObject *decode_tuple();
+  const unsigned char *p;
+  const unsigned char *end;
+};
+
+
+// Get the data for a bytes, str or pickle item. At the top level, this is
+// the rest of the buffer; within tuples, it's unescaped into tmp. Sets an
+// exception and returns false if the data is not valid.
+bool
+Decoder::data(const char *&buf, std::size_t& len, std::string& tmp,
+              bool nested) {
+  if (!nested) {
+    buf = (const char*)p;
+    len = end - p;
+    p = end;
+    return true;
+  }
+  while (true) {
+    const unsigned char *q = (const unsigned char*)memchr(p, END, end - p);
+    if (!q || q + 1 >= end || (q[1] != ESC && q[1] != TERM)) {
+      error();
+      return false;
+    }
+    tmp.append((const char*)p, q - p);
+    p = q + 2;
+    if (q[1] == TERM) {
+      buf = tmp.data();
+      len = tmp.size();
+      return true;
+    }
+    tmp.push_back((char)END);
+  }
+}
+
+
+// Steals a reference to obj
+static PyObject *
+_maybe_invert(PyObject *obj, bool invert) {
+  if (!obj || !invert) {
+    return obj;
+  }
+  PyObject *rval = PyNumber_Invert(obj);
+  Py_DECREF(obj);
+  return rval;
+}
+
+
+PyObject *
+Decoder::decode_int() {
+  if (p >= end) {
+    return error();
+  }
+  int h = *p++;
+  bool negative = h < INT_BASE;
+  Py_ssize_t len = negative ? INT_BASE - 1 - h : h - INT_BASE;
+  if (len > end - p) {
+    return error();
+  }
+  const unsigned char *q = p;
+  p += len;
+  if (len <= 8) {
+    uint64_t c = 0;
+    for (; q < p; ++q) {
+      c = (c << 8) | (negative ? (unsigned char)~*q : *q);
+    }
+    if (c <= INT64_MAX) {
+      return PyLong_FromLongLong(negative ? ~(int64_t)c : (int64_t)c);
+    }
+    return _maybe_invert(PyLong_FromUnsignedLongLong(c), negative);
+  }
+  std::string b((const char*)q, len);
+  if (negative) {
+    for (auto& x : b) {
+      x = ~x;
+    }
+  }
+  return _maybe_invert(PyObject_CallMethod(
+    (PyObject*)&PyLong_Type, (char*)"from_bytes", (char*)BYTES_FMT "s",
+    b.data(), (Py_ssize_t)b.size(), "big"
+  ), negative);
+}
+
+
+PyObject *
+Decoder::decode_float() {
+  if (end - p < 8) {
+    return error();
+  }
+  uint64_t bits = 0;
+  for (int i = 0; i < 8; ++i) {
+    bits = (bits << 8) | *p++;
+  }
+  bits = (bits & SIGN_BIT) ? bits ^ SIGN_BIT : ~bits;
+  double d;
+  memcpy(&d, &bits, sizeof d);
+  return PyFloat_FromDouble(d);
+}
+
+
+PyObject *
+Decoder::decode_tuple() {
+  PyObject *items = PyList_New(0);
+  if (!items) {
+    return NULL;
+  }
+  if (Py_EnterRecursiveCall(" while decoding a tuple")) {
+    Py_DECREF(items);
+    return NULL;
+  }
+  while (true) {
+    if (p >= end) {
+      Py_LeaveRecursiveCall();
+      Py_DECREF(items);
+      return error();
+    }
+    if (*p == END) {
+      p++;
+      break;
+    }
+    PyObject *item = decode(true);
+    if (!item || PyList_Append(items, item) < 0) {
+      Py_XDECREF(item);
+      Py_LeaveRecursiveCall();
+      Py_DECREF(items);
+      return NULL;
+    }
+    Py_DECREF(item);
+  }
+  Py_LeaveRecursiveCall();
+  PyObject *rval = PyList_AsTuple(items);
+  Py_DECREF(items);
+  return rval;
+}
+
+
+PyObject *
+Decoder::decode(bool nested) {
+  if (p >= end) {
+    return error();
+  }
+  int tag = *p++;
+  std::string tmp;
+  const char *buf;
+  std::size_t len;
+  switch (tag) {
+  case T_INT:
+    return decode_int();
+  case T_FLOAT:
+    return decode_float();
+  case T_TUPLE:
+    return decode_tuple();
+  case T_BYTES:
+    if (!data(buf, len, tmp, nested)) {
+      return NULL;
+    }
+    return PyBytes_FromStringAndSize(buf, len);
+  case T_STR:
+    if (!data(buf, len, tmp, nested)) {
+      return NULL;
+    }
+    return PyUnicode_DecodeUTF8(buf, len, NULL);
+  case T_PICKLE: {
+    if (!data(buf, len, tmp, nested) || !_import_pickle()) {
+      return NULL;
+    }
+    PyObject *bytes = PyBytes_FromStringAndSize(buf, len);
+    if (!bytes) {
+      return NULL;
+    }
+    PyObject *rval = PyObject_CallFunctionObjArgs(pickle_loads, bytes, NULL);
+    Py_DECREF(bytes);
+    return rval;
+  }
+  default:
+    return PyErr_Format(PyExc_ValueError, "bad type tag: %d", tag);
+  }
+}
+
+
+PyObject *
+orderedDecode(PyObject *self, PyObject *args) {
+  Py_buffer buffer = {NULL, NULL};
+  if (!PyArg_ParseTuple(args, "s*", &buffer)) {
+    return NULL;
+  }
+  Decoder decoder((const char*)buffer.buf, buffer.len);
+  PyObject *rval = decoder.decode(false);
+  if (rval && !decoder.at_end()) {
+    Py_CLEAR(rval);
+    PyErr_SetString(PyExc_ValueError, "trailing data after encoded object");
+  }
+  PyBuffer_Release(&buffer);
+  return rval;
+}
@@ -0,0 +1,48 @@
+// BEGIN_COPYRIGHT
+//
+// Copyright 2009-2019 CRS4.
+//
+// Licensed under the Apache License, Version 2.0 (the "License"); you may not
+// use this file except in compliance with the License. You may obtain a copy
+// of the License at
+//
+//   http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+// WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+// License for the specific language governing permissions and limitations
+// under the License.
+//
+// END_COPYRIGHT
+
+#pragma once
+
+#include <Python.h>
+#include <cstdint>
+
+// the order of tags determines the order of objects of different types
+#define END 0x00  // must sort before any tag
+#define T_INT 0x10
+#define T_FLOAT 0x20
+#define T_STR 0x30
+#define T_BYTES 0x40
+#define T_TUPLE 0x50
+#define T_PICKLE 0xf0
+
+#define ESC 0xff
+#define TERM 0x01
+
+#define INT_BASE 0x80
+#define MAX_INT_LEN 127
+
+#define SIGN_BIT (UINT64_C(1) << 63)
+
+/**
+ * Order-preserving serialization for intermediate keys: for objects of type
+ * bytes, str, int and float, and (nested) tuples of them, the byte-wise
+ * order of encoded objects is the same as the Python order of the original
+ * ones. Anything else is pickled. See pydoop.mapreduce.intermediate.
+ */
+PyObject *orderedEncode(PyObject *self, PyObject *args);
+PyObject *orderedDecode(PyObject *self, PyObject *args);
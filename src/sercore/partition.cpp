@@ -0,0 +1,424 @@
+// BEGIN_COPYRIGHT
+//
+// Copyright 2009-2019 CRS4.
+//
+// Licensed under the Apache License, Version 2.0 (the "License"); you may not
+// use this file except in compliance with the License. You may obtain a copy
+// of the License at
+//
+//   http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+// WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+// License for the specific language governing permissions and limitations
+// under the License.
+//
+// END_COPYRIGHT
+
+#define PY_SSIZE_T_CLEAN  // must be defined before including Python.h
+
+#include <Python.h>
+
+#include <algorithm>
+#include <cmath>
+#include <cstdlib>
+#include <cstring>
+#include <new>
+
+#include "ordered.h"
+#include "partition.h"
+
+
+int32_t
+javaHashBytes(const char *buf, std::size_t len, int32_t seed) {
+  // unsigned arithmetic wraps around like Java's int
+  uint32_t h = seed;
+  for (std::size_t i = 0; i < len; ++i) {
+    h = 31 * h + (uint32_t)(int32_t)(int8_t)buf[i];
+  }
+  return (int32_t)h;
+}
+
+
+static inline int
+_java_mod(int32_t h, int n) {
+  return (h & INT32_MAX) % n;
+}
+
+
+// Return a pointer to the end of the encoded tuple item at p, or NULL if
+// the data is not valid.
+static const unsigned char *
+_skip_item(const unsigned char *p, const unsigned char *end) {
+  if (p >= end) {
+    return NULL;
+  }
+  switch (*p++) {
+  case T_INT: {
+    if (p >= end) {
+      return NULL;
+    }
+    int h = *p++;
+    std::size_t len = h < INT_BASE ? INT_BASE - 1 - h : h - INT_BASE;
+    return len <= (std::size_t)(end - p) ? p + len : NULL;
+  }
+  case T_FLOAT:
+    return end - p >= 8 ? p + 8 : NULL;
+  case T_STR:
+  case T_BYTES:
+  case T_PICKLE:
+    while ((p = (const unsigned char*)memchr(p, END, end - p))) {
+      if (end - p < 2 || (p[1] != TERM && p[1] != ESC)) {
+        return NULL;
+      }
+      p += 2;
+      if (p[-1] == TERM) {
+        return p;
+      }
+    }
+    return NULL;
+  case T_TUPLE:
+    while (p < end && *p != END) {
+      if (!(p = _skip_item(p, end))) {
+        return NULL;
+      }
+    }
+    return p < end ? p + 1 : NULL;
+  default:
+    return NULL;
+  }
+}
+
+
+// Find the byte range spanned by fields [first, last). If the key has
+// fewer than first + 1 fields, the range is empty. Return false if the key
+// is not valid.
+bool
+KeyPartitioner::span(const char *key, std::size_t len, Py_ssize_t first,
+                     Py_ssize_t last, std::size_t& begin,
+                     std::size_t& end) const {
+  if (!sep.empty()) {
+    const char *k_end = key + len;
+    const char *p = key;
+    for (Py_ssize_t i = 0; i < first; ++i) {
+      p = std::search(p, k_end, sep.begin(), sep.end());
+      if (p == k_end) {
+        begin = end = len;
+        return true;
+      }
+      p += sep.size();
+    }
+    begin = p - key;
+    for (Py_ssize_t i = first; i < last; ++i) {
+      const char *q = std::search(p, k_end, sep.begin(), sep.end());
+      end = q - key;
+      if (q == k_end) {
+        break;
+      }
+      p = q + sep.size();
+    }
+    return true;
+  }
+  if (len == 0) {
+    return false;
+  }
+  const unsigned char *b = (const unsigned char*)key;
+  const unsigned char *e = b + len;
+  if (*b != T_TUPLE) {  // a single field
+    begin = first == 0 ? 0 : len;
+    end = len;
+    return true;
+  }
+  const unsigned char *p = b + 1;
+  for (Py_ssize_t i = 0; i < first; ++i) {
+    if (p < e && *p == END) {
+      begin = end = p - b;
+      return true;
+    }
+    if (!(p = _skip_item(p, e))) {
+      return false;
+    }
+  }
+  begin = p - b;
+  for (Py_ssize_t i = first; i < last; ++i) {
+    if (p < e && *p == END) {
+      break;
+    }
+    if (!(p = _skip_item(p, e))) {
+      return false;
+    }
+  }
+  end = p - b;
+  return true;
+}
+
+
+// Get the numeric value of field start
+bool
+KeyPartitioner::value(const char *key, std::size_t len, double& v) const {
+  std::size_t begin, end;
+  if (!span(key, len, start, start + 1, begin, end) || begin == end) {
+    return false;
+  }
+  if (!sep.empty()) {
+    std::string s(key + begin, end - begin);
+    char *endptr;
+    v = strtod(s.c_str(), &endptr);
+    return endptr == s.c_str() + s.size();
+  }
+  const unsigned char *p = (const unsigned char*)key + begin;
+  const unsigned char *e = (const unsigned char*)key + end;
+  if (*p == T_INT && e - p >= 2) {
+    int h = p[1];
+    bool negative = h < INT_BASE;
+    Py_ssize_t n = negative ? INT_BASE - 1 - h : h - INT_BASE;
+    if (n > 8) {
+      v = negative ? -HUGE_VAL : HUGE_VAL;
+      return true;
+    }
+    uint64_t c = 0;
+    for (p += 2; p < e; ++p) {
+      c = (c << 8) | (negative ? (unsigned char)~*p : *p);
+    }
+    // the encoded magnitude of a negative n is that of ~n == -1 - n
+    v = negative ? -1.0 - (double)c : (double)c;
+    return true;
+  }
+  if (*p == T_FLOAT && e - p == 9) {
+    uint64_t bits = 0;
+    for (++p; p < e; ++p) {
+      bits = (bits << 8) | *p;
+    }
+    bits = (bits & SIGN_BIT) ? bits ^ SIGN_BIT : ~bits;
+    memcpy(&v, &bits, sizeof v);
+    return true;
+  }
+  return false;
+}
+
+
+int
+KeyPartitioner::partition(const char *key, std::size_t len, int n) const {
+  std::size_t begin, end;
+  double v;
+  switch (kind) {
+  case FIELDS:
+    if (!span(key, len, start, stop, begin, end)) {
+      return -1;
+    }
+    // KeyFieldBasedPartitioner starts from 0
+    return _java_mod(
+      javaHashBytes(key + begin, end - begin, sep.empty() ? 1 : 0), n
+    );
+  case RANGE:
+    if (!value(key, len, v)) {
+      return -1;
+    }
+    return std::min<std::size_t>(
+      std::upper_bound(splits.begin(), splits.end(), v) - splits.begin(),
+      n - 1
+    );
+  case ORDER: {
+    // upper bound, without copying the key
+    std::size_t lo = 0, hi = split_keys.size();
+    while (lo < hi) {
+      std::size_t mid = lo + (hi - lo) / 2;
+      const std::string& s = split_keys[mid];
+      int c = memcmp(key, s.data(), std::min(len, s.size()));
+      if (c < 0 || (c == 0 && len < s.size())) {
+        hi = mid;
+      } else {
+        lo = mid + 1;
+      }
+    }
+    return std::min<std::size_t>(lo, n - 1);
+  }
+  default:
+    return _java_mod(javaHashBytes(key, len), n);
+  }
+}
+
+
+// explicitly run the constructor and destructor of the C++ member.
+
+static PyObject *
+Partitioner_new(PyTypeObject *type, PyObject *args, PyObject *kwds) {
+  PartitionerObj *self = (PartitionerObj*)type->tp_alloc(type, 0);
+  if (self) {
+    new (&self->p) KeyPartitioner();
+  }
+  return (PyObject*)self;
+}
+
+
+static void
+Partitioner_dealloc(PartitionerObj *self) {
+  self->p.~KeyPartitioner();
+  Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+
+static bool
+_get_splits(PyObject *obj, KeyPartitioner& p) {
+  PyObject *seq = PySequence_Fast(obj, "splits must be a sequence");
+  if (!seq) {
+    return false;
+  }
+  p.splits.clear();
+  p.split_keys.clear();
+  for (Py_ssize_t i = 0; i < PySequence_Fast_GET_SIZE(seq); ++i) {
+    PyObject *item = PySequence_Fast_GET_ITEM(seq, i);
+    bool sorted;
+    if (p.kind == KeyPartitioner::ORDER) {
+      Py_buffer buf;
+      if (PyObject_GetBuffer(item, &buf, PyBUF_SIMPLE) < 0) {
+        Py_DECREF(seq);
+        return false;
+      }
+      p.split_keys.emplace_back((const char*)buf.buf, buf.len);
+      PyBuffer_Release(&buf);
+      sorted = i == 0 || !(p.split_keys[i] < p.split_keys[i - 1]);
+    } else {
+      double d = PyFloat_AsDouble(item);
+      if (d == -1.0 && PyErr_Occurred()) {
+        Py_DECREF(seq);
+        return false;
+      }
+      p.splits.push_back(d);
+      sorted = i == 0 || p.splits[i] >= p.splits[i - 1];
+    }
+    if (!sorted) {
+      Py_DECREF(seq);
+      PyErr_SetString(PyExc_ValueError, "splits must be sorted");
+      return false;
+    }
+  }
+  Py_DECREF(seq);
+  return true;
+}
+
+
+static int
+Partitioner_init(PartitionerObj *self, PyObject *args, PyObject *kwds) {
+  const char *kind = "hash";
+  Py_ssize_t start = 0, stop = PY_SSIZE_T_MAX;
+  const char *sep = NULL;
+  Py_ssize_t sep_len = 0;
+  PyObject *splits = NULL;
+  static char *kwlist[] = {"kind", "start", "stop", "separator", "splits",
+                           NULL};
+  if (!PyArg_ParseTupleAndKeywords(args, kwds, "|snnz#O", kwlist, &kind,
+                                   &start, &stop, &sep, &sep_len, &splits)) {
+    return -1;
+  }
+  KeyPartitioner& p = self->p;
+  if (!strcmp(kind, "hash")) {
+    p.kind = KeyPartitioner::HASH;
+  } else if (!strcmp(kind, "fields")) {
+    p.kind = KeyPartitioner::FIELDS;
+  } else if (!strcmp(kind, "range")) {
+    p.kind = KeyPartitioner::RANGE;
+  } else if (!strcmp(kind, "order")) {
+    p.kind = KeyPartitioner::ORDER;
+  } else {
+    PyErr_Format(PyExc_ValueError, "invalid kind: '%s'", kind);
+    return -1;
+  }
+  if (start < 0 || stop <= start) {
+    PyErr_SetString(PyExc_ValueError, "invalid field range");
+    return -1;
+  }
+  if (sep && !sep_len) {
+    PyErr_SetString(PyExc_ValueError, "separator must not be empty");
+    return -1;
+  }
+  p.start = start;
+  p.stop = stop;
+  p.sep = sep ? std::string(sep, sep_len) : std::string();
+  if (splits && splits != Py_None && !_get_splits(splits, p)) {
+    return -1;
+  }
+  return 0;
+}
+
+
+static PyObject *
+Partitioner_partition(PartitionerObj *self, PyObject *args) {
+  PyObject *pykey;
+  Py_buffer key = {NULL, NULL};
+  int n;
+  if (!PyArg_ParseTuple(args, "Oi", &pykey, &n)) {
+    return NULL;
+  }
+  if (n < 1) {
+    PyErr_SetString(PyExc_ValueError, "number of partitions must be > 0");
+    return NULL;
+  }
+  if (PyObject_GetBuffer(pykey, &key, PyBUF_SIMPLE) < 0) {
+    return NULL;
+  }
+  int part = self->p.partition((const char*)key.buf, key.len, n);
+  PyBuffer_Release(&key);
+  if (part < 0) {
+    PyErr_SetString(PyExc_ValueError, "key not valid for partitioner");
+    return NULL;
+  }
+  return PyLong_FromLong(part);
+}
+
+
+static PyMethodDef Partitioner_methods[] = {
+  {"partition", (PyCFunction)Partitioner_partition, METH_VARARGS,
+   "partition(key, num_partitions): get the partition for the serialized "
+   "key"},
+  {NULL}  /* Sentinel */
+};
+
+
+PyTypeObject PartitionerType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "sercore.Partitioner",                            /* tp_name */
+    sizeof(PartitionerObj),                           /* tp_basicsize */
+    0,                                                /* tp_itemsize */
+    (destructor)Partitioner_dealloc,                  /* tp_dealloc */
+    0,                                                /* tp_print */
+    0,                                                /* tp_getattr */
+    0,                                                /* tp_setattr */
+    0,                                                /* tp_compare */
+    0,                                                /* tp_repr */
+    0,                                                /* tp_as_number */
+    0,                                                /* tp_as_sequence */
+    0,                                                /* tp_as_mapping */
+    0,                                                /* tp_hash */
+    0,                                                /* tp_call */
+    0,                                                /* tp_str */
+    0,                                                /* tp_getattro */
+    0,                                                /* tp_setattro */
+    0,                                                /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT,                               /* tp_flags */
+    "Partitioner([kind[, start[, stop[, separator[, splits]]]]]): compute\n"
+    "the partition of serialized keys. kind is one of 'hash' (whole key,\n"
+    "like Hadoop's HashPartitioner), 'fields' (fields [start, stop)),\n"
+    "'range' (numeric value of field start, compared to splits) and\n"
+    "'order' (whole key, compared byte-wise to splits). If separator is\n"
+    "None, keys are encoded with the ordered codec.",
+                                                      /* tp_doc */
+    0,                                                /* tp_traverse */
+    0,                                                /* tp_clear */
+    0,                                                /* tp_richcompare */
+    0,                                                /* tp_weaklistoffset */
+    0,                                                /* tp_iter */
+    0,                                                /* tp_iternext */
+    Partitioner_methods,                              /* tp_methods */
+    0,                                                /* tp_members */
+    0,                                                /* tp_getset */
+    0,                                                /* tp_base */
+    0,                                                /* tp_dict */
+    0,                                                /* tp_descr_get */
+    0,                                                /* tp_descr_set */
+    0,                                                /* tp_dictoffset */
+    (initproc)Partitioner_init,                       /* tp_init */
+    0,                                                /* tp_alloc */
+    Partitioner_new,                                  /* tp_new */
+};
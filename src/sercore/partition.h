@@ -0,0 +1,71 @@
+// BEGIN_COPYRIGHT
+//
+// Copyright 2009-2019 CRS4.
+//
+// Licensed under the Apache License, Version 2.0 (the "License"); you may not
+// use this file except in compliance with the License. You may obtain a copy
+// of the License at
+//
+//   http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+// WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+// License for the specific language governing permissions and limitations
+// under the License.
+//
+// END_COPYRIGHT
+
+#pragma once
+
+#include <Python.h>
+#include <cstddef>
+#include <cstdint>
+#include <string>
+#include <vector>
+
+/**
+ * Same as org.apache.hadoop.io.WritableComparator.hashBytes (i.e., the
+ * hashCode of Text and BytesWritable) when seed is 1.
+ */
+int32_t javaHashBytes(const char *buf, std::size_t len, int32_t seed = 1);
+
+/**
+ * Computes the partition of serialized keys. Does not need the GIL.
+ *
+ *   HASH: Java hash of the whole key, as in Hadoop's HashPartitioner.
+ *   FIELDS: hash of fields [start, stop) of the key.
+ *   RANGE: index of the first split point that is greater than the
+ *     (numeric) value of field start.
+ *   ORDER: index of the first split key that is greater than the key
+ *     (compared byte-wise), as in Hadoop's TotalOrderPartitioner.
+ *
+ * If sep is empty, keys are assumed to be encoded with the ordered codec
+ * (see ordered.cpp): fields are the items of a tuple, and other objects are
+ * treated as 1-tuples. Otherwise, keys are text, with fields separated by
+ * sep, and FIELDS hashes them like Hadoop's KeyFieldBasedPartitioner.
+ */
+class KeyPartitioner {
+public:
+  enum Kind {HASH, FIELDS, RANGE, ORDER};
+  KeyPartitioner() : kind(HASH), start(0), stop(PY_SSIZE_T_MAX) {}
+  // return a partition in [0, n), or -1 if the key is not valid
+  int partition(const char *key, std::size_t len, int n) const;
+  Kind kind;
+  std::string sep;
+  Py_ssize_t start;
+  Py_ssize_t stop;
+  std::vector<double> splits;  // sorted
+  std::vector<std::string> split_keys;  // sorted
+private:
+  bool span(const char *key, std::size_t len, Py_ssize_t first,
+            Py_ssize_t last, std::size_t& begin, std::size_t& end) const;
+  bool value(const char *key, std::size_t len, double& v) const;
+};
+
+typedef struct {
+  PyObject_HEAD
+  KeyPartitioner p;
+} PartitionerObj;
+
+extern PyTypeObject PartitionerType;
@@ -18,7 +18,11 @@
 
 #include <Python.h>
 
+#include "arena.h"
 #include "hu_extras.h"
+#include "ordered.h"
+#include "partition.h"
+#include "shm.h"
 #include "streams.h"
 
 const char* m_name = "sercore";
@@ -89,6 +93,10 @@ deserializeFileSplit(PyObject *self, PyObject *args) {
 static PyMethodDef SercoreMethods[] = {
   {"deserialize_file_split", deserializeFileSplit, METH_VARARGS,
    "deserialize_file_split(data): deserialize a Hadoop FileSplit"},
+  {"ordered_encode", orderedEncode, METH_VARARGS,
+   "ordered_encode(obj): serialize obj, preserving order for common types"},
+  {"ordered_decode", orderedDecode, METH_VARARGS,
+   "ordered_decode(data): deserialize data produced by ordered_encode"},
   {NULL}
 };
 
@@ -123,6 +131,18 @@ initsercore(void) {
   if (PyType_Ready(&FileOutStreamType) < 0) {
     INIT_RETURN(NULL);;
   }
+  if (PyType_Ready(&ArenaBufferType) < 0) {
+    INIT_RETURN(NULL);;
+  }
+  if (PyType_Ready(&ReduceValuesType) < 0) {
+    INIT_RETURN(NULL);;
+  }
+  if (PyType_Ready(&ShmRingType) < 0) {
+    INIT_RETURN(NULL);;
+  }
+  if (PyType_Ready(&PartitionerType) < 0) {
+    INIT_RETURN(NULL);;
+  }
 #ifdef PY3
   m = PyModule_Create(&module_def);
 #else
@@ -135,5 +155,9 @@ initsercore(void) {
   PyModule_AddObject(m, "FileInStream", (PyObject *)&FileInStreamType);
   Py_INCREF(&FileOutStreamType);
   PyModule_AddObject(m, "FileOutStream", (PyObject *)&FileOutStreamType);
+  Py_INCREF(&ShmRingType);
+  PyModule_AddObject(m, "ShmRing", (PyObject *)&ShmRingType);
+  Py_INCREF(&PartitionerType);
+  PyModule_AddObject(m, "Partitioner", (PyObject *)&PartitionerType);
   INIT_RETURN(m);
 }
@@ -0,0 +1,446 @@
+// BEGIN_COPYRIGHT
+//
+// Copyright 2009-2019 CRS4.
+//
+// Licensed under the Apache License, Version 2.0 (the "License"); you may not
+// use this file except in compliance with the License. You may obtain a copy
+// of the License at
+//
+//   http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+// WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+// License for the specific language governing permissions and limitations
+// under the License.
+//
+// END_COPYRIGHT
+
+#define PY_SSIZE_T_CLEAN  // must be defined before including Python.h
+
+#include <Python.h>
+
+#include <algorithm>
+#include <cerrno>
+#include <cstring>
+#include <new>
+
+#include <fcntl.h>
+#include <sched.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <time.h>
+#include <unistd.h>
+
+#include "HadoopUtils/SerialUtils.hh"
+#include "shm.h"
+
+#define SHM_MAGIC 0x50445242  // "PDRB"
+#define SHM_VERSION 1
+
+#define MAGIC_OFFSET 0
+#define VERSION_OFFSET 4
+#define CAPACITY_OFFSET 8
+#define HEAD_OFFSET 64
+#define TAIL_OFFSET 128
+#define PRODUCER_CLOSED_OFFSET 192
+#define CONSUMER_CLOSED_OFFSET 196
+#define HEADER_SIZE 256
+
+// wait strategy: busy-wait, then yield, then sleep (doubling the interval)
+#define SPIN_ROUNDS 1000
+#define YIELD_ROUNDS 2000  // including the spin ones
+#define MIN_SLEEP_NS 10000
+#define MAX_SLEEP_NS 1000000
+
+// buffer size for the stdio wrapper
+#define SHM_STDIO_BUFSIZE (64 * 1024)
+
+
+#define FIELD(T, OFFSET) (reinterpret_cast<T*>(base + (OFFSET)))
+
+template <typename T>
+static inline T
+load_acquire(T *p) {
+  return __atomic_load_n(p, __ATOMIC_ACQUIRE);
+}
+
+template <typename T>
+static inline void
+store_release(T *p, T val) {
+  __atomic_store_n(p, val, __ATOMIC_RELEASE);
+}
+
+
+// busy-waiting only makes sense if the other side can run at the same time
+static const unsigned spin_rounds = (
+  sysconf(_SC_NPROCESSORS_ONLN) > 1 ? SPIN_ROUNDS : 0
+);
+
+
+static void
+backoff(unsigned& round) {
+  if (round < spin_rounds) {
+#if defined(__x86_64__) || defined(__i386__)
+    __builtin_ia32_pause();
+#endif
+  } else if (round < YIELD_ROUNDS) {
+    sched_yield();
+  } else {
+    unsigned shift = std::min(round - YIELD_ROUNDS, 7u);
+    long ns = std::min((long)MIN_SLEEP_NS << shift, (long)MAX_SLEEP_NS);
+    struct timespec ts = {0, ns};
+    nanosleep(&ts, NULL);
+  }
+  round++;
+}
+
+
+static std::string
+errorMessage(const std::string& what, const std::string& path) {
+  return what + " " + path + ": " + strerror(errno);
+}
+
+
+ShmRing::ShmRing(const std::string& path, bool writer, std::size_t capacity):
+  base(NULL), map_len(0), capacity(capacity), writer(writer), closed(false),
+  parent(capacity ? 0 : getppid()) {
+  int fd;
+  if (capacity) {
+    fd = open(path.c_str(), O_RDWR | O_CREAT | O_TRUNC, 0600);
+  } else {
+    fd = open(path.c_str(), O_RDWR);
+  }
+  if (fd == -1) {
+    throw HadoopUtils::Error(errorMessage("cannot open", path));
+  }
+  if (capacity) {
+    map_len = HEADER_SIZE + capacity;
+    if (ftruncate(fd, map_len) == -1) {
+      ::close(fd);
+      throw HadoopUtils::Error(errorMessage("cannot resize", path));
+    }
+  } else {
+    struct stat st;
+    if (fstat(fd, &st) == -1) {
+      ::close(fd);
+      throw HadoopUtils::Error(errorMessage("cannot stat", path));
+    }
+    if (st.st_size <= HEADER_SIZE) {
+      ::close(fd);
+      throw HadoopUtils::Error("not a ring buffer: " + path);
+    }
+    map_len = st.st_size;
+  }
+  void *addr = mmap(NULL, map_len, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+  ::close(fd);
+  if (addr == MAP_FAILED) {
+    throw HadoopUtils::Error(errorMessage("cannot map", path));
+  }
+  base = static_cast<char*>(addr);
+  if (capacity) {
+    memset(base, 0, HEADER_SIZE);
+    *FIELD(int64_t, CAPACITY_OFFSET) = capacity;
+    *FIELD(int32_t, VERSION_OFFSET) = SHM_VERSION;
+    store_release(FIELD(int32_t, MAGIC_OFFSET), (int32_t)SHM_MAGIC);
+  } else {
+    this->capacity = *FIELD(int64_t, CAPACITY_OFFSET);
+    if (load_acquire(FIELD(int32_t, MAGIC_OFFSET)) != SHM_MAGIC ||
+        *FIELD(int32_t, VERSION_OFFSET) != SHM_VERSION ||
+        HEADER_SIZE + this->capacity != map_len) {
+      munmap(base, map_len);
+      throw HadoopUtils::Error("not a ring buffer: " + path);
+    }
+  }
+}
+
+
+ShmRing::~ShmRing() {
+  close();
+  munmap(base, map_len);
+}
+
+
+// checking the parent needs a system call, so we only do it while sleeping
+bool
+ShmRing::peerGone(unsigned round) const {
+  if (load_acquire(FIELD(int32_t, writer ?
+                         CONSUMER_CLOSED_OFFSET : PRODUCER_CLOSED_OFFSET))) {
+    return true;
+  }
+  return round >= YIELD_ROUNDS && parent && getppid() != parent;
+}
+
+
+ssize_t
+ShmRing::read(char *buf, std::size_t len) {
+  int64_t *head_p = FIELD(int64_t, HEAD_OFFSET);
+  int64_t *tail_p = FIELD(int64_t, TAIL_OFFSET);
+  int64_t tail = *tail_p;  // only updated by us
+  int64_t head;
+  unsigned round = 0;
+  if (closed) {
+    errno = EBADF;
+    return -1;
+  }
+  if (len == 0) {
+    return 0;
+  }
+  while ((head = load_acquire(head_p)) == tail) {
+    // check the head again, the producer might have closed after writing
+    if (peerGone(round) && load_acquire(head_p) == tail) {
+      return 0;
+    }
+    backoff(round);
+  }
+  std::size_t n = std::min(len, (std::size_t)(head - tail));
+  std::size_t pos = tail % capacity;
+  std::size_t first = std::min(n, capacity - pos);
+  char *data = base + HEADER_SIZE;
+  memcpy(buf, data + pos, first);
+  memcpy(buf + first, data, n - first);
+  store_release(tail_p, tail + (int64_t)n);
+  return n;
+}
+
+
+ssize_t
+ShmRing::write(const char *buf, std::size_t len) {
+  int64_t *head_p = FIELD(int64_t, HEAD_OFFSET);
+  int64_t *tail_p = FIELD(int64_t, TAIL_OFFSET);
+  int64_t head = *head_p;  // only updated by us
+  char *data = base + HEADER_SIZE;
+  std::size_t done = 0;
+  if (closed) {
+    errno = EBADF;
+    return -1;
+  }
+  if (peerGone(0)) {
+    errno = EPIPE;
+    return -1;
+  }
+  while (done < len) {
+    std::size_t avail;
+    unsigned round = 0;
+    while (!(avail = capacity - (head - load_acquire(tail_p)))) {
+      if (peerGone(round)) {
+        errno = EPIPE;
+        return -1;
+      }
+      backoff(round);
+    }
+    std::size_t n = std::min(len - done, avail);
+    std::size_t pos = head % capacity;
+    std::size_t first = std::min(n, capacity - pos);
+    memcpy(data + pos, buf + done, first);
+    memcpy(data, buf + done + first, n - first);
+    head += n;
+    store_release(head_p, head);
+    done += n;
+  }
+  return len;
+}
+
+
+void
+ShmRing::close() {
+  if (!closed) {
+    store_release(FIELD(int32_t, writer ?
+                        PRODUCER_CLOSED_OFFSET : CONSUMER_CLOSED_OFFSET), 1);
+    closed = true;
+  }
+}
+
+
+// stdio wrapper
+
+#ifdef __GLIBC__
+
+static ssize_t
+cookie_read(void *cookie, char *buf, size_t size) {
+  return (*static_cast<std::shared_ptr<ShmRing>*>(cookie))->read(buf, size);
+}
+
+
+static ssize_t
+cookie_write(void *cookie, const char *buf, size_t size) {
+  ssize_t rval = (*static_cast<std::shared_ptr<ShmRing>*>(cookie))->write(
+    buf, size);
+  return rval < 0 ? 0 : rval;  // must not return a negative value
+}
+
+
+static int
+cookie_close(void *cookie) {
+  std::shared_ptr<ShmRing> *ring = static_cast<std::shared_ptr<ShmRing>*>(
+    cookie);
+  (*ring)->close();
+  delete ring;
+  return 0;
+}
+
+
+FILE *
+ShmRing_fopen(const std::shared_ptr<ShmRing>& ring) {
+  cookie_io_functions_t funcs = {NULL, NULL, NULL, cookie_close};
+  const char *mode;
+  if (ring->isWriter()) {
+    funcs.write = cookie_write;
+    mode = "w";
+  } else {
+    funcs.read = cookie_read;
+    mode = "r";
+  }
+  std::shared_ptr<ShmRing> *cookie = new std::shared_ptr<ShmRing>(ring);
+  FILE *fp = fopencookie(cookie, mode, funcs);
+  if (!fp) {
+    delete cookie;
+    PyErr_SetFromErrno(PyExc_IOError);
+    return NULL;
+  }
+  setvbuf(fp, NULL, _IOFBF, SHM_STDIO_BUFSIZE);
+  return fp;
+}
+
+#else
+
+FILE *
+ShmRing_fopen(const std::shared_ptr<ShmRing>& ring) {
+  PyErr_SetString(PyExc_NotImplementedError,
+                  "shared memory streams require the GNU C library");
+  return NULL;
+}
+
+#endif
+
+
+// Python wrapper. Memory is allocated by PyType_GenericAlloc, so we have to
+// explicitly run the constructor and destructor of the C++ member.
+
+static PyObject *
+ShmRing_new(PyTypeObject *type, PyObject *args, PyObject *kwds) {
+  ShmRingObj *self = (ShmRingObj*)type->tp_alloc(type, 0);
+  if (self) {
+    new (&self->ring) std::shared_ptr<ShmRing>();
+  }
+  return (PyObject*)self;
+}
+
+
+static void
+ShmRing_dealloc(ShmRingObj *self) {
+  self->ring.~shared_ptr<ShmRing>();
+  Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+
+static int
+ShmRing_init(ShmRingObj *self, PyObject *args, PyObject *kwds) {
+  const char *path;
+  const char *mode = "r";
+  Py_ssize_t capacity = 0;
+  PyThreadState *state;
+  static char *kwlist[] = {"path", "mode", "capacity", NULL};
+  if (!PyArg_ParseTupleAndKeywords(args, kwds, "es|sn", kwlist, "utf-8",
+                                   &path, &mode, &capacity)) {
+    return -1;
+  }
+  std::string path_s(path);
+  PyMem_Free((void*)path);
+  if (strcmp(mode, "r") && strcmp(mode, "w")) {
+    PyErr_Format(PyExc_ValueError, "invalid mode: '%s'", mode);
+    return -1;
+  }
+  if (capacity < 0) {
+    PyErr_SetString(PyExc_ValueError, "capacity must be non-negative");
+    return -1;
+  }
+  state = PyEval_SaveThread();
+  try {
+    self->ring = std::make_shared<ShmRing>(path_s, mode[0] == 'w', capacity);
+  } catch (HadoopUtils::Error e) {
+    PyEval_RestoreThread(state);
+    PyErr_SetString(PyExc_IOError, e.getMessage().c_str());
+    return -1;
+  }
+  PyEval_RestoreThread(state);
+  return 0;
+}
+
+
+static PyObject *
+ShmRing_close(ShmRingObj *self) {
+  if (self->ring) {
+    self->ring->close();
+  }
+  Py_RETURN_NONE;
+}
+
+
+static PyObject *
+ShmRing_getCapacity(ShmRingObj *self, void *closure) {
+  if (!self->ring) {
+    PyErr_SetString(PyExc_ValueError, "uninitialized ring");
+    return NULL;
+  }
+  return PyLong_FromSize_t(self->ring->getCapacity());
+}
+
+
+static PyMethodDef ShmRing_methods[] = {
+  {"close", (PyCFunction)ShmRing_close, METH_NOARGS,
+   "close(): mark this end of the ring as closed"},
+  {NULL}  /* Sentinel */
+};
+
+
+static PyGetSetDef ShmRing_getset[] = {
+  {"capacity", (getter)ShmRing_getCapacity, NULL,
+   "size of the data area in bytes", NULL},
+  {NULL}  /* Sentinel */
+};
+
+
+PyTypeObject ShmRingType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "sercore.ShmRing",                                /* tp_name */
+    sizeof(ShmRingObj),                               /* tp_basicsize */
+    0,                                                /* tp_itemsize */
+    (destructor)ShmRing_dealloc,                      /* tp_dealloc */
+    0,                                                /* tp_print */
+    0,                                                /* tp_getattr */
+    0,                                                /* tp_setattr */
+    0,                                                /* tp_compare */
+    0,                                                /* tp_repr */
+    0,                                                /* tp_as_number */
+    0,                                                /* tp_as_sequence */
+    0,                                                /* tp_as_mapping */
+    0,                                                /* tp_hash */
+    0,                                                /* tp_call */
+    0,                                                /* tp_str */
+    0,                                                /* tp_getattro */
+    0,                                                /* tp_setattro */
+    0,                                                /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT,                               /* tp_flags */
+    "ShmRing(path[, mode[, capacity]]): one end of a shared memory ring\n"
+    "buffer, to be passed to FileInStream (mode 'r') or FileOutStream\n"
+    "(mode 'w'). If capacity is given, create and initialize the ring.",
+                                                      /* tp_doc */
+    0,                                                /* tp_traverse */
+    0,                                                /* tp_clear */
+    0,                                                /* tp_richcompare */
+    0,                                                /* tp_weaklistoffset */
+    0,                                                /* tp_iter */
+    0,                                                /* tp_iternext */
+    ShmRing_methods,                                  /* tp_methods */
+    0,                                                /* tp_members */
+    ShmRing_getset,                                   /* tp_getset */
+    0,                                                /* tp_base */
+    0,                                                /* tp_dict */
+    0,                                                /* tp_descr_get */
+    0,                                                /* tp_descr_set */
+    0,                                                /* tp_dictoffset */
+    (initproc)ShmRing_init,                           /* tp_init */
+    0,                                                /* tp_alloc */
+    ShmRing_new,                                      /* tp_new */
+};
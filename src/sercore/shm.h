@@ -0,0 +1,90 @@
+// BEGIN_COPYRIGHT
+//
+// Copyright 2009-2019 CRS4.
+//
+// Licensed under the Apache License, Version 2.0 (the "License"); you may not
+// use this file except in compliance with the License. You may obtain a copy
+// of the License at
+//
+//   http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+// WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+// License for the specific language governing permissions and limitations
+// under the License.
+//
+// END_COPYRIGHT
+
+#pragma once
+
+#include <Python.h>
+#include <cstddef>
+#include <cstdint>
+#include <cstdio>
+#include <memory>
+#include <string>
+
+/**
+ * A single-producer, single-consumer byte ring buffer in a memory-mapped
+ * file, shared with another process. The layout must be kept in sync with
+ * it.crs4.pydoop.mapreduce.pipes.ShmRing:
+ *
+ *   0    int32  magic
+ *   4    int32  version
+ *   8    int64  capacity (size of the data area)
+ *   64   int64  head: total bytes written (only updated by the producer)
+ *   128  int64  tail: total bytes read (only updated by the consumer)
+ *   192  int32  producer closed flag
+ *   196  int32  consumer closed flag
+ *   256  data
+ *
+ * All fields are in native byte order. There are no kernel wakeups: a side
+ * that has to wait spins for a while, then yields, then sleeps for
+ * increasingly longer intervals (see backoff in shm.cpp). A side also stops
+ * waiting when the other one is closed or, for the process that opened an
+ * existing ring, when its parent process (i.e., the one that created the
+ * ring) exits. Does not need the GIL.
+ */
+class ShmRing {
+public:
+  /**
+   * Map the ring at path. If capacity is not 0, create (or truncate) the
+   * file and initialize the ring, otherwise the file must already exist.
+   * Throws a HadoopUtils::Error on failure.
+   */
+  ShmRing(const std::string& path, bool writer, std::size_t capacity = 0);
+  ~ShmRing();
+  // read up to len bytes, blocking until at least one is available; return
+  // 0 at end of stream or -1 (and set errno) on error
+  ssize_t read(char *buf, std::size_t len);
+  // write len bytes, blocking as needed; return -1 (and set errno) if the
+  // consumer has gone away
+  ssize_t write(const char *buf, std::size_t len);
+  // mark this side as closed
+  void close();
+  bool isWriter() const { return writer; }
+  std::size_t getCapacity() const { return capacity; }
+private:
+  bool peerGone(unsigned round) const;
+  char *base;
+  std::size_t map_len;
+  std::size_t capacity;
+  bool writer;
+  bool closed;
+  pid_t parent;  // 0 if we created the ring
+};
+
+/**
+ * Return a stdio stream that reads from (or writes to) ring. The stream
+ * holds a reference to the ring and marks it as closed when fclose'd.
+ * Sets a Python exception and returns NULL on failure (with the GIL held).
+ */
+FILE *ShmRing_fopen(const std::shared_ptr<ShmRing>& ring);
+
+typedef struct {
+  PyObject_HEAD
+  std::shared_ptr<ShmRing> ring;
+} ShmRingObj;
+
+extern PyTypeObject ShmRingType;
@@ -28,16 +28,36 @@
 
 #include <string>
 #include <memory>
+#include <vector>
 #include <cstdlib>
 #include <cstdint>
+#include <cctype>
 #include <cstdio>
+#include <new>
 
 #include "hu_extras.h"
+#include "partition.h"
+#include "shm.h"
 #include "streams.h"
 
+#define MAP_ITEM 4
+#define REDUCE_VALUE 7
 #define OUTPUT 50
 #define PARTITIONED_OUTPUT 51
 
+// max number of items / total bytes read at once by the native map loop
+#define MAP_BATCH_SIZE 1024
+#define MAP_BATCH_BYTES (4 * 1024 * 1024)
+
+// max number of values read ahead by the reduce values iterator
+#define REDUCE_BATCH_SIZE 1024
+
+// valid key / value format codes, see _decode_item
+#define ITEM_FORMATS "bmsqivfdonSQIVFDO"
+
+// size of the memory blocks used for zero-copy reads
+#define ARENA_BLOCK_SIZE (4 * 1024 * 1024)
+
 
 // This can only be used in functions that return a PyObject*
 # define _ASSERT_STREAM_OPEN {                                           \
@@ -48,12 +68,21 @@
 }
 
 // PyFile_AsFile is only available in Python 2, for "old style" file objects
-// This should work on anything associated to a file descriptor
+// This should work on anything associated to a file descriptor, and on
+// shared memory rings
 FILE *
 _PyFile_AsFile(PyObject *f, const char* mode) {
   int fd, newfd;
   FILE *fp;
   PyThreadState *state;
+  if (PyObject_TypeCheck(f, &ShmRingType)) {
+    std::shared_ptr<ShmRing>& ring = ((ShmRingObj*)f)->ring;
+    if (!ring || ring->isWriter() != (mode[0] == 'w')) {
+      PyErr_SetString(PyExc_ValueError, "ring not open for this direction");
+      return NULL;
+    }
+    return ShmRing_fopen(ring);
+  }
   if ((fd = PyObject_AsFileDescriptor(f)) == -1) {
     return NULL;
   }
@@ -121,6 +150,7 @@ FileInStream_close(FileInStreamObj *self) {
     return PyErr_SetFromErrno(PyExc_IOError);
   }
   PyEval_RestoreThread(state);
+  self->arena.reset();  // blocks still in use are kept alive by their views
   self->closed = true;
   Py_RETURN_NONE;
 }
@@ -355,6 +385,540 @@ FileInStream_readLongWritable(FileInStreamObj *self) {
 }
 
 
+// A serialized key or value, read as a std::string or, in zero-copy mode,
+// directly into an arena block.
+struct RawItem {
+  std::string str;
+  std::shared_ptr<ArenaBlock> block;
+  char *buf;
+  std::size_t len;
+};
+
+
+// Creates memoryviews on arena blocks, reusing the Python-level exporter for
+// consecutive items that live in the same block. Must be used with the GIL.
+class ViewMaker {
+public:
+  ViewMaker() : exporter(NULL), block(NULL) {}
+  ~ViewMaker() {
+    Py_XDECREF(exporter);
+  }
+  PyObject *view(const RawItem& item) {
+    if (item.block.get() != block) {
+      Py_XDECREF(exporter);
+      block = NULL;
+      if (!(exporter = ArenaBuffer_New(item.block))) {
+        return NULL;
+      }
+      block = item.block.get();
+    }
+    return ArenaBuffer_View(exporter, item.buf, item.len);
+  }
+private:
+  PyObject *exporter;
+  ArenaBlock *block;
+};
+
+
+// Decode a single Writable from stream. Note that 's' (Text) expects the
+// length of the string as a VInt, since this is only used for ArrayWritable
+// items (at the top level, the length is part of the command stream).
+static PyObject *
+_decode_writable(char code, BufferInStream& stream) {
+  switch(code) {
+  case 'i':
+    return Py_BuildValue("i", deserializeIntWritable(stream));
+  case 'q':
+    return Py_BuildValue("L", deserializeLongWritable(stream));
+  case 'v':
+    return Py_BuildValue("L", HadoopUtils::deserializeLong(stream));
+  case 'f':
+    return PyFloat_FromDouble(HadoopUtils::deserializeFloat(stream));
+  case 'd':
+    return PyFloat_FromDouble(deserializeDoubleWritable(stream));
+  case 'o': {
+    char c;
+    stream.read(&c, 1);
+    return PyBool_FromLong(c);
+  }
+  case 's': {
+    std::string t;
+    HadoopUtils::deserializeString(t, stream);
+    return PyUnicode_FromStringAndSize(t.c_str(), t.size());
+  }
+  default:
+    return PyErr_Format(PyExc_ValueError, "Unknown format '%c'", code);
+  }
+}
+
+
+// Decode an ArrayWritable whose items are decoded according to code
+static PyObject *
+_decode_array(char code, BufferInStream& stream) {
+  int32_t n = deserializeIntWritable(stream);
+  // each item takes at least one byte
+  HADOOP_ASSERT(n >= 0 && (std::size_t)n <= stream.remaining(),
+                "bad array length");
+  PyObject *rval, *item;
+  if (!(rval = PyList_New(n))) {
+    return NULL;
+  }
+  for (int32_t i = 0; i < n; ++i) {
+    try {
+      item = _decode_writable(code, stream);
+    } catch (HadoopUtils::Error e) {
+      Py_DECREF(rval);
+      throw;
+    }
+    if (!item) {
+      Py_DECREF(rval);
+      return NULL;
+    }
+    PyList_SET_ITEM(rval, i, item);
+  }
+  return rval;
+}
+
+
+// Convert a serialized key or value to a Python object according to code:
+//   'b': raw bytes (also used for hadoop.io.BytesWritable)
+//   'm': raw bytes, as a read-only memoryview on an arena block (zero-copy)
+//   's': hadoop.io.Text (decoded as utf-8)
+//   'q': hadoop.io.LongWritable
+//   'i': hadoop.io.IntWritable
+//   'v': hadoop.io.VIntWritable or hadoop.io.VLongWritable
+//   'f': hadoop.io.FloatWritable
+//   'd': hadoop.io.DoubleWritable
+//   'o': hadoop.io.BooleanWritable
+//   'n': hadoop.io.NullWritable (always None)
+// The upper case version of 'sqivfdo' stands for a hadoop.io.ArrayWritable
+// of the corresponding type (decoded as a list).
+static PyObject *
+_decode_item(char code, const RawItem& item, ViewMaker& vm) {
+  const std::string& s = item.str;
+  switch(code) {
+  case 'b':
+    return PyBytes_FromStringAndSize(s.c_str(), s.size());
+  case 'm':
+    return vm.view(item);
+  case 's':
+    return PyUnicode_FromStringAndSize(s.c_str(), s.size());
+  case 'n':
+    if (!s.empty()) {
+      return PyErr_Format(PyExc_ValueError,
+                          "bad NullWritable size: %zd", s.size());
+    }
+    Py_RETURN_NONE;
+  }
+  BufferInStream stream(s.c_str(), s.size());
+  PyObject *rval;
+  try {
+    if (isupper(code)) {
+      rval = _decode_array(tolower(code), stream);
+    } else {
+      rval = _decode_writable(code, stream);
+    }
+  } catch (HadoopUtils::Error e) {
+    return PyErr_Format(PyExc_ValueError, "bad data for format '%c': %s",
+                        code, e.getMessage().c_str());
+  }
+  if (rval && stream.remaining() > 0) {
+    Py_DECREF(rval);
+    return PyErr_Format(PyExc_ValueError, "%zd trailing bytes for format '%c'",
+                        stream.remaining(), code);
+  }
+  return rval;
+}
+
+
+// Same as _decode_item, but also pass the result through deser (if not None)
+static PyObject *
+_decode_item_with(char code, const RawItem& item, ViewMaker& vm,
+                  PyObject *deser) {
+  PyObject *obj, *rval;
+  if (!(obj = _decode_item(code, item, vm)) || deser == Py_None) {
+    return obj;
+  }
+  rval = PyObject_CallFunctionObjArgs(deser, obj, NULL);
+  Py_DECREF(obj);
+  return rval;
+}
+
+
+// Also creates the arena, if fmt requires it
+static bool
+_check_item_fmt(FileInStreamObj *self, const char *fmt, std::size_t len) {
+  if (strlen(fmt) != len) {
+    PyErr_Format(PyExc_ValueError, "format must have length %zd: '%s'",
+                 len, fmt);
+    return false;
+  }
+  for (std::size_t i = 0; i < len; ++i) {
+    if (!fmt[i] || !strchr(ITEM_FORMATS, fmt[i])) {
+      PyErr_Format(PyExc_ValueError, "Unknown format '%c'", fmt[i]);
+      return false;
+    }
+  }
+  if (!self->arena && strchr(fmt, 'm')) {
+    self->arena = std::make_shared<Arena>(ARENA_BLOCK_SIZE);
+  }
+  return true;
+}
+
+
+// Does not need the GIL
+static void
+_read_raw_item(FileInStreamObj *self, char code, RawItem& item) {
+  if (code != 'm') {
+    HadoopUtils::deserializeString(item.str, *self->stream);
+    return;
+  }
+  int32_t len = HadoopUtils::deserializeInt(*self->stream);
+  HADOOP_ASSERT(len >= 0, "negative item length");
+  item.len = len;
+  item.buf = self->arena->alloc(item.len, item.block);
+  if (len > 0) {
+    self->stream->read(item.buf, item.len);
+  }
+}
+
+
+// Read up to max_n consecutive commands with the given code, stopping
+// (without consuming it) at the first command of a different type. Each
+// command carries strlen(fmt) serialized fields (e.g., key and value for
+// MAP_ITEM), which are appended to raw in order. If pending is true, the
+// command code for the first item has already been consumed. If max_bytes is
+// positive, also stop as soon as the total size of the items read so far
+// reaches it. Note that this blocks until the next command is available.
+static bool
+_read_items_raw(FileInStreamObj *self, int8_t code, const char *fmt,
+                bool pending, std::size_t max_n, std::size_t max_bytes,
+                std::vector<RawItem>& raw) {
+  std::size_t nf = strlen(fmt);
+  std::size_t start = raw.size();
+  PyThreadState *state = PyEval_SaveThread();
+  try {
+    std::size_t nbytes = 0;
+    int8_t cmd;
+    while (raw.size() - start < nf * max_n &&
+           (max_bytes == 0 || nbytes < max_bytes)) {
+      if (pending) {
+        pending = false;
+      } else if (self->stream->peek() == code) {
+        self->stream->read(&cmd, 1);
+      } else {
+        break;
+      }
+      for (std::size_t i = 0; i < nf; ++i) {
+        raw.emplace_back();
+        _read_raw_item(self, fmt[i], raw.back());
+        nbytes += raw.back().block ? raw.back().len : raw.back().str.size();
+      }
+    }
+  } catch (HadoopUtils::Error e) {
+    PyEval_RestoreThread(state);
+    PyErr_SetString(PyExc_IOError, e.getMessage().c_str());
+    return false;
+  }
+  PyEval_RestoreThread(state);
+  return true;
+}
+
+
+static bool
+_read_map_items_raw(FileInStreamObj *self, const char *fmt, bool pending,
+                    std::size_t max_n, std::size_t max_bytes,
+                    std::vector<RawItem>& raw) {
+  return _read_items_raw(self, MAP_ITEM, fmt, pending, max_n, max_bytes, raw);
+}
+
+
+static PyObject *
+FileInStream_readMapItems(FileInStreamObj *self, PyObject *args) {
+  Py_ssize_t max_n, max_bytes = 0;
+  const char *fmt = "bb";
+  PyObject *pending = Py_False;
+  _ASSERT_STREAM_OPEN;
+  if (!PyArg_ParseTuple(args, "n|snO", &max_n, &fmt, &max_bytes, &pending)) {
+    return NULL;
+  }
+  if (!_check_item_fmt(self, fmt, 2)) {
+    return NULL;
+  }
+  int is_pending = PyObject_IsTrue(pending);
+  if (is_pending < 0) {
+    return NULL;
+  }
+  std::vector<RawItem> raw;
+  if (!_read_map_items_raw(self, fmt, is_pending, max_n < 0 ? 0 : max_n,
+                           max_bytes < 0 ? 0 : max_bytes, raw)) {
+    return NULL;
+  }
+  std::size_t n = raw.size() / 2;
+  ViewMaker vm;
+  PyObject *rval, *k, *v, *item;
+  if (!(rval = PyList_New(n))) {
+    return NULL;
+  }
+  for (std::size_t i = 0; i < n; ++i) {
+    if (!(k = _decode_item(fmt[0], raw[2 * i], vm))) {
+      goto error;
+    }
+    if (!(v = _decode_item(fmt[1], raw[2 * i + 1], vm))) {
+      Py_DECREF(k);
+      goto error;
+    }
+    if (!(item = PyTuple_New(2))) {
+      Py_DECREF(k);
+      Py_DECREF(v);
+      goto error;
+    }
+    PyTuple_SET_ITEM(item, 0, k);
+    PyTuple_SET_ITEM(item, 1, v);
+    PyList_SET_ITEM(rval, i, item);
+  }
+  return rval;
+
+error:
+  Py_DECREF(rval);
+  return NULL;
+}
+
+
+#if PY_MAJOR_VERSION < 3
+#define _INTERN PyString_InternFromString
+#else
+#define _INTERN PyUnicode_InternFromString
+#endif
+
+static PyObject *KEY_ATTR = NULL;
+static PyObject *VALUE_ATTR = NULL;
+
+
+// Native map loop, to be called right after reading a MAP_ITEM command code:
+// for that item and each of the immediately following MAP_ITEM commands, set
+// context._key and context._value and call map_func(context). Input is read
+// in batches, with the GIL released. Stops (without consuming it) at the
+// first command of a different type, which is left to the Python downlink,
+// and returns the number of items processed.
+static PyObject *
+FileInStream_runMapItems(FileInStreamObj *self, PyObject *args) {
+  PyObject *context, *map_func, *res;
+  PyObject *kdeser = Py_None, *vdeser = Py_None;
+  const char *fmt = "bb";
+  Py_ssize_t count = 0;
+  bool pending = true;
+  _ASSERT_STREAM_OPEN;
+  if (!PyArg_ParseTuple(args, "OO|sOO", &context, &map_func, &fmt,
+                        &kdeser, &vdeser)) {
+    return NULL;
+  }
+  if (!_check_item_fmt(self, fmt, 2)) {
+    return NULL;
+  }
+  if (!KEY_ATTR && !(KEY_ATTR = _INTERN("_key"))) {
+    return NULL;
+  }
+  if (!VALUE_ATTR && !(VALUE_ATTR = _INTERN("_value"))) {
+    return NULL;
+  }
+  std::vector<RawItem> raw;
+  raw.reserve(2 * MAP_BATCH_SIZE);
+  while (true) {
+    raw.clear();
+    if (!_read_map_items_raw(self, fmt, pending, MAP_BATCH_SIZE,
+                             MAP_BATCH_BYTES, raw)) {
+      return NULL;
+    }
+    pending = false;
+    if (raw.empty()) {
+      break;
+    }
+    ViewMaker vm;
+    for (std::size_t i = 0; i < raw.size(); i += 2) {
+      PyObject *k, *v;
+      if (!(k = _decode_item_with(fmt[0], raw[i], vm, kdeser))) {
+        return NULL;
+      }
+      int status = PyObject_SetAttr(context, KEY_ATTR, k);
+      Py_DECREF(k);
+      if (status < 0) {
+        return NULL;
+      }
+      if (!(v = _decode_item_with(fmt[1], raw[i + 1], vm, vdeser))) {
+        return NULL;
+      }
+      status = PyObject_SetAttr(context, VALUE_ATTR, v);
+      Py_DECREF(v);
+      if (status < 0) {
+        return NULL;
+      }
+      if (!(res = PyObject_CallFunctionObjArgs(map_func, context, NULL))) {
+        return NULL;
+      }
+      Py_DECREF(res);
+      count++;
+    }
+  }
+  return PyLong_FromSsize_t(count);
+}
+
+
+// Iterator over the values for the current reduce key: yields the payloads
+// of consecutive REDUCE_VALUE commands, stopping (without consuming it) at
+// the first command of a different type (REDUCE_KEY or CLOSE). Values are
+// read ahead in batches, with the GIL released, and decoded on demand.
+typedef struct {
+  PyObject_HEAD
+  FileInStreamObj *stream;
+  char code;
+  PyObject *deser;
+  std::vector<RawItem> items;
+  std::size_t pos;
+  bool pending;  // the first REDUCE_VALUE code has already been read
+  bool done;  // no more REDUCE_VALUE commands for this key
+} ReduceValuesObj;
+
+
+// Memory is allocated by PyObject_New, so we have to explicitly run the
+// constructor and destructor of the C++ member (see arena.cpp).
+static void
+ReduceValues_dealloc(ReduceValuesObj *self) {
+  self->items.~vector<RawItem>();
+  Py_XDECREF(self->stream);
+  Py_XDECREF(self->deser);
+  PyObject_Del(self);
+}
+
+
+// Returns false on error. On success, self->pos < self->items.size() unless
+// there are no more values.
+static bool
+_ReduceValues_fill(ReduceValuesObj *self) {
+  if (self->pos < self->items.size() || self->done) {
+    return true;
+  }
+  if (self->stream->closed) {
+    PyErr_SetString(PyExc_ValueError, "I/O operation on closed stream");
+    return false;
+  }
+  const char fmt[2] = {self->code, '\0'};
+  self->items.clear();
+  self->pos = 0;
+  if (!_read_items_raw(self->stream, REDUCE_VALUE, fmt, self->pending,
+                       REDUCE_BATCH_SIZE, MAP_BATCH_BYTES, self->items)) {
+    return false;
+  }
+  self->pending = false;
+  self->done = self->items.empty();
+  return true;
+}
+
+
+static PyObject *
+ReduceValues_iternext(ReduceValuesObj *self) {
+  if (!_ReduceValues_fill(self) || self->pos >= self->items.size()) {
+    return NULL;  // StopIteration is implied if no error is set
+  }
+  ViewMaker vm;
+  PyObject *rval = _decode_item_with(
+    self->code, self->items[self->pos], vm, self->deser
+  );
+  self->items[self->pos++] = RawItem();  // release memory early
+  return rval;
+}
+
+
+static PyObject *
+ReduceValues_skip(ReduceValuesObj *self) {
+  Py_ssize_t count = 0;
+  while (true) {
+    if (!_ReduceValues_fill(self)) {
+      return NULL;
+    }
+    if (self->pos >= self->items.size()) {
+      break;
+    }
+    count += self->items.size() - self->pos;
+    self->pos = self->items.size();
+  }
+  return PyLong_FromSsize_t(count);
+}
+
+
+static PyMethodDef ReduceValues_methods[] = {
+  {"skip", (PyCFunction)ReduceValues_skip, METH_NOARGS,
+   "skip(): discard all remaining values, return their number"},
+  {NULL}  /* Sentinel */
+};
+
+
+PyTypeObject ReduceValuesType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "sercore.ReduceValues",                           /* tp_name */
+    sizeof(ReduceValuesObj),                          /* tp_basicsize */
+    0,                                                /* tp_itemsize */
+    (destructor)ReduceValues_dealloc,                 /* tp_dealloc */
+    0,                                                /* tp_print */
+    0,                                                /* tp_getattr */
+    0,                                                /* tp_setattr */
+    0,                                                /* tp_compare */
+    0,                                                /* tp_repr */
+    0,                                                /* tp_as_number */
+    0,                                                /* tp_as_sequence */
+    0,                                                /* tp_as_mapping */
+    0,                                                /* tp_hash */
+    0,                                                /* tp_call */
+    0,                                                /* tp_str */
+    0,                                                /* tp_getattro */
+    0,                                                /* tp_setattro */
+    0,                                                /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT,                               /* tp_flags */
+    "Iterator over the values for a reduce key",      /* tp_doc */
+    0,                                                /* tp_traverse */
+    0,                                                /* tp_clear */
+    0,                                                /* tp_richcompare */
+    0,                                                /* tp_weaklistoffset */
+    PyObject_SelfIter,                                /* tp_iter */
+    (iternextfunc)ReduceValues_iternext,              /* tp_iternext */
+    ReduceValues_methods,                             /* tp_methods */
+};
+
+
+// To be called right after reading a REDUCE_KEY command and its payload
+static PyObject *
+FileInStream_reduceValues(FileInStreamObj *self, PyObject *args) {
+  const char *fmt = "b";
+  PyObject *deser = Py_None, *pending = Py_False;
+  ReduceValuesObj *rval;
+  _ASSERT_STREAM_OPEN;
+  if (!PyArg_ParseTuple(args, "|sOO", &fmt, &deser, &pending)) {
+    return NULL;
+  }
+  if (!_check_item_fmt(self, fmt, 1)) {
+    return NULL;
+  }
+  int is_pending = PyObject_IsTrue(pending);
+  if (is_pending < 0) {
+    return NULL;
+  }
+  if (!(rval = PyObject_New(ReduceValuesObj, &ReduceValuesType))) {
+    return NULL;
+  }
+  new (&rval->items) std::vector<RawItem>();
+  rval->items.reserve(REDUCE_BATCH_SIZE);
+  Py_INCREF(self);
+  rval->stream = self;
+  rval->code = fmt[0];
+  Py_INCREF(deser);
+  rval->deser = deser;
+  rval->pos = 0;
+  rval->pending = is_pending;
+  rval->done = false;
+  return (PyObject*)rval;
+}
+
+
 static PyMethodDef FileInStream_methods[] = {
   {"close", (PyCFunction)FileInStream_close, METH_NOARGS,
    "close(): close the currently open file"},
@@ -378,6 +942,17 @@ static PyMethodDef FileInStream_methods[] = {
   {"__exit__", (PyCFunction)FileInStream_exit, METH_VARARGS},
   {"read_long_writable", (PyCFunction)FileInStream_readLongWritable,
    METH_NOARGS, "read_long_writable(): read a hadoop.io.LongWritable"},
+  {"read_map_items", (PyCFunction)FileInStream_readMapItems, METH_VARARGS,
+   "read_map_items(max_n[, fmt[, max_bytes[, pending]]]): read consecutive "
+   "MAP_ITEM commands (if pending, the first command code has already been "
+   "read), return a list of (key, value) tuples"},
+  {"run_map_items", (PyCFunction)FileInStream_runMapItems, METH_VARARGS,
+   "run_map_items(context, map_func[, fmt[, kdeser[, vdeser]]]): call "
+   "map_func(context) for the current and all following MAP_ITEM commands"},
+  {"reduce_values", (PyCFunction)FileInStream_reduceValues, METH_VARARGS,
+   "reduce_values([fmt[, deser[, pending]]]): return an iterator over the "
+   "values of the following REDUCE_VALUE commands (if pending, the first "
+   "command code has already been read)"},
   {NULL}  /* Sentinel */
 };
 
@@ -704,19 +1279,32 @@ error:
 }
 
 
+// Does not need the GIL
+static void
+_write_output(FileOutStreamObj *self, const Py_buffer& key,
+              const Py_buffer& value, int part) {
+  if (part >= 0) {
+    HadoopUtils::serializeInt(PARTITIONED_OUTPUT, *self->stream);
+    HadoopUtils::serializeInt(part, *self->stream);
+  } else {
+    HadoopUtils::serializeInt(OUTPUT, *self->stream);
+  }
+  serializeBuffer(key.buf, key.len, *self->stream);
+  serializeBuffer(value.buf, value.len, *self->stream);
+}
+
+
 // Same as write_tuple("ibb", (OUTPUT, k, v)) or, when part is specified,
 // write_tuple("iibb", (PARTITIONED_OUTPUT, part, k, v)), but more efficient.
 // Optimizing other commands in this way is probably worthless.
 static PyObject *
 FileOutStream_writeOutput(FileOutStreamObj *self, PyObject *args) {
   int part = -1;
-  PyThreadState *state;
-  _ASSERT_STREAM_OPEN;
-#if PY_MAJOR_VERSION < 3
-  // "y#" not available
   PyObject *pykey, *pyval;
   Py_buffer kbuf = {NULL, NULL};
   Py_buffer vbuf = {NULL, NULL};
+  PyThreadState *state;
+  _ASSERT_STREAM_OPEN;
   if (!PyArg_ParseTuple(args, "OO|i", &pykey, &pyval, &part)) {
     return NULL;
   }
@@ -727,45 +1315,131 @@ FileOutStream_writeOutput(FileOutStreamObj *self, PyObject *args) {
     PyBuffer_Release(&kbuf);
     return NULL;
   }
-  std::string ks((const char*)kbuf.buf, kbuf.len);
-  std::string vs((const char*)vbuf.buf, vbuf.len);
-#else
-  const char *key, *val;
-  Py_ssize_t klen, vlen;
-  if (!PyArg_ParseTuple(args, "y#y#|i", &key, &klen, &val, &vlen, &part)) {
-    return NULL;
-  }
-  std::string ks(key, klen);
-  std::string vs(val, vlen);
-#endif
   state = PyEval_SaveThread();
   try {
-    if (part >= 0) {
-      HadoopUtils::serializeInt(PARTITIONED_OUTPUT, *self->stream);
-      HadoopUtils::serializeInt(part, *self->stream);
-    } else {
-      HadoopUtils::serializeInt(OUTPUT, *self->stream);
-    }
-    HadoopUtils::serializeString(ks, *self->stream);
-    HadoopUtils::serializeString(vs, *self->stream);
+    _write_output(self, kbuf, vbuf, part);
   } catch (HadoopUtils::Error e) {
     PyEval_RestoreThread(state);
     PyErr_SetString(PyExc_IOError, e.getMessage().c_str());
-#if PY_MAJOR_VERSION < 3
     PyBuffer_Release(&kbuf);
     PyBuffer_Release(&vbuf);
-#endif
     return NULL;
   }
   PyEval_RestoreThread(state);
-#if PY_MAJOR_VERSION < 3
   PyBuffer_Release(&kbuf);
   PyBuffer_Release(&vbuf);
-#endif
   Py_RETURN_NONE;
 }
 
 
+// Same as calling write_output for each (k, v[, part]) triple, but all
+// output is serialized with a single GIL release. Keys and values can be any
+// objects that support the buffer protocol. If parts is a Partitioner,
+// partitions are computed from the keys (with the GIL released), and
+// num_partitions must be given.
+static PyObject *
+FileOutStream_writeOutputs(FileOutStreamObj *self, PyObject *args) {
+  PyObject *keys, *values, *parts = Py_None;
+  PyObject *seq_k = NULL, *seq_v = NULL, *seq_p = NULL;
+  PyObject *rval = NULL;
+  Py_ssize_t n;
+  int nparts = 0;
+  const KeyPartitioner *partitioner = NULL;
+  std::vector<Py_buffer> bufs;
+  std::vector<int> pv;
+  PyThreadState *state;
+  _ASSERT_STREAM_OPEN;
+  if (!PyArg_ParseTuple(args, "OO|Oi", &keys, &values, &parts, &nparts)) {
+    return NULL;
+  }
+  if (PyObject_TypeCheck(parts, &PartitionerType)) {
+    if (nparts < 1) {
+      PyErr_SetString(PyExc_ValueError, "number of partitions must be > 0");
+      return NULL;
+    }
+    partitioner = &((PartitionerObj*)parts)->p;
+  }
+  if (!(seq_k = PySequence_Fast(keys, "keys must be a sequence"))) {
+    goto done;
+  }
+  if (!(seq_v = PySequence_Fast(values, "values must be a sequence"))) {
+    goto done;
+  }
+  n = PySequence_Fast_GET_SIZE(seq_k);
+  if (PySequence_Fast_GET_SIZE(seq_v) != n) {
+    PyErr_SetString(PyExc_ValueError, "keys and values differ in length");
+    goto done;
+  }
+  if (parts != Py_None && !partitioner) {
+    if (!(seq_p = PySequence_Fast(parts, "partitions must be a sequence"))) {
+      goto done;
+    }
+    if (PySequence_Fast_GET_SIZE(seq_p) != n) {
+      PyErr_SetString(PyExc_ValueError, "keys and partitions differ in length");
+      goto done;
+    }
+    pv.reserve(n);
+    for (Py_ssize_t i = 0; i < n; ++i) {
+      long p = PyLong_AsLong(PySequence_Fast_GET_ITEM(seq_p, i));
+      if (p == -1 && PyErr_Occurred()) {
+        goto done;
+      }
+      if (p < 0 || p > INT32_MAX) {
+        PyErr_Format(PyExc_ValueError, "invalid partition: %ld", p);
+        goto done;
+      }
+      pv.push_back(p);
+    }
+  }
+  bufs.reserve(2 * n);
+  for (Py_ssize_t i = 0; i < n; ++i) {
+    for (PyObject *seq : {seq_k, seq_v}) {
+      bufs.emplace_back();
+      PyObject *item = PySequence_Fast_GET_ITEM(seq, i);
+      if (PyObject_GetBuffer(item, &bufs.back(), PyBUF_SIMPLE) < 0) {
+        bufs.pop_back();
+        goto done;
+      }
+    }
+  }
+  state = PyEval_SaveThread();
+  if (partitioner) {
+    pv.reserve(n);
+    for (Py_ssize_t i = 0; i < n; ++i) {
+      const Py_buffer& k = bufs[2 * i];
+      pv.push_back(partitioner->partition((const char*)k.buf, k.len, nparts));
+      if (pv.back() < 0) {
+        PyEval_RestoreThread(state);
+        PyErr_SetString(PyExc_ValueError, "key not valid for partitioner");
+        goto done;
+      }
+    }
+  }
+  try {
+    for (Py_ssize_t i = 0; i < n; ++i) {
+      _write_output(self, bufs[2 * i], bufs[2 * i + 1],
+                    pv.empty() ? -1 : pv[i]);
+    }
+  } catch (HadoopUtils::Error e) {
+    PyEval_RestoreThread(state);
+    PyErr_SetString(PyExc_IOError, e.getMessage().c_str());
+    goto done;
+  }
+  PyEval_RestoreThread(state);
+  Py_INCREF(Py_None);
+  rval = Py_None;
+
+done:
+  for (auto& b : bufs) {
+    PyBuffer_Release(&b);
+  }
+  Py_XDECREF(seq_k);
+  Py_XDECREF(seq_v);
+  Py_XDECREF(seq_p);
+  return rval;
+}
+
+
 static PyObject *
 FileOutStream_advance(FileOutStreamObj *self, PyObject *args) {
   size_t len;
@@ -815,6 +1489,9 @@ static PyMethodDef FileOutStream_methods[] = {
    "write_tuple(fmt, t): write values from iterable t according to fmt"},
   {"write_output", (PyCFunction)FileOutStream_writeOutput, METH_VARARGS,
    "write_output(key, value[, part]): write pipes [partitioned] output"},
+  {"write_outputs", (PyCFunction)FileOutStream_writeOutputs, METH_VARARGS,
+   "write_outputs(keys, values[, parts[, num_partitions]]): write a "
+   "sequence of pipes [partitioned] outputs; parts can be a Partitioner"},
   {"advance", (PyCFunction)FileOutStream_advance, METH_VARARGS,
    "advance(len): advance len bytes"},
   {"flush", (PyCFunction)FileOutStream_flush, METH_NOARGS,
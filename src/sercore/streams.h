@@ -23,12 +23,14 @@
 #include <memory>
 #include <string>
 #include "HadoopUtils/SerialUtils.hh"
+#include "arena.h"
 
 typedef struct {
     PyObject_HEAD
     FILE *fp;
     bool closed;
     std::shared_ptr<HadoopUtils::FileInStream> stream;
+    std::shared_ptr<Arena> arena;  // for zero-copy reads, created on demand
 } FileInStreamObj;
 
 typedef struct {
@@ -40,3 +42,4 @@ typedef struct {
 
 extern PyTypeObject FileInStreamType;
 extern PyTypeObject FileOutStreamType;
+extern PyTypeObject ReduceValuesType;
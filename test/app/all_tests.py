@@ -21,6 +21,7 @@ from pydoop.test_utils import get_module
 
 
 TEST_MODULE_NAMES = [
+    'test_profiles',
     'test_submit',
 ]
 
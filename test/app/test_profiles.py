@@ -0,0 +1,121 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+import cProfile
+import os
+import shutil
+import tempfile
+import unittest
+from io import StringIO
+
+from pydoop.app.profiles import JobProfile, task_info
+
+
+def work(n):
+    return sum(i * i for i in range(n))
+
+
+def task(n, extra=0):
+    work(n)
+    if extra:
+        sorted(str(_) for _ in range(extra))
+
+
+class TestJobProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix="pydoop_test_")
+        self.job_profile = JobProfile(stream=StringIO())
+        for i, extra in enumerate([0, 0, 0, 100000]):
+            self.__add("m_%05d_tmp%d.pstats" % (i, i), 1000, extra)
+        self.__add("r_00000_tmp.pstats", 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def __add(self, name, n, extra=0):
+        path = os.path.join(self.wd, name)
+        cProfile.runctx("task(n, extra)", globals(), locals(), path)
+        self.job_profile.add(path)
+
+    def test_task_info(self):
+        self.assertEqual(task_info("m_00003_tmpabc.pstats"), ("map", 3))
+        self.assertEqual(task_info("r_00012_tmpabc.pstats"), ("reduce", 12))
+        self.assertEqual(task_info("foo.pstats"), ("other", None))
+
+    def test_merge(self):
+        self.assertEqual(self.job_profile.task_types(), ["map", "reduce"])
+        for task_type, ntasks in ("map", 4), ("reduce", 1):
+            self.assertEqual(len(self.job_profile.tasks[task_type]), ntasks)
+            stats = self.job_profile.stats[task_type].stats
+            ncalls = [v[1] for f, v in stats.items() if f[2] == "task"]
+            self.assertEqual(ncalls, [ntasks])
+
+    def test_outliers(self):
+        outliers = self.job_profile.outliers("map")
+        self.assertEqual([t.partition for t, _ in outliers], [3])
+        self.assertTrue(outliers[0][1] >= 2)
+        f, dt = self.job_profile.excess(outliers[0][0])
+        self.assertTrue(dt > 0)
+        self.assertNotEqual(f[2], "work")
+        self.assertEqual(self.job_profile.outliers("reduce"), [])
+
+    def test_report(self):
+        self.job_profile.print_report(top=5, strip_dirs=True)
+        report = self.job_profile.stream.getvalue()
+        self.assertIn("=== map tasks: 4 profiles", report)
+        self.assertIn("=== reduce tasks: 1 profiles", report)
+        self.assertIn("m_00003_tmp3.pstats", report)
+
+    def test_collapsed(self):
+        stacks = self.job_profile.collapsed_stacks("map")
+        work_stacks = [_ for _ in stacks if _.split(";")[-1].startswith(
+            "work (test_profiles.py:"
+        )]
+        self.assertEqual(len(work_stacks), 1)
+        frames = work_stacks[0].split(";")
+        self.assertEqual(frames[0], "map")
+        self.assertTrue(frames[-2].startswith("task ("))
+        total = self.job_profile.stats["map"].total_tt
+        self.assertTrue(sum(stacks.values()) <= total * 1.001)
+        self.assertTrue(sum(stacks.values()) >= total * 0.9)
+        f = StringIO()
+        self.job_profile.write_collapsed(f)
+        lines = f.getvalue().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            stack, us = line.rsplit(" ", 1)
+            self.assertTrue(stack.split(";")[0] in ("map", "reduce"))
+            self.assertTrue(int(us) > 0)
+
+
+CASES = [
+    TestJobProfile,
+]
+
+
+def suite():
+    ret = unittest.TestSuite()
+    test_loader = unittest.TestLoader()
+    for c in CASES:
+        ret.addTest(test_loader.loadTestsFromTestCase(c))
+    return ret
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run((suite()))
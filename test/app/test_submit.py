@@ -26,6 +26,11 @@ from io import StringIO, BytesIO
 
 import pydoop.app.main as app
 from pydoop.app.submit import PydoopSubmitter
+from pydoop.mapreduce.grouping import (
+    GROUPING_FIELDS_KEY, KEY_COMPARATOR_KEY, KEY_COMPARATOR_OPTIONS_KEY
+)
+from pydoop.mapreduce.partitioners import PARTITION_FILE_KEY
+from pydoop.mapreduce.pipes import INTERMEDIATE_CODEC_KEY
 
 
 def nop(x=None):
@@ -234,6 +239,55 @@ class TestAppSubmit(unittest.TestCase):
         self.assertEquals('value2', d['var2'])
         self.assertEquals('str with = sign', d['var3'])
 
+    def test_sample_partitions(self):
+        parser = app.make_parser()
+        parser.format_help = nop
+        argv = ['submit', '--sample-partitions', '0.1', 'module', 'in', 'out']
+        args, unknown = parser.parse_known_args(argv)
+        self.assertEqual(args.sample_partitions, 0.1)
+        self.assertEqual(args.sample_key_codec, 'ordered')
+        self.submitter.set_args(args, unknown)
+        path = self.submitter.properties[PARTITION_FILE_KEY]
+        self.assertTrue(path.startswith(self.submitter.remote_wd))
+        args = self._gen_default_args()
+        self.submitter.set_args(args)
+        self.assertFalse(PARTITION_FILE_KEY in self.submitter.properties)
+
+    def test_group_fields(self):
+        parser = app.make_parser()
+        parser.format_help = nop
+        # previous calls must not leave any stale properties
+        for formats in ("ordered", "text", None), ("text", "ordered", None):
+            for fmt in formats:
+                argv = ['submit', 'module', 'in', 'out']
+                if fmt:
+                    argv[1:1] = ['--group-fields', '2',
+                                 '--group-key-format', fmt]
+                args, unknown = parser.parse_known_args(argv)
+                self.submitter.set_args(args, unknown)
+                props = self.submitter.properties
+                self.assertEqual(props.get(GROUPING_FIELDS_KEY),
+                                 '2' if fmt else None)
+                for k in KEY_COMPARATOR_KEY, KEY_COMPARATOR_OPTIONS_KEY:
+                    self.assertEqual(k in props, fmt == "text")
+                self.assertEqual(props.get(INTERMEDIATE_CODEC_KEY),
+                                 "ordered" if fmt == "ordered" else None)
+
+    def test_group_fields_codec(self):
+        parser = app.make_parser()
+        parser.format_help = nop
+        argv = ['submit', '--group-fields', '2', 'module', 'in', 'out']
+        args, unknown = parser.parse_known_args(
+            argv + ['-D', '%s=ordered' % INTERMEDIATE_CODEC_KEY]
+        )
+        self.submitter.set_args(args, unknown)
+        props = self.submitter.properties
+        self.assertEqual(props[INTERMEDIATE_CODEC_KEY], "ordered")
+        args, unknown = parser.parse_known_args(
+            argv + ['-D', '%s=pickle' % INTERMEDIATE_CODEC_KEY]
+        )
+        self.assertRaises(RuntimeError, self.submitter.set_args, args, unknown)
+
     def test_bad_upload_files(self):
         args = self._gen_default_args()
         args.python_zip = [""]
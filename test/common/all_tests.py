@@ -25,6 +25,8 @@ from pydoop.test_utils import get_module
 TEST_MODULE_NAMES = [
     'test_hadoop_utils',
     'test_hadut',
+    'test_import_time',
+    'test_misc',
     'test_pydoop',
 ]
 
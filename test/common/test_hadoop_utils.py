@@ -18,6 +18,7 @@
 
 import unittest
 import tempfile
+import json
 import os
 import stat
 import shutil
@@ -126,6 +127,56 @@ class TestHadoopUtils(unittest.TestCase):
             n.appendChild(doc.createTextNode(s.upper()))
         self.__check_params(doc.toxml(), {"NAME": "VALUE"})
 
+    def test_info_cache(self):
+        log = os.path.join(self.hadoop_home, "log")
+        with open(self.hadoop_exe, "w") as fo:
+            fo.write("#!/bin/bash\necho $1 >>%s\n" % log)
+            fo.write('if [ "$1" = classpath ]; then echo /hadoop-common.jar\n')
+            fo.write("else echo Hadoop %s; fi\n" % self.hadoop_version)
+        cache_dir = os.path.join(self.hadoop_home, "cache")
+        os.environ.update({
+            "HADOOP_HOME": self.hadoop_home,
+            "HADOOP_CONF_DIR": self.hadoop_conf,
+            hu.CACHE_DIR_ENV: cache_dir,
+        })
+        for k in "HADOOP_VERSION", "HADOOP_CLASSPATH", hu.HADOOP_INFO_ENV:
+            os.environ.pop(k, None)
+
+        def n_calls():
+            try:
+                with open(log) as f:
+                    return len(f.readlines())
+            except IOError:
+                return 0
+
+        info = self.pf.find()
+        self.assertEqual(info["hadoop_classpath"], "/hadoop-common.jar")
+        self.assertEqual(n_calls(), 2)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        self.assertEqual(hu.PathFinder().find(), info)
+        self.assertEqual(n_calls(), 2)
+        # changing the configuration invalidates the cache
+        xml_fn = os.path.join(self.hadoop_conf, "core-site.xml")
+        with open(xml_fn, "w") as fo:
+            fo.write("<configuration/>")
+        self.assertEqual(hu.PathFinder().find(), info)
+        self.assertEqual(n_calls(), 4)
+        # so does a conflicting environment
+        os.environ["HADOOP_VERSION"] = "2.9.2"
+        pf = hu.PathFinder()
+        self.assertFalse(pf.load_info(self.pf.dump_info()))
+        self.assertEqual(pf.find()["hadoop_version_info"].main, (2, 9, 2))
+        self.assertEqual(n_calls(), 5)  # classpath only
+        del os.environ["HADOOP_VERSION"]
+        # info from the environment
+        os.environ[hu.CACHE_DIR_ENV] = ""
+        os.environ[hu.HADOOP_INFO_ENV] = json.dumps(self.pf.dump_info())
+        self.assertEqual(hu.PathFinder().find(), info)
+        self.assertEqual(n_calls(), 5)
+        os.environ[hu.HADOOP_INFO_ENV] = "{"
+        self.assertEqual(hu.PathFinder().find(), info)
+        self.assertEqual(n_calls(), 7)
+
     def __check_params(self, xml_content=None, expected=None):
         if expected is None:
             expected = {}
@@ -145,6 +196,7 @@ def suite():
     suite.addTest(TestHadoopUtils('test_get_hadoop_exec'))
     suite.addTest(TestHadoopUtils('test_get_hadoop_version'))
     suite.addTest(TestHadoopUtils('test_get_hadoop_params'))
+    suite.addTest(TestHadoopUtils('test_info_cache'))
     return suite
 
 
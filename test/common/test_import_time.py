@@ -0,0 +1,127 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+"""
+Import time of the modules loaded by MapReduce tasks.
+
+Measured with ``python -X importtime`` in a fresh interpreter. Every task
+pays this (plus interpreter startup), so modules that are only needed in
+specific cases must be imported where they are used.
+"""
+
+import os
+import subprocess
+import sys
+import unittest
+
+import pydoop
+
+TASK_MODULE = "pydoop.mapreduce.pipes"
+# max cumulative import time of TASK_MODULE, in seconds (currently ~0.02)
+BUDGET = 0.5
+# must not be imported by TASK_MODULE
+DEFERRED = frozenset([
+    "configparser",
+    "glob",
+    "hmac",
+    "json",
+    "logging",
+    "multiprocessing",
+    "platform",
+    "pydoop.utils.misc",
+    "socketserver",
+    "subprocess",
+    "tempfile",
+    "traceback",
+    "uuid",
+    "xml.dom.minidom",
+])
+
+
+def import_times(module):
+    """\
+    Import ``module`` in a new interpreter and return a dict that maps the
+    name of each module imported as a result to its cumulative import time
+    in seconds.
+    """
+    env = os.environ.copy()
+    env["PYTHONPATH"] = os.pathsep.join([
+        os.path.dirname(pydoop.package_dir()), env.get("PYTHONPATH", "")
+    ])
+    p = subprocess.Popen(
+        [sys.executable, "-X", "importtime", "-c", "import %s" % module],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+        universal_newlines=True
+    )
+    _, err = p.communicate()
+    if p.returncode:
+        raise RuntimeError(err)
+    times = {}
+    for line in err.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        try:
+            times[name.strip()] = int(cumulative) / 1e6
+        except ValueError:
+            pass  # header
+    return times
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "needs -X importtime")
+class TestImportTime(unittest.TestCase):
+
+    def setUp(self):
+        self.times = import_times(TASK_MODULE)
+
+    def test_deferred(self):
+        self.assertIn(TASK_MODULE, self.times)
+        self.assertEqual(sorted(DEFERRED.intersection(self.times)), [])
+
+    def test_budget(self):
+        self.assertLess(self.times[TASK_MODULE], BUDGET)
+
+    def test_lazy_hadoop_info(self):
+        code = "; ".join([
+            "import pydoop",
+            "assert '_HADOOP_INFO' not in vars(pydoop)",
+            "assert isinstance(pydoop._HADOOP_INFO, dict)",
+            "assert '_HADOOP_INFO' in vars(pydoop)",
+        ])
+        subprocess.check_call([sys.executable, "-c", code], env=dict(
+            os.environ,
+            PYTHONPATH=os.path.dirname(pydoop.package_dir()),
+            PYDOOP_CACHE_DIR="",
+        ))
+
+
+CASES = [
+    TestImportTime,
+]
+
+
+def suite():
+    ret = unittest.TestSuite()
+    test_loader = unittest.TestLoader()
+    for c in CASES:
+        ret.addTest(test_loader.loadTestsFromTestCase(c))
+    return ret
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run((suite()))
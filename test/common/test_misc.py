@@ -0,0 +1,179 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+import threading
+import unittest
+
+import pydoop.utils.misc as misc
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.t = 0.
+
+    def __call__(self):
+        return self.t
+
+    def tick(self, s):
+        self.t += s
+
+
+class Context(object):
+
+    def __init__(self):
+        self.names = []
+        self.counters = {}
+
+    def get_counter(self, group, name):
+        self.names.append((group, name))
+        return len(self.names) - 1
+
+    def increment_counter(self, counter, amount):
+        name = self.names[counter][1]
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+
+class TestPhaseTimer(unittest.TestCase):
+
+    def setUp(self):
+        self.wall, self.cpu = Clock(), Clock()
+        self.orig_clocks = misc._wall, misc._cpu
+        misc._wall, misc._cpu = self.wall, self.cpu
+
+    def tearDown(self):
+        misc._wall, misc._cpu = self.orig_clocks
+
+    def tick(self, wall, cpu=0.):
+        self.wall.tick(wall)
+        self.cpu.tick(cpu)
+
+    def test_exclusive(self):
+        timer = misc.PhaseTimer(Context())
+        self.tick(1)
+        with timer.time_block("read"):
+            self.tick(2, 1)
+            with timer.time_block("map"):
+                self.tick(3, 3)
+            self.tick(1)
+        self.tick(4, 2)
+        self.assertEqual(timer.totals(), {
+            "other": (5., 2.), "read": (3., 1.), "map": (3., 3.),
+        })
+        with self.assertRaises(RuntimeError):
+            with timer.time_block("read"):
+                timer.stop("map")
+
+    def test_in_progress(self):
+        timer = misc.PhaseTimer(Context())
+        timer.start("reduce")
+        self.tick(2, 1)
+        timer.start("write")
+        self.tick(1, 1)
+        self.assertEqual(timer.totals(), {
+            "other": (0., 0.), "reduce": (2., 1.), "write": (1., 1.),
+        })
+
+    def test_sampled(self):
+        timer = misc.PhaseTimer(Context(), sample=10)
+        calls = []
+
+        def write():
+            self.tick(1)
+
+        def map_(i):
+            calls.append(timer.sampling)
+            self.tick(2)
+            nested_write()
+            return i
+
+        nested_write = timer.nested(write, "write")
+        sampled_map = timer.sampled(map_, "map")
+        out = [sampled_map(_) for _ in range(100)]
+        self.assertEqual(out, list(range(100)))
+        n_sampled = sum(1 for _ in calls if _)
+        self.assertTrue(n_sampled > 0)
+        self.assertTrue(set(calls) <= {0, 10})
+        totals = timer.totals()
+        self.assertEqual(totals["map"][0], 20. * n_sampled)
+        self.assertEqual(totals["write"][0], 10. * n_sampled)
+        self.assertEqual(timer.sampling, 0)
+        # outside of a sampled run, nested calls are not timed
+        nested_write()
+        self.assertEqual(timer.totals()["write"][0], 10. * n_sampled)
+
+    def test_sampled_iter(self):
+        timer = misc.PhaseTimer(Context(), sample=1)
+
+        def records():
+            for i in range(5):
+                self.tick(1)
+                yield i
+
+        self.assertEqual(
+            list(timer.sampled_iter(records(), "record_reader")),
+            list(range(5))
+        )
+        self.assertEqual(timer.totals()["record_reader"][0], 5.)
+
+    def test_other_threads(self):
+        timer = misc.PhaseTimer(Context())
+        timed_tick = timer.timed(self.tick, "map")
+        thread = threading.Thread(target=timed_tick, args=(1,))
+        thread.start()
+        thread.join()
+        self.assertNotIn("map", timer.totals())
+        timed_tick(1)
+        self.assertEqual(timer.totals()["map"], (1., 0.))
+
+    def test_report(self):
+        ctx = Context()
+        timer = misc.PhaseTimer(ctx, "PHASES")
+        with timer.time_block("map"):
+            self.tick(1.5, 1)
+        timer.report()
+        self.assertEqual(ctx.counters, {
+            "TIME_MAP (ms)": 1500, "CPU_MAP (ms)": 1000,
+            "TIME_OTHER (ms)": 0, "CPU_OTHER (ms)": 0,
+        })
+        self.tick(2, 1)
+        timer.report()
+        self.assertEqual(ctx.counters["TIME_MAP (ms)"], 1500)
+        self.assertEqual(ctx.counters["TIME_OTHER (ms)"], 2000)
+        self.assertEqual(ctx.counters["CPU_OTHER (ms)"], 1000)
+        self.assertEqual(set(g for g, _ in ctx.names), {"PHASES"})
+        timer.reset()
+        self.tick(1)
+        self.assertEqual(timer.totals(), {"other": (1., 0.)})
+
+
+CASES = [
+    TestPhaseTimer,
+]
+
+
+def suite():
+    ret = unittest.TestSuite()
+    test_loader = unittest.TestLoader()
+    for c in CASES:
+        ret.addTest(test_loader.loadTestsFromTestCase(c))
+    return ret
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run((suite()))
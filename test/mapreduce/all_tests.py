@@ -21,8 +21,16 @@ from pydoop.test_utils import get_module
 
 
 TEST_MODULE_NAMES = [
+    'test_binary_protocol',
     'test_connections',
+    'test_grouping',
+    'test_intermediate',
+    'test_job_conf',
+    'test_memory',
     'test_opaque',
+    'test_sampler',
+    'test_spill',
+    'test_zygote',
 ]
 
 
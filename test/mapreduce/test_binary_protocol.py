@@ -0,0 +1,101 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+import struct
+import unittest
+
+import pydoop.mapreduce.binary_protocol as bp
+
+IO_PKG = "org.apache.hadoop.io"
+
+
+class TestDeserializers(unittest.TestCase):
+
+    def setUp(self):
+        self.orig_get_k = bp.Downlink.get_k
+        self.orig_get_v = bp.Downlink.get_v
+        self.orig_formats = bp.MAP_ITEM_FORMATS.copy()
+        self.orig_deser = bp.PY_DESERIALIZERS.copy()
+
+    def tearDown(self):
+        bp.Downlink.get_k = self.orig_get_k
+        bp.Downlink.get_v = self.orig_get_v
+        bp.MAP_ITEM_FORMATS.clear()
+        bp.MAP_ITEM_FORMATS.update(self.orig_formats)
+        bp.PY_DESERIALIZERS.clear()
+        bp.PY_DESERIALIZERS.update(self.orig_deser)
+
+    def __setup(self, key_type, value_type, **kwargs):
+        downlink = bp.Downlink(None, None, **kwargs)
+        downlink.setup_deser(key_type, value_type)
+        return downlink
+
+    def test_builtin(self):
+        for name, fmt in [
+                ("IntWritable", "i"),
+                ("VLongWritable", "v"),
+                ("DoubleWritable", "d"),
+                ("NullWritable", "n"),
+        ]:
+            d = self.__setup("%s.Text" % IO_PKG, "%s.%s" % (IO_PKG, name))
+            self.assertEqual(d.map_items_fmt, "s" + fmt)
+            self.assertIsNone(d.key_deser)
+            self.assertIsNone(d.value_deser)
+
+    def test_raw(self):
+        d = self.__setup(
+            "%s.LongWritable" % IO_PKG, "%s.IntWritable" % IO_PKG,
+            raw_keys=True, raw_values=True
+        )
+        self.assertEqual(d.map_items_fmt, "bb")
+
+    def test_unknown(self):
+        d = self.__setup("foo.Bar", "%s.IntWritable" % IO_PKG)
+        self.assertEqual(d.map_items_fmt, "bi")
+
+    def test_register(self):
+        def deser(b):
+            return struct.unpack(">ii", b)
+        bp.register_deserializer("foo.IntArray", "I")
+        bp.register_deserializer("foo.Pair", deser)
+        d = self.__setup("foo.IntArray", "foo.Pair")
+        self.assertEqual(d.map_items_fmt, "Ib")
+        self.assertIsNone(d.key_deser)
+        self.assertIs(d.value_deser, deser)
+        bp.register_deserializer("foo.Pair", "q")
+        d = self.__setup("foo.IntArray", "foo.Pair")
+        self.assertEqual(d.map_items_fmt, "Iq")
+        self.assertIsNone(d.value_deser)
+        for deser in "m", "x", "bb", None:
+            self.assertRaises(
+                ValueError, bp.register_deserializer, "foo.Pair", deser
+            )
+
+
+def suite():
+    suite_ = unittest.TestSuite()
+    suite_.addTest(TestDeserializers('test_builtin'))
+    suite_.addTest(TestDeserializers('test_raw'))
+    suite_.addTest(TestDeserializers('test_unknown'))
+    suite_.addTest(TestDeserializers('test_register'))
+    return suite_
+
+
+if __name__ == '__main__':
+    _RUNNER = unittest.TextTestRunner(verbosity=2)
+    _RUNNER.run((suite()))
@@ -18,16 +18,33 @@
 
 import io
 import os
+import random
+import socket
+import threading
+import time
 import unittest
 
 import pydoop.mapreduce.api as api
 import pydoop.mapreduce.binary_protocol as bp
+import pydoop.mapreduce.connections as connections
+import pydoop.mapreduce.intermediate as intermediate
+import pydoop.mapreduce.partitioners as partitioners
 import pydoop.mapreduce.pipes as pipes
+import pydoop.mapreduce.workers as workers
 import pydoop.sercore as sercore
 from pydoop.test_utils import WDTestCase
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 M_NAME, R_NAME = "m_task.cmd", "r_task.cmd"
+NRED = 4
+
+
+def java_hash(data):
+    # same as org.apache.hadoop.io.Text.hashCode
+    h = 1
+    for b in bytearray(data):
+        h = (31 * h + (b - 256 if b > 127 else b)) & 0xffffffff
+    return h & 0x7fffffff
 
 
 class Mapper(api.Mapper):
@@ -36,12 +53,114 @@ class Mapper(api.Mapper):
         context.emit(context.key, context.value)
 
 
+class WordCountMapper(api.Mapper):
+
+    def map(self, context):
+        for w in context.value.split():
+            context.emit(w, 1)
+
+
+class MultiWordCountMapper(api.Mapper):
+
+    def map(self, context):
+        for w in context.value.split():
+            for i in range(10):
+                context.emit((w, i), 1)
+
+
 class Reducer(api.Reducer):
 
     def reduce(self, context):
         context.emit(context.key, sum(context.values))
 
 
+class FirstValueReducer(api.Reducer):
+
+    def reduce(self, context):
+        context.emit(context.key, next(iter(context.values)))
+
+
+class CountingMapper(api.Mapper):
+
+    def __init__(self, context):
+        super(CountingMapper, self).__init__(context)
+        self.counter = None
+
+    def map(self, context):
+        if self.counter is None:
+            self.counter = context.get_counter("TEST", "RECORDS")
+        context.increment_counter(self.counter, 1)
+        context.emit(context.key, context.value)
+
+
+class ThreadedMapper(api.ThreadedMapper):
+
+    threads = 3
+
+    def map(self, context):
+        if context.key == 0:
+            context.set_status("first record")
+        counter = context.get_counter("TEST", "THREADED")
+        context.increment_counter(counter, 1)
+        time.sleep(0.001 * random.random())
+        context.emit(context.key, context.value)
+
+
+class UnorderedMapper(ThreadedMapper):
+
+    ordered = False
+    max_pending = 5
+
+
+class FailingMapper(api.Mapper):
+
+    def map(self, context):
+        raise ValueError("map failed")
+
+
+class SumCombiner(api.Combiner):
+
+    def reduce(self, context):
+        context.emit(context.key, sum(context.values))
+
+
+class AggregatingCombiner(api.AggregatingCombiner):
+
+    def combine(self, acc, value):
+        return acc + value
+
+
+# the test task has a single reducer
+class HashPartitioner(partitioners.HashPartitioner):
+
+    def __init__(self, context):
+        context.nred = NRED
+        super(HashPartitioner, self).__init__(context)
+
+
+class KeyFieldPartitioner(partitioners.KeyFieldPartitioner):
+
+    def __init__(self, context):
+        context.nred = NRED
+        super(KeyFieldPartitioner, self).__init__(context, fields=(0, 1))
+
+
+class BatchMapper(api.BatchMapper):
+
+    batch_size = 3
+
+    def map_batch(self, context, keys, values):
+        context.emit_batch(keys, values)
+
+
+class BatchReducer(api.BatchReducer):
+
+    batch_size = 3
+
+    def reduce_batch(self, context, keys, values):
+        context.emit_batch(keys, [sum(_) for _ in values])
+
+
 # move to test_utils?
 class UplinkDumpReader(object):
 
@@ -58,7 +177,7 @@ class UplinkDumpReader(object):
         elif cmd == bp.OUTPUT:
             return cmd, self.stream.read_tuple("bb")
         elif cmd == bp.PARTITIONED_OUTPUT:
-            return cmd, self.stream.write_tuple("ibb")
+            return cmd, self.stream.read_tuple("ibb")
         elif cmd == bp.STATUS:
             return cmd, self.stream.read_tuple("s")
         elif cmd == bp.PROGRESS:
@@ -90,24 +209,557 @@ class TestFileConnection(WDTestCase):
         factory = pipes.Factory(Mapper, reducer_class=Reducer)
         self.__run_test(R_NAME, factory)
 
-    def __run_test(self, name, factory, **kwargs):
+    def test_map_emit_batch(self):
+        factory = pipes.Factory(Mapper)
+        kwargs = {"private_encoding": False}
+        out = self.__run_test(M_NAME, factory, **kwargs)
+        out_batch = self.__run_test(
+            M_NAME, factory, emit_batch_size=100, **kwargs
+        )
+        self.assertEqual(out_batch, out)
+
+    def test_reduce_emit_batch(self):
+        factory = pipes.Factory(Mapper, reducer_class=Reducer)
+        out = self.__run_test(R_NAME, factory)
+        out_batch = self.__run_test(R_NAME, factory, emit_batch_size=7)
+        self.assertEqual(out_batch, out)
+
+    def test_reduce_partial(self):
+        factory = pipes.Factory(Mapper, reducer_class=Reducer)
+        out = self.__run_test(R_NAME, factory)
+        factory = pipes.Factory(Mapper, reducer_class=FirstValueReducer)
+        out_partial = self.__run_test(R_NAME, factory)
+        self.assertEqual([k for k, _ in out_partial], [k for k, _ in out])
+
+    def test_map_intermediate_codec(self):
+        factory = pipes.Factory(Mapper, reducer_class=Reducer)
+        pickle_codec = intermediate.PickleCodec()
+        ordered_codec = intermediate.OrderedCodec()
+        out = self.__run_test(M_NAME, factory)
+        out_ordered = self.__run_test(
+            M_NAME, factory, intermediate_codec="ordered"
+        )
+        self.assertEqual(
+            [tuple(ordered_codec.decode(_) for _ in kv) for kv in out_ordered],
+            [tuple(pickle_codec.decode(_) for _ in kv) for kv in out],
+        )
+
+    def test_map_aggregating_combiner(self):
+        codec = intermediate.PickleCodec()
+        results = []
+        for cclass in SumCombiner, AggregatingCombiner:
+            factory = pipes.Factory(
+                WordCountMapper, reducer_class=Reducer, combiner_class=cclass
+            )
+            out = self.__run_test(M_NAME, factory)
+            results.append([tuple(codec.decode(_) for _ in kv) for kv in out])
+            self.assertEqual(self.counters["SPILLS"], 1)
+            self.assertEqual(self.counters["SPILLED_KEYS"], len(out))
+            self.assertTrue(self.counters["SPILLED_BYTES"] > 0)
+        self.assertEqual(results[1], results[0])
+        keys = [k for k, _ in results[0]]
+        self.assertEqual(len(keys), len(set(keys)))
+        self.assertTrue(max(v for _, v in results[0]) > 1)
+
+    def test_map_local_spill(self):
+        codec = intermediate.PickleCodec()
+        for cclass in SumCombiner, AggregatingCombiner:
+            factory = pipes.Factory(
+                MultiWordCountMapper, reducer_class=Reducer,
+                combiner_class=cclass
+            )
+            counts = []
+            for local_spill in False, True:
+                out = self.__run_test(
+                    M_NAME, factory, local_spill=local_spill, sort_mb=1
+                )
+                self.assertTrue(self.counters["SPILLS"] > 1)
+                c = {}
+                for kv in out:
+                    k, v = [codec.decode(_) for _ in kv]
+                    c[k] = c.get(k, 0) + v
+                counts.append(c)
+            self.assertEqual(counts[1], counts[0])
+            # with local spill, each key is sent only once
+            self.assertEqual(len(out), len(counts[1]))
+            self.assertTrue(len(out) < self.counters["SPILLED_KEYS"])
+
+    def test_map_native_partitioner(self):
+        factory = pipes.Factory(Mapper, partitioner_class=HashPartitioner)
+        kwargs = {"private_encoding": False}
+        out = self.__run_test(M_NAME, pipes.Factory(Mapper), **kwargs)
+        for batch_size in 1, 100:
+            self.assertEqual(self.__run_test(
+                M_NAME, factory, emit_batch_size=batch_size, **kwargs
+            ), [])
+            self.assertEqual([(k, v) for _, k, v in self.partitioned], out)
+            for p, k, _ in self.partitioned:
+                self.assertEqual(p, java_hash(k) % NRED)
+            self.assertEqual(
+                len(set(p for p, _, _ in self.partitioned)), NRED
+            )
+
+    def test_map_key_field_partitioner(self):
+        factory = pipes.Factory(
+            MultiWordCountMapper, partitioner_class=KeyFieldPartitioner
+        )
+        codec = intermediate.OrderedCodec()
+        for batch_size in 1, 100:
+            self.__run_test(
+                M_NAME, factory, intermediate_codec="ordered",
+                emit_batch_size=batch_size
+            )
+            parts = {}
+            for p, k, _ in self.partitioned:
+                parts.setdefault(codec.decode(k)[0], set()).add(p)
+            self.assertTrue(all(len(_) == 1 for _ in parts.values()))
+            self.assertEqual(len(set.union(*parts.values())), NRED)
+
+    def test_map_workers(self):
+        kwargs = {"private_encoding": False}
+        out = self.__run_test(M_NAME, pipes.Factory(Mapper), **kwargs)
+        for mclass in CountingMapper, BatchMapper:
+            out_workers = self.__run_test(
+                M_NAME, pipes.Factory(mclass), map_workers=3, **kwargs
+            )
+            self.assertEqual(sorted(out_workers), sorted(out))
+        out_workers = self.__run_test(
+            M_NAME, pipes.Factory(CountingMapper), map_workers=3,
+            emit_batch_size=10, **kwargs
+        )
+        self.assertEqual(sorted(out_workers), sorted(out))
+        self.assertEqual(self.counters["RECORDS"], len(out))
+        # native partitioner and combiner in the workers
+        codec = intermediate.PickleCodec()
+        factory = pipes.Factory(
+            WordCountMapper, reducer_class=Reducer, combiner_class=SumCombiner,
+            partitioner_class=HashPartitioner
+        )
+        counts = []
+        for n in 1, 3:
+            self.__run_test(M_NAME, factory, map_workers=n)
+            c = {}
+            for p, k, v in self.partitioned:
+                self.assertEqual(p, java_hash(k) % NRED)
+                k, v = codec.decode(k), codec.decode(v)
+                c[k] = c.get(k, 0) + v
+            counts.append(c)
+            self.assertEqual(self.counters["SPILLS"], n)
+        self.assertEqual(counts[1], counts[0])
+        with self.assertRaises(RuntimeError) as cm:
+            self.__run_test(
+                M_NAME, pipes.Factory(FailingMapper), map_workers=2, **kwargs
+            )
+        self.assertIn("map failed", str(cm.exception))
+
+    def test_map_threads(self):
+        kwargs = {"private_encoding": False}
+        out = self.__run_test(M_NAME, pipes.Factory(Mapper), **kwargs)
+        self.assertEqual(
+            self.__run_test(M_NAME, pipes.Factory(ThreadedMapper), **kwargs),
+            out
+        )
+        self.assertEqual(self.counters["THREADED"], len(out))
+        out_unordered = self.__run_test(
+            M_NAME, pipes.Factory(UnorderedMapper), **kwargs
+        )
+        self.assertEqual(sorted(out_unordered), sorted(out))
+        for n in 0, 2:
+            self.assertEqual(self.__run_test(
+                M_NAME, pipes.Factory(Mapper), map_threads=n, **kwargs
+            ), out)
+        out_workers = self.__run_test(
+            M_NAME, pipes.Factory(ThreadedMapper), map_workers=2, **kwargs
+        )
+        self.assertEqual(sorted(out_workers), sorted(out))
+        self.assertEqual(self.counters["THREADED"], len(out))
+        with self.assertRaises(ValueError):
+            self.__run_test(
+                M_NAME, pipes.Factory(FailingMapper), map_threads=2, **kwargs
+            )
+
+    def test_map_batch(self):
+        kwargs = {"private_encoding": False}
+        out = self.__run_test(M_NAME, pipes.Factory(Mapper), **kwargs)
+        out_batch = self.__run_test(
+            M_NAME, pipes.Factory(BatchMapper), **kwargs
+        )
+        self.assertEqual(out_batch, out)
+
+    def test_reduce_batch(self):
+        factory = pipes.Factory(Mapper, reducer_class=Reducer)
+        out = self.__run_test(R_NAME, factory)
+        factory = pipes.Factory(Mapper, reducer_class=BatchReducer)
+        out_batch = self.__run_test(R_NAME, factory)
+        self.assertEqual(out_batch, out)
+
+    def test_map_instrument(self):
+        kwargs = {"private_encoding": False}
+        out = self.__run_test(M_NAME, pipes.Factory(Mapper), **kwargs)
+        for map_workers in None, 2:
+            out_instrument = self.__run_test(
+                M_NAME, pipes.Factory(Mapper), map_workers=map_workers,
+                instrument=True, instrument_sample=1, **kwargs
+            )
+            self.assertEqual(sorted(out_instrument), sorted(out))
+            for phase in "READ", "MAP", "WRITE", "OTHER":
+                for kind in "TIME", "CPU":
+                    self.assertIn("%s_%s (ms)" % (kind, phase), self.counters)
+        factory = pipes.Factory(
+            WordCountMapper, reducer_class=Reducer, combiner_class=SumCombiner
+        )
+        out = self.__run_test(M_NAME, factory)
+        self.assertEqual(self.__run_test(
+            M_NAME, factory, instrument=True, instrument_sample=3
+        ), out)
+        for phase in "COMBINE", "SPILL":
+            self.assertIn("TIME_%s (ms)" % phase, self.counters)
+        self.assertEqual(self.__run_test(
+            M_NAME, pipes.Factory(BatchMapper), instrument=True, **kwargs
+        ), self.__run_test(M_NAME, pipes.Factory(BatchMapper), **kwargs))
+
+    def test_reduce_instrument(self):
+        for rclass in Reducer, BatchReducer:
+            factory = pipes.Factory(Mapper, reducer_class=rclass)
+            out = self.__run_test(R_NAME, factory)
+            self.assertFalse(any(
+                _.startswith("TIME_") for _ in self.counters
+            ))
+            self.assertEqual(self.__run_test(
+                R_NAME, factory, instrument=True, instrument_sample=1
+            ), out)
+            for phase in "READ", "REDUCE", "OTHER":
+                self.assertIn("TIME_%s (ms)" % phase, self.counters)
+
+    def __run_test(self, name, factory, sort_mb=None, **kwargs):
         orig_path = os.path.join(THIS_DIR, name)
         cmd_path = os.path.join(self.wd, name)
         with io.open(orig_path, "rb") as fi, io.open(cmd_path, "wb") as fo:
-            fo.write(fi.read())
+            cmds = fi.read()
+            if sort_mb is not None:
+                prop = b"mapreduce.task.io.sort.mb"
+                value = str(sort_mb).encode("ascii")
+                cmds = cmds.replace(
+                    prop + b"\x03100", prop + bytearray([len(value)]) + value
+                )
+            fo.write(cmds)
         os.environ["mapreduce.pipes.commandfile"] = cmd_path
         pipes.run_task(factory, **kwargs)
         out_cmd_path = "%s.out" % cmd_path
         self.assertTrue(os.path.exists(out_cmd_path))
         with sercore.FileInStream(out_cmd_path) as stream:
-            out_cmds = set(cmd for cmd, _ in UplinkDumpReader(stream))
-        self.assertEqual(out_cmds, {bp.OUTPUT, bp.PROGRESS})
+            out_cmds = list(UplinkDumpReader(stream))
+        cmds = set(cmd for cmd, _ in out_cmds)
+        self.assertIn(bp.PROGRESS, cmds)
+        self.assertTrue(cmds & {bp.OUTPUT, bp.PARTITIONED_OUTPUT})
+        # combiner counters
+        self.assertTrue(cmds.issubset({
+            bp.OUTPUT, bp.PARTITIONED_OUTPUT, bp.PROGRESS, bp.STATUS,
+            bp.REGISTER_COUNTER, bp.INCREMENT_COUNTER
+        }))
+        self.counters = self.__get_counters(out_cmds)
+        self.partitioned = [
+            args for cmd, args in out_cmds if cmd == bp.PARTITIONED_OUTPUT
+        ]
+        return [args for cmd, args in out_cmds if cmd == bp.OUTPUT]
+
+    def __get_counters(self, out_cmds):
+        names, counters = {}, {}
+        for cmd, args in out_cmds:
+            if cmd == bp.REGISTER_COUNTER:
+                names[args[0]] = args[2]
+                counters[args[2]] = 0
+            elif cmd == bp.INCREMENT_COUNTER:
+                counters[names[args[0]]] += args[1]
+        return counters
+
+
+class ClosingRecordReader(api.RecordReader):
+
+    def __init__(self, context):
+        super(ClosingRecordReader, self).__init__(context)
+        self.log_path = context.job_conf["test.close.log"]
+        self.it = iter(range(1000))
+
+    def next(self):
+        i = next(self.it)
+        return i, b"%d" % i
+
+    def get_progress(self):
+        return 0.0
+
+    def close(self):
+        with io.open(self.log_path, "a") as f:
+            f.write(u"%d\n" % os.getpid())
+
+
+class TestMapWorkers(WDTestCase):
+
+    def setUp(self):
+        super(TestMapWorkers, self).setUp()
+        self.cmd_path = os.path.join(self.wd, M_NAME)
+
+    def tearDown(self):
+        os.environ.pop("mapreduce.pipes.commandfile", None)
+        super(TestMapWorkers, self).tearDown()
+
+    def __run(self, factory, items=None, job_conf=None, **kwargs):
+        job_conf = job_conf or {}
+        with sercore.FileOutStream(self.cmd_path) as s:
+            s.write_tuple("ibb", (bp.AUTHENTICATION_REQ, b"", b""))
+            s.write_tuple("ii", (bp.START, bp.PROTOCOL_VERSION))
+            s.write_tuple("ii", (bp.SET_JOB_CONF, 2 * len(job_conf)))
+            for item in job_conf.items():
+                s.write_tuple("ss", item)
+            if items is None:
+                s.write_tuple("ibii", (bp.RUN_MAP, b"", 1, 0))
+            else:
+                text = "org.apache.hadoop.io.Text"
+                s.write_tuple("iss", (bp.SET_INPUT_TYPES, text, text))
+                s.write_tuple("ibii", (bp.RUN_MAP, b"", 1, 1))
+                for k, v in items:
+                    s.write_tuple("ibb", (bp.MAP_ITEM, k, v))
+                s.write_vint(bp.CLOSE)
+        os.environ["mapreduce.pipes.commandfile"] = self.cmd_path
+        pipes.run_task(factory, private_encoding=False, **kwargs)
+        with sercore.FileInStream("%s.out" % self.cmd_path) as stream:
+            return [
+                args for cmd, args in UplinkDumpReader(stream)
+                if cmd == bp.OUTPUT
+            ]
+
+    def test_large_records(self):
+        # results must be received while sending input, or the driver and
+        # the workers block each other on full connection buffers
+        items = [(b"%d" % i, b"%04d" % i * 500) for i in range(4000)]
+        for n in 2, 3:
+            out = self.__run(pipes.Factory(Mapper), items, map_workers=n)
+            self.assertEqual(sorted(out), sorted(items))
+
+    def test_record_reader(self):
+        log_path = os.path.join(self.wd, "close.log")
+        for mclass, n in [(Mapper, 2), (ThreadedMapper, None),
+                          (ThreadedMapper, 2), (BatchMapper, None)]:
+            out = self.__run(
+                pipes.Factory(mclass, record_reader_class=ClosingRecordReader),
+                job_conf={"test.close.log": log_path}, map_workers=n
+            )
+            self.assertEqual(len(out), 1000)
+            with io.open(log_path, "rt") as f:
+                self.assertEqual(f.read().split(), [str(os.getpid())])
+            os.remove(log_path)
+
+
+class TestProgress(unittest.TestCase):
+
+    def test_counters(self):
+        ctx = pipes.TaskContext(pipes.Factory(None))
+        ctx.uplink = workers.CaptureUplink()
+        try:
+            a, b, c = [ctx.get_counter("G", _) for _ in "abc"]
+            ctx.increment_counter(a, 2)
+            ctx.increment_counter(c, 1)
+            ctx.increment_counter(c, -1)
+            ctx.progress()  # the first call always reports
+            self.assertEqual(ctx.uplink.collect()[1], {("G", "a"): 2})
+            self.assertEqual(ctx.counters, [0, 0, 0])
+            ctx.increment_counter(c, 3)
+            ctx.increment_counter(b, 1)
+            ctx.increment_counter(c, 1)
+            ctx.progress()  # not due yet
+            self.assertEqual(ctx.uplink.collect()[1], {})
+            for bad in 3, -1, "a", None:
+                self.assertRaises(ValueError, ctx.increment_counter, bad, 1)
+        finally:
+            ctx.close()
+        self.assertEqual(
+            ctx.uplink.collect()[1], {("G", "b"): 1, ("G", "c"): 4}
+        )
+
+    def test_heartbeat(self):
+        hb = pipes.Heartbeat(0.01)
+        try:
+            self.assertTrue(hb.beat)
+            hb.beat = False
+            time.sleep(0.1)
+            self.assertTrue(hb.beat)
+        finally:
+            hb.stop()
+
+
+class TestUnixConnection(WDTestCase):
+
+    def setUp(self):
+        super(TestUnixConnection, self).setUp()
+        self.old_env = os.environ.copy()
+        os.environ.pop("mapreduce.pipes.command.port", None)
+        os.environ.pop("mapreduce.pipes.commandfile", None)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.old_env)
+        super(TestUnixConnection, self).tearDown()
+
+    @unittest.skipUnless(hasattr(socket, "AF_UNIX"), "no AF_UNIX support")
+    def test_map(self):
+        with io.open(os.path.join(THIS_DIR, M_NAME), "rb") as f:
+            cmds = f.read()
+        path = os.path.join(self.wd, "pipes.sock")
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(1)
+        received = []
+
+        def serve():
+            conn, _ = server.accept()
+            conn.sendall(cmds)
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    break
+                received.append(chunk)
+            conn.close()
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        os.environ["mapreduce.pipes.command.socket"] = path
+        try:
+            pipes.run_task(pipes.Factory(Mapper), private_encoding=False)
+        finally:
+            thread.join()
+            server.close()
+        out_cmd_path = os.path.join(self.wd, "out.cmd")
+        with io.open(out_cmd_path, "wb") as f:
+            f.write(b"".join(received))
+        with sercore.FileInStream(out_cmd_path) as stream:
+            out_cmds = list(UplinkDumpReader(stream))
+        self.assertEqual(
+            set(cmd for cmd, _ in out_cmds), {bp.OUTPUT, bp.PROGRESS}
+        )
+        self.assertTrue(sum(1 for cmd, _ in out_cmds if cmd == bp.OUTPUT))
+
+
+class TestFdConnection(WDTestCase):
+
+    def setUp(self):
+        super(TestFdConnection, self).setUp()
+        self.old_env = os.environ.copy()
+        os.environ.pop("mapreduce.pipes.command.port", None)
+        os.environ.pop("mapreduce.pipes.commandfile", None)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.old_env)
+        super(TestFdConnection, self).tearDown()
+
+    @unittest.skipUnless(hasattr(socket, "socketpair"), "no socketpair")
+    def test_map(self):
+        with io.open(os.path.join(THIS_DIR, M_NAME), "rb") as f:
+            cmds = f.read()
+        java_side, task_side = socket.socketpair()
+        received = []
+
+        def serve():
+            java_side.sendall(cmds)
+            while True:
+                chunk = java_side.recv(65536)
+                if not chunk:
+                    break
+                received.append(chunk)
+            java_side.close()
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        os.environ[connections.FD_ENV] = str(os.dup(task_side.fileno()))
+        task_side.close()
+        try:
+            pipes.run_task(pipes.Factory(Mapper), private_encoding=False)
+        finally:
+            thread.join()
+        self.assertNotIn(connections.FD_ENV, os.environ)
+        out_cmd_path = os.path.join(self.wd, "out.cmd")
+        with io.open(out_cmd_path, "wb") as f:
+            f.write(b"".join(received))
+        with sercore.FileInStream(out_cmd_path) as stream:
+            out_cmds = list(UplinkDumpReader(stream))
+        self.assertEqual(
+            set(cmd for cmd, _ in out_cmds), {bp.OUTPUT, bp.PROGRESS}
+        )
+        self.assertTrue(sum(1 for cmd, _ in out_cmds if cmd == bp.OUTPUT))
+
+
+class TestShmConnection(WDTestCase):
+
+    def setUp(self):
+        super(TestShmConnection, self).setUp()
+        self.old_env = os.environ.copy()
+        os.environ.pop("mapreduce.pipes.command.port", None)
+        os.environ.pop("mapreduce.pipes.commandfile", None)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.old_env)
+        super(TestShmConnection, self).tearDown()
+
+    def test_map(self):
+        with io.open(os.path.join(THIS_DIR, M_NAME), "rb") as f:
+            cmds = f.read()
+        down_path = os.path.join(self.wd, "down")
+        up_path = os.path.join(self.wd, "up")
+        # play the Java side: create the rings and serve them
+        down = sercore.ShmRing(down_path, "w", 4096)
+        up = sercore.ShmRing(up_path, "r", 4096)
+        out_cmds = []
+
+        def send():
+            with sercore.FileOutStream(down) as s:
+                s.write(cmds)
+
+        def receive():
+            with sercore.FileInStream(up) as s:
+                out_cmds.extend(UplinkDumpReader(s))
+
+        threads = [threading.Thread(target=_) for _ in (send, receive)]
+        for t in threads:
+            t.start()
+        os.environ["mapreduce.pipes.command.shm.downlink"] = down_path
+        os.environ["mapreduce.pipes.command.shm.uplink"] = up_path
+        try:
+            pipes.run_task(pipes.Factory(Mapper), private_encoding=False)
+        finally:
+            for t in threads:
+                t.join()
+        self.assertEqual(
+            set(cmd for cmd, _ in out_cmds), {bp.OUTPUT, bp.PROGRESS}
+        )
+        self.assertTrue(sum(1 for cmd, _ in out_cmds if cmd == bp.OUTPUT))
 
 
 def suite():
     suite_ = unittest.TestSuite()
     suite_.addTest(TestFileConnection('test_map'))
     suite_.addTest(TestFileConnection('test_reduce'))
+    suite_.addTest(TestFileConnection('test_map_emit_batch'))
+    suite_.addTest(TestFileConnection('test_reduce_emit_batch'))
+    suite_.addTest(TestFileConnection('test_reduce_partial'))
+    suite_.addTest(TestFileConnection('test_map_intermediate_codec'))
+    suite_.addTest(TestFileConnection('test_map_aggregating_combiner'))
+    suite_.addTest(TestFileConnection('test_map_local_spill'))
+    suite_.addTest(TestFileConnection('test_map_batch'))
+    suite_.addTest(TestFileConnection('test_reduce_batch'))
+    suite_.addTest(TestFileConnection('test_map_native_partitioner'))
+    suite_.addTest(TestFileConnection('test_map_key_field_partitioner'))
+    suite_.addTest(TestFileConnection('test_map_workers'))
+    suite_.addTest(TestFileConnection('test_map_threads'))
+    suite_.addTest(TestFileConnection('test_map_instrument'))
+    suite_.addTest(TestFileConnection('test_reduce_instrument'))
+    suite_.addTest(TestMapWorkers('test_large_records'))
+    suite_.addTest(TestMapWorkers('test_record_reader'))
+    suite_.addTest(TestProgress('test_counters'))
+    suite_.addTest(TestProgress('test_heartbeat'))
+    suite_.addTest(TestUnixConnection('test_map'))
+    suite_.addTest(TestFdConnection('test_map'))
+    suite_.addTest(TestShmConnection('test_map'))
     return suite_
 
 
@@ -0,0 +1,244 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+import os
+import random
+import unittest
+
+import pydoop.mapreduce.api as api
+import pydoop.mapreduce.binary_protocol as bp
+import pydoop.mapreduce.grouping as grouping
+import pydoop.mapreduce.partitioners as partitioners
+import pydoop.mapreduce.pipes as pipes
+import pydoop.sercore as sercore
+from pydoop.mapreduce.api import JobConf
+from pydoop.mapreduce.intermediate import OrderedCodec, PickleCodec
+from pydoop.test_utils import WDTestCase
+
+CMD_NAME = "r_task.cmd"
+CODEC = OrderedCodec()
+
+
+def emit(context, key, value):
+    context.emit(CODEC.encode(key), CODEC.encode(value))
+
+
+class Context(object):
+
+    def __init__(self, job_conf, private_encoding=True, codec=None):
+        self.job_conf = JobConf(job_conf)
+        self._private_encoding = private_encoding
+        self._codec = codec or OrderedCodec()
+
+
+class GroupReducer(api.Reducer):
+
+    def reduce(self, context):
+        keys = []
+        for v in context.values:
+            keys.append(context.values.key)
+            emit(context, context.key, v)
+        emit(context, context.key, tuple(keys))
+
+
+class FirstValueReducer(api.Reducer):
+
+    def reduce(self, context):
+        emit(context, context.key, next(iter(context.values)))
+
+
+class BatchReducer(api.BatchReducer):
+
+    batch_size = 5
+
+    def reduce_batch(self, context, keys, values):
+        for k, vs in zip(keys, values):
+            emit(context, k, tuple(vs))
+
+
+class TestGroupKey(unittest.TestCase):
+
+    def test_ordered(self):
+        ctx = Context({grouping.GROUPING_FIELDS_KEY: "2"})
+        group_key = grouping.get_group_key(ctx)
+        self.assertEqual(group_key(("a", 1, 2.5)), ("a", 1))
+        self.assertEqual(group_key(("a",)), ("a",))
+        self.assertEqual(group_key("a"), "a")
+        ctx = Context({grouping.GROUPING_FIELDS_KEY: "0"})
+        self.assertIsNone(grouping.get_group_key(ctx))
+        self.assertIsNone(grouping.get_group_key(Context({})))
+        ctx = Context({grouping.GROUPING_FIELDS_KEY: "1"}, codec=PickleCodec())
+        self.assertRaises(ValueError, grouping.get_group_key, ctx)
+        ctx = Context({grouping.GROUPING_FIELDS_KEY: "-1"})
+        self.assertRaises(ValueError, grouping.get_group_key, ctx)
+
+    def test_text(self):
+        ctx = Context({
+            grouping.GROUPING_FIELDS_KEY: "2",
+            "mapreduce.map.output.key.field.separator": ":",
+        }, private_encoding=False)
+        group_key = grouping.get_group_key(ctx)
+        self.assertEqual(group_key(b"a:b:c:d"), [b"a", b"b"])
+        self.assertEqual(group_key(b"a:b"), [b"a", b"b"])
+        self.assertEqual(group_key(b"a"), [b"a"])
+
+    def test_java_properties(self):
+        props = grouping.java_properties(2, separator=":")
+        self.assertEqual(props[grouping.GROUPING_FIELDS_KEY], "2")
+        self.assertEqual(
+            props[grouping.KEY_COMPARATOR_KEY], grouping.KEY_FIELD_COMPARATOR
+        )
+        self.assertEqual(
+            props[grouping.KEY_COMPARATOR_OPTIONS_KEY], "-k1,2 -k3"
+        )
+        self.assertEqual(
+            props["mapreduce.map.output.key.field.separator"], ":"
+        )
+
+    def test_default_partitioner(self):
+        for fields, nred, expected in [
+                ("2", 4, partitioners.KeyFieldPartitioner),
+                ("2", 1, type(None)),
+                ("0", 4, type(None)),
+        ]:
+            ctx = pipes.TaskContext(
+                pipes.Factory(None), intermediate_codec="ordered"
+            )
+            ctx._job_conf = JobConf({grouping.GROUPING_FIELDS_KEY: fields})
+            ctx.nred = nred
+            p = ctx.create_partitioner()
+            self.assertIs(type(p), expected)
+            if p:
+                keys = [CODEC.encode(("a", 1, _)) for _ in range(10)]
+                parts = set(p.partition(_, 100) for _ in keys)
+                self.assertEqual(len(parts), 1)
+
+
+class TestGroupedReduce(WDTestCase):
+
+    def setUp(self):
+        super(TestGroupedReduce, self).setUp()
+        # (user, timestamp) keys, already sorted as done by the framework
+        self.keys = sorted(set(
+            (random.choice("abcd"), random.randint(0, 1000))
+            for _ in range(100)
+        ))
+        self.cmd_path = os.path.join(self.wd, CMD_NAME)
+
+    def tearDown(self):
+        os.environ.pop("mapreduce.pipes.commandfile", None)
+        super(TestGroupedReduce, self).tearDown()
+
+    def __write_cmds(self, job_conf):
+        enc = CODEC.encode
+        with sercore.FileOutStream(self.cmd_path) as s:
+            s.write_tuple("ibb", (bp.AUTHENTICATION_REQ, b"", b""))
+            s.write_tuple("ii", (bp.START, bp.PROTOCOL_VERSION))
+            s.write_tuple("ii", (bp.SET_JOB_CONF, 2 * len(job_conf)))
+            for item in job_conf.items():
+                s.write_tuple("ss", item)
+            s.write_tuple("iii", (bp.RUN_REDUCE, 0, 1))
+            for k in self.keys:
+                s.write_tuple("ib", (bp.REDUCE_KEY, enc(k)))
+                for i in range(k[1] % 3 + 1):
+                    s.write_tuple("ib", (bp.REDUCE_VALUE, enc((k[1], i))))
+            s.write_vint(bp.CLOSE)
+
+    def __run(self, reducer_class, fields=1):
+        job_conf = {
+            "pydoop.mapreduce.pipes.intermediate.codec": "ordered",
+            grouping.GROUPING_FIELDS_KEY: str(fields),
+        }
+        self.__write_cmds(job_conf)
+        os.environ["mapreduce.pipes.commandfile"] = self.cmd_path
+        pipes.run_task(
+            pipes.Factory(None, reducer_class=reducer_class),
+            auto_serialize=False
+        )
+        out = []
+        with sercore.FileInStream("%s.out" % self.cmd_path) as s:
+            while True:
+                cmd = s.read_vint()
+                if cmd == bp.DONE:
+                    break
+                elif cmd == bp.OUTPUT:
+                    out.append(tuple(
+                        CODEC.decode(_) for _ in s.read_tuple("bb")
+                    ))
+                else:
+                    self.assertEqual(cmd, bp.PROGRESS)
+                    s.read_float()
+        return out
+
+    def __expected_values(self, keys):
+        return [(k[1], i) for k in keys for i in range(k[1] % 3 + 1)]
+
+    def test_reduce(self):
+        out = self.__run(GroupReducer)
+        users = sorted(set(k[0] for k in self.keys))
+        self.assertEqual(len(out), len(users) + sum(
+            k[1] % 3 + 1 for k in self.keys
+        ))
+        for u in users:
+            keys = [k for k in self.keys if k[0] == u]
+            values = self.__expected_values(keys)
+            group = out[:len(values) + 1]
+            out = out[len(values) + 1:]
+            self.assertTrue(all(k == keys[0] for k, _ in group))
+            self.assertEqual([v for _, v in group[:-1]], values)
+            seen = group[-1][1]
+            self.assertEqual(list(seen), [
+                k for k in keys for _ in range(k[1] % 3 + 1)
+            ])
+        self.assertEqual(out, [])
+
+    def test_reduce_full_key(self):
+        out = self.__run(FirstValueReducer, fields=2)
+        self.assertEqual(out, [(k, (k[1], 0)) for k in self.keys])
+
+    def test_reduce_partial(self):
+        out = self.__run(FirstValueReducer)
+        users = sorted(set(k[0] for k in self.keys))
+        self.assertEqual([k[0] for k, _ in out], users)
+        for k, v in out:
+            self.assertEqual(v, (k[1], 0))
+
+    def test_reduce_batch(self):
+        out = self.__run(BatchReducer)
+        for k, v in out:
+            keys = [_ for _ in self.keys if _[0] == k[0]]
+            self.assertEqual(k, keys[0])
+            self.assertEqual(list(v), self.__expected_values(keys))
+
+
+CASES = [
+    TestGroupKey,
+    TestGroupedReduce,
+]
+
+
+def suite():
+    ret = unittest.TestSuite()
+    test_loader = unittest.TestLoader()
+    for c in CASES:
+        ret.addTest(test_loader.loadTestsFromTestCase(c))
+    return ret
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run((suite()))
@@ -0,0 +1,116 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+import random
+import unittest
+
+import pydoop.mapreduce.intermediate as intermediate
+
+UNI_CHR = u'\N{CYRILLIC CAPITAL LETTER O WITH DIAERESIS}'
+
+
+def _rand_str(chars):
+    return u"".join(random.choice(chars) for _ in range(random.randint(0, 5)))
+
+
+class TestOrderedCodec(unittest.TestCase):
+
+    def setUp(self):
+        self.codec = intermediate.OrderedCodec()
+        random.seed(42)
+
+    def __check(self, objects):
+        encoded = [self.codec.encode(_) for _ in objects]
+        for obj, data in zip(objects, encoded):
+            dec = self.codec.decode(data)
+            self.assertEqual(dec, obj)
+            self.assertIs(type(dec), type(obj))
+        self.assertEqual(
+            [self.codec.decode(_) for _ in sorted(encoded)], sorted(objects)
+        )
+
+    def test_int(self):
+        ints = [0, 1, -1, 255, 256, -256, -257, 2**63 - 1, -2**63, 2**64,
+                -2**64 - 1, 2**1000, -2**1000]
+        ints.extend(random.randint(-2**70, 2**70) for _ in range(500))
+        ints.extend(range(-300, 300))
+        self.__check(ints)
+
+    def test_float(self):
+        floats = [0.0, 1e-300, -1e-300, 1.5, -1.5, float("inf"),
+                  -float("inf")]
+        floats.extend(random.uniform(-1e10, 1e10) for _ in range(500))
+        self.__check(floats)
+        self.assertEqual(self.codec.encode(-0.0), self.codec.encode(0.0))
+
+    def test_str(self):
+        strings = [_rand_str(u"ab\x00" + UNI_CHR) for _ in range(500)]
+        self.__check(strings)
+        self.__check([_.encode("utf-8") for _ in strings])
+
+    def test_tuple(self):
+        strings = [_rand_str(u"ab\x00" + UNI_CHR) for _ in range(10)]
+        tuples = [(), (u"a",), (u"a", 1), (u"a", 1, (b"", 0.5))]
+        tuples.extend((
+            random.choice(strings),
+            random.randint(-5, 5),
+            (random.choice(strings).encode("utf-8"), random.random()),
+        ) for _ in range(500))
+        self.__check(tuples)
+
+    def test_fallback(self):
+        for obj in None, True, {"a": 1}, (u"a", None, [1]), 2**1100:
+            self.assertEqual(self.codec.decode(self.codec.encode(obj)), obj)
+
+    def test_errors(self):
+        for data in (b"", b"\x99", b"\x10", b"\x10\x82\x01", b"\x50\x30ab",
+                     b"\x20\x00", b"\x10\x80\x00"):
+            self.assertRaises(ValueError, self.codec.decode, data)
+
+
+class TestGetCodec(unittest.TestCase):
+
+    def test_get_codec(self):
+        self.assertIsInstance(
+            intermediate.get_codec("pickle"), intermediate.PickleCodec
+        )
+        self.assertIsInstance(
+            intermediate.get_codec("ordered"), intermediate.OrderedCodec
+        )
+        codec = intermediate.PickleCodec()
+        self.assertIs(intermediate.get_codec(codec), codec)
+        for spec in "foo", None, intermediate.PickleCodec:
+            self.assertRaises(ValueError, intermediate.get_codec, spec)
+
+
+CASES = [
+    TestOrderedCodec,
+    TestGetCodec,
+]
+
+
+def suite():
+    ret = unittest.TestSuite()
+    test_loader = unittest.TestLoader()
+    for c in CASES:
+        ret.addTest(test_loader.loadTestsFromTestCase(c))
+    return ret
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run((suite()))
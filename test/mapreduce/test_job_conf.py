@@ -0,0 +1,129 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+import copy
+import pickle
+import unittest
+
+from pydoop.mapreduce.api import JobConf
+
+RAW = {
+    b"a": b"1",
+    b"f": b"2.5",
+    b"t": b" True",
+    b"j": b'{"x": [1, 2]}',
+    u"à".encode("utf-8"): u"è".encode("utf-8"),
+}
+DECODED = dict((k.decode("utf-8"), v.decode("utf-8")) for k, v in RAW.items())
+
+
+class TestJobConf(unittest.TestCase):
+
+    def setUp(self):
+        self.jc = JobConf.fromraw(dict(RAW))
+
+    def test_lazy(self):
+        jc = self.jc
+        self.assertEqual(len(jc), len(RAW))
+        self.assertEqual(dict.__len__(jc), 0)
+        self.assertIn("a", jc)
+        self.assertNotIn("b", jc)
+        self.assertNotIn(1, jc)
+        self.assertEqual(jc["a"], "1")
+        self.assertEqual(jc.get(u"à"), u"è")
+        self.assertIsNone(jc.get("b"))
+        self.assertEqual(jc.get("b", "x"), "x")
+        self.assertRaises(KeyError, jc.__getitem__, "b")
+        self.assertEqual(dict.__len__(jc), 2)
+        self.assertEqual(len(jc), len(RAW))
+
+    def test_dict(self):
+        jc = self.jc
+        self.assertEqual(jc, DECODED)
+        self.assertEqual(dict(jc), DECODED)
+        self.assertEqual(sorted(jc), sorted(DECODED))
+        self.assertEqual(sorted(jc.items()), sorted(DECODED.items()))
+        for other in jc.copy(), copy.copy(jc), pickle.loads(pickle.dumps(jc)):
+            self.assertIs(type(other), JobConf)
+            self.assertEqual(other, DECODED)
+        jc = JobConf.fromraw(dict(RAW))
+        jc["a"] = "3"
+        self.assertEqual(jc["a"], "3")
+        del jc["f"]
+        self.assertNotIn("f", jc)
+        self.assertEqual(len(jc), len(RAW) - 1)
+        self.assertRaises(KeyError, jc.__delitem__, "f")
+        self.assertEqual(jc.pop("t"), " True")
+        jc.update(b="4")
+        self.assertEqual(jc["b"], "4")
+        self.assertEqual(JobConf({"a": "1"}, b="2"), {"a": "1", "b": "2"})
+
+    def test_typed(self):
+        jc = self.jc
+        self.assertEqual(jc.get_int("a"), 1)
+        self.assertEqual(jc.get_float("f"), 2.5)
+        self.assertIs(jc.get_bool("t"), True)
+        self.assertEqual(jc.get_json("j"), {"x": [1, 2]})
+        self.assertIs(jc.get_json("j"), jc.get_json("j"))
+        self.assertIsNone(jc.get_int("b"))
+        self.assertEqual(jc.get_int("b", 7), 7)
+        self.assertEqual(jc.get_json("b", "[]"), [])
+        self.assertRaises(ValueError, jc.get_int, "f")
+        self.assertRaises(RuntimeError, jc.get_bool, "a")
+        self.assertIs(jc.get_bool("a", False), False)
+        # memoized values are dropped on change
+        jc["a"] = "2"
+        self.assertEqual(jc.get_int("a"), 2)
+        jc.update(a="3")
+        self.assertEqual(jc.get_int("a"), 3)
+        del jc["a"]
+        self.assertIsNone(jc.get_int("a"))
+
+    def test_typed_spec(self):
+        params = self.jc.typed({
+            "a": int,
+            "f": (float, 0.0),
+            "t": bool,
+            "j": "json",
+            u"à": str,
+            "b": (int, 42),
+            "c": float,
+        })
+        self.assertEqual(params, {
+            "a": 1, "f": 2.5, "t": True, "j": {"x": [1, 2]}, u"à": u"è",
+            "b": 42, "c": None,
+        })
+        self.assertRaises(ValueError, self.jc.typed, {"a": list})
+        self.assertRaises(ValueError, self.jc.typed, {"a": [int]})
+
+
+CASES = [
+    TestJobConf,
+]
+
+
+def suite():
+    ret = unittest.TestSuite()
+    test_loader = unittest.TestLoader()
+    for c in CASES:
+        ret.addTest(test_loader.loadTestsFromTestCase(c))
+    return ret
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run((suite()))
@@ -0,0 +1,119 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+import unittest
+from sys import getsizeof as sizeof
+
+import pydoop.mapreduce.memory as memory
+
+
+class TestSizeof(unittest.TestCase):
+
+    def test_atomic(self):
+        for obj in b"abc", u"abc", 1, 1.5, None:
+            self.assertEqual(memory.deep_sizeof(obj), sizeof(obj))
+
+    def test_containers(self):
+        values = [b"x" * 100 for _ in range(10)]
+        expected = sizeof(values) + sum(sizeof(_) for _ in values)
+        for t in list, tuple:
+            obj = t(values)
+            self.assertEqual(
+                memory.deep_sizeof(obj),
+                sizeof(obj) + sum(sizeof(_) for _ in values)
+            )
+        self.assertEqual(memory.deep_sizeof(values), expected)
+        d = {i: v for i, v in enumerate(values)}
+        self.assertEqual(
+            memory.deep_sizeof(d),
+            sizeof(d) + sum(sizeof(k) + sizeof(v) for k, v in d.items())
+        )
+        nested = (values, (b"a", 1))
+        self.assertEqual(
+            memory.deep_sizeof(nested),
+            sizeof(nested) + expected + memory.deep_sizeof((b"a", 1))
+        )
+
+    def test_sampling(self):
+        values = [b"x" * 100 for _ in range(1000)]
+        self.assertEqual(
+            memory.deep_sizeof(values, sample_size=10),
+            memory.deep_sizeof(values)
+        )
+
+    def test_cache(self):
+        cache = {}
+        self.assertEqual(memory.cache_sizeof(cache), sizeof(cache))
+        for i in range(1000):
+            cache[b"%04d" % i] = [b"x" * 100] * 5
+        exact = sizeof(cache) + sum(
+            memory.deep_sizeof(k) + memory.deep_sizeof(v)
+            for k, v in cache.items()
+        )
+        self.assertEqual(memory.cache_sizeof(cache, sample_size=10), exact)
+        # sys.getsizeof misses the contents of tuple values
+        cache = {b"k": [(b"x" * 100, i) for i in range(10)]}
+        shallow_size = sum(sizeof(b"k") + sizeof(_) for _ in cache[b"k"])
+        self.assertTrue(memory.cache_sizeof(cache) > 2 * shallow_size)
+
+
+class TestCacheMeter(unittest.TestCase):
+
+    def test_check(self):
+        limit = 1024 * 1024
+        meter = memory.CacheMeter(limit)
+        cache, shallow_size, spilled = {}, 0, False
+        for i in range(100000):
+            k, v = b"%06d" % i, [i]
+            cache[k] = v
+            shallow_size += sizeof(k) + sizeof(v)
+            if shallow_size >= meter.next_check:
+                if meter.check(cache, shallow_size):
+                    spilled = True
+                    break
+        self.assertTrue(spilled)
+        self.assertTrue(memory.cache_sizeof(cache) >= limit)
+        self.assertTrue(memory.cache_sizeof(cache) < 1.5 * limit)
+        meter.reset()
+        self.assertEqual(meter.next_check, meter.MIN_STEP)
+
+    def test_rss(self):
+        if memory.get_rss() is None:
+            return
+        meter = memory.CacheMeter(2**40, rss_limit=1)
+        self.assertTrue(meter.check({}, 0))
+        meter = memory.CacheMeter(2**40, rss_limit=2**40)
+        self.assertFalse(meter.check({}, 0))
+
+
+CASES = [
+    TestSizeof,
+    TestCacheMeter,
+]
+
+
+def suite():
+    ret = unittest.TestSuite()
+    test_loader = unittest.TestLoader()
+    for c in CASES:
+        ret.addTest(test_loader.loadTestsFromTestCase(c))
+    return ret
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run((suite()))
@@ -0,0 +1,156 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+import io
+import os
+import random
+import unittest
+
+from pydoop.mapreduce.api import JobConf
+from pydoop.mapreduce.intermediate import OrderedCodec
+import pydoop.mapreduce.partitioners as partitioners
+import pydoop.mapreduce.sampler as sampler
+from pydoop.test_utils import WDTestCase
+
+
+class Context(object):
+
+    def __init__(self, job_conf, nred):
+        self.job_conf = JobConf(job_conf)
+        self.nred = nred
+
+
+class TestPartitionFile(unittest.TestCase):
+
+    def test_roundtrip(self):
+        for points in [], [b""], [b"a", b"b\x00\xff", b"c" * 1000]:
+            f = io.BytesIO()
+            partitioners.write_partition_file(points, f)
+            f.seek(0)
+            self.assertEqual(partitioners.read_partition_file(f), points)
+
+    def test_truncated(self):
+        f = io.BytesIO()
+        partitioners.write_partition_file([b"abc"], f)
+        f = io.BytesIO(f.getvalue()[:-1])
+        self.assertRaises(RuntimeError, partitioners.read_partition_file, f)
+
+
+class TestPickSplitPoints(unittest.TestCase):
+
+    def test_even(self):
+        samples = [b"%03d" % i for i in range(100)]
+        random.shuffle(samples)
+        points = sampler.pick_split_points(samples, 4)
+        self.assertEqual(points, [b"025", b"050", b"075"])
+        self.assertEqual(sampler.pick_split_points(samples, 1), [])
+        self.assertEqual(sampler.pick_split_points([], 4), [])
+
+    def test_duplicates(self):
+        samples = [b"a"] * 90 + [b"b"] * 5 + [b"c"] * 5
+        points = sampler.pick_split_points(samples, 4)
+        self.assertEqual(points, [b"a", b"b", b"c"])
+        self.assertEqual(sampler.pick_split_points([b"x"] * 10, 3), [b"x"])
+
+
+class TestReadSplit(WDTestCase):
+
+    def test_splits(self):
+        lines = [(b"line %d" % i) * random.randint(0, 5) for i in range(100)]
+        data = b"\n".join(lines) + b"\n"
+        fn = os.path.join(self.wd, "f")
+        with io.open(fn, "wb") as f:
+            f.write(data)
+        for size in 1, 7, 64, len(data), 2 * len(data):
+            records = []
+            with io.open(fn, "rb") as f:
+                for off in range(0, len(data), size):
+                    length = min(size, len(data) - off)
+                    records.extend(sampler.read_split(f, off, length))
+            self.assertEqual(records, lines)
+        with io.open(fn, "rb") as f:
+            self.assertEqual(
+                list(sampler.read_split(f, 0, len(data), max_records=3)),
+                lines[:3]
+            )
+
+    def test_crlf(self):
+        f = io.BytesIO(b"a\r\nb\nc")
+        self.assertEqual(list(sampler.read_split(f, 0, 7)), [b"a", b"b", b"c"])
+
+
+# the following ones need HDFS (pydoop.hdfs is used for local files as well)
+class TestTotalOrder(WDTestCase):
+
+    def setUp(self):
+        super(TestTotalOrder, self).setUp()
+        self.words = ["%05d" % random.randint(0, 99999) for _ in range(5000)]
+        self.input_dir = os.path.join(self.wd, "input")
+        os.mkdir(self.input_dir)
+        for i in range(4):
+            fn = os.path.join(self.input_dir, "part-%d" % i)
+            with io.open(fn, "wb") as f:
+                for w in self.words[i::4]:
+                    f.write(w.encode("ascii") + b"\n")
+        with io.open(os.path.join(self.input_dir, "_SUCCESS"), "wb") as f:
+            f.write(b"ignore me\n")
+        self.path = "file://%s" % os.path.join(self.wd, "_partition.lst")
+
+    def test_get_splits(self):
+        splits = sampler.get_splits(
+            ["file://%s" % self.input_dir], split_size=1000
+        )
+        self.assertEqual(len(set(_[0] for _ in splits)), 4)
+        self.assertEqual(sum(_[2] for _ in splits), 6 * len(self.words))
+
+    def test_partition(self):
+        nred = 4
+        points = sampler.create_partition_file(
+            ["file://%s" % self.input_dir], self.path, nred, fraction=0.5,
+            split_size=1000, seed=1
+        )
+        self.assertEqual(len(points), nred - 1)
+        ctx = Context({partitioners.PARTITION_FILE_KEY: self.path}, nred)
+        p = partitioners.TotalOrderPartitioner(ctx)
+        self.assertEqual(p.split_points, points)
+        encode = OrderedCodec().encode
+        parts = [p.partition(encode(w), nred) for w in sorted(self.words)]
+        self.assertEqual(parts, sorted(parts))
+        for i in range(nred):
+            # sampled, so not exactly balanced
+            self.assertTrue(parts.count(i) > len(self.words) / (2 * nred))
+
+
+CASES = [
+    TestPartitionFile,
+    TestPickSplitPoints,
+    TestReadSplit,
+    TestTotalOrder,
+]
+
+
+def suite():
+    ret = unittest.TestSuite()
+    test_loader = unittest.TestLoader()
+    for c in CASES:
+        ret.addTest(test_loader.loadTestsFromTestCase(c))
+    return ret
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run((suite()))
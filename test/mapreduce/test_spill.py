@@ -0,0 +1,92 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+import os
+import random
+import unittest
+
+import pydoop.mapreduce.spill as spill
+from pydoop.test_utils import WDTestCase
+
+
+class TestRunStore(WDTestCase):
+
+    def setUp(self):
+        super(TestRunStore, self).setUp()
+        random.seed(42)
+        self.store = spill.RunStore(dir=self.wd)
+
+    def tearDown(self):
+        self.store.close()
+        super(TestRunStore, self).tearDown()
+
+    def test_merge(self):
+        runs = []
+        for i in range(5):
+            keys = sorted(random.sample(range(3000), 1000))
+            runs.append([(k, {"run": i}) for k in keys])
+        for r in runs[:-1]:
+            self.store.write(r)
+        self.assertEqual(len(self.store.paths), 4)
+        expected = {}
+        for r in runs:
+            for k, v in r:
+                expected.setdefault(k, []).append(v)
+        merged = [(k, list(values)) for k, values in
+                  self.store.merge(runs[-1])]
+        self.assertEqual([k for k, _ in merged], sorted(expected))
+        self.assertEqual(dict(merged), expected)
+
+    def test_partial(self):
+        self.store.write([(b"a", 1), (b"a", 2), (b"b", 3)])
+        self.store.write([(b"a", 4), (b"c", 5)])
+        self.assertEqual(
+            [(k, next(values)) for k, values in self.store.merge()],
+            [(b"a", 1), (b"b", 3), (b"c", 5)]
+        )
+
+    def test_empty(self):
+        self.assertEqual(list(self.store.merge()), [])
+        self.store.write([])
+        self.assertEqual(
+            [(k, list(v)) for k, v in self.store.merge([(1, 2)])], [(1, [2])]
+        )
+
+    def test_close(self):
+        self.store.write([(1, 2)])
+        self.assertTrue(os.path.isdir(self.store.dir))
+        self.store.close()
+        self.assertFalse(os.path.exists(self.store.dir))
+        self.assertEqual(self.store.paths, [])
+
+
+CASES = [
+    TestRunStore,
+]
+
+
+def suite():
+    ret = unittest.TestSuite()
+    test_loader = unittest.TestLoader()
+    for c in CASES:
+        ret.addTest(test_loader.loadTestsFromTestCase(c))
+    return ret
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run((suite()))
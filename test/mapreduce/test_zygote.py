@@ -0,0 +1,223 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+import io
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+import pydoop
+import pydoop.mapreduce.binary_protocol as bp
+import pydoop.mapreduce.zygote as zygote
+import pydoop.sercore as sercore
+from pydoop.test_utils import WDTestCase
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+M_NAME = "m_task.cmd"
+MODULE = "zygote_job"
+MODULE_CODE = """\
+import os
+import sys
+
+import pydoop.mapreduce.api as api
+import pydoop.mapreduce.pipes as pipes
+
+with open(os.environ["IMPORT_LOG"], "a") as f:
+    f.write("%d\\n" % os.getpid())
+
+
+class Mapper(api.Mapper):
+
+    def map(self, context):
+        context.emit(context.key, context.value)
+
+
+def main():
+    sys.stdout.write("%d %s\\n" % (os.getpid(), os.getcwd()))
+    sys.stderr.write(os.getenv("TASK_MSG", ""))
+    if os.getenv("mapreduce.pipes.command.socket"):
+        pipes.run_task(pipes.Factory(Mapper), private_encoding=False)
+    sys.exit(int(os.getenv("TASK_EXIT", "0")))
+"""
+
+
+@unittest.skipUnless(zygote.supported(), "warm workers not supported")
+class TestZygote(WDTestCase):
+
+    def setUp(self):
+        super(TestZygote, self).setUp()
+        self.import_log = os.path.join(self.wd, "imports")
+        self.env = os.environ.copy()
+        self.env.update({
+            zygote.ZYGOTE_DIR_ENV: os.path.join(self.wd, "zygote"),
+            "IMPORT_LOG": self.import_log,
+        })
+        for k in ("mapreduce.pipes.command.port",
+                  "mapreduce.pipes.command.socket",
+                  "mapreduce.pipes.commandfile"):
+            self.env.pop(k, None)
+        self.key = "test-%d" % os.getpid()
+        self.ntasks = 0
+
+    def tearDown(self):
+        lock_path = "%s.lock" % self.__socket_path()
+        if os.path.exists(lock_path):
+            with io.open(lock_path, "rt") as f:
+                pid = f.read().strip()
+            if pid:
+                os.kill(int(pid), signal.SIGTERM)
+        super(TestZygote, self).tearDown()
+
+    def __socket_path(self):
+        old_env = os.environ.copy()
+        os.environ[zygote.ZYGOTE_DIR_ENV] = self.env[zygote.ZYGOTE_DIR_ENV]
+        try:
+            return zygote.socket_path("%s:%s:main" % (self.key, MODULE))
+        finally:
+            os.environ.clear()
+            os.environ.update(old_env)
+
+    def __run_task(self, **env):
+        # each task runs in its own dir, with the module in it
+        self.ntasks += 1
+        task_dir = os.path.join(self.wd, "task_%d" % self.ntasks)
+        os.mkdir(task_dir)
+        with io.open(os.path.join(task_dir, "%s.py" % MODULE), "wt") as f:
+            f.write(MODULE_CODE)
+        task_env = self.env.copy()
+        task_env.update(env)
+        task_env["PYTHONPATH"] = os.pathsep.join([
+            task_dir, os.path.dirname(os.path.dirname(pydoop.__file__))
+        ])
+        code = "import pydoop.mapreduce.zygote as z; z.run(%r, 'main', %r)"
+        p = subprocess.Popen(
+            [sys.executable, "-c", code % (MODULE, self.key)],
+            cwd=task_dir, env=task_env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        out, err = p.communicate()
+        pid, cwd = out.decode("utf-8").split()
+        return p.returncode, int(pid), cwd, err.decode("utf-8"), task_dir
+
+    def __import_pids(self):
+        with io.open(self.import_log, "rt") as f:
+            return [int(_) for _ in f.read().split()]
+
+    def __start_zygote(self):
+        code, pid, _, _, _ = self.__run_task()
+        self.assertEqual(code, 0)
+        self.assertEqual(self.__import_pids(), [pid])  # ran directly
+        path = self.__socket_path()
+        for _ in range(200):
+            if os.path.exists(path):
+                break
+            time.sleep(0.05)
+        else:
+            self.fail("zygote not started")
+
+    def test_run(self):
+        self.__start_zygote()
+        pids = set()
+        for _ in range(3):
+            code, pid, cwd, err, task_dir = self.__run_task(TASK_MSG="foo")
+            self.assertEqual(code, 0)
+            self.assertEqual(os.path.realpath(cwd), os.path.realpath(task_dir))
+            self.assertEqual(err, "foo")
+            pids.add(pid)
+        import_pids = self.__import_pids()
+        self.assertEqual(len(import_pids), 2)  # first task + zygote
+        self.assertEqual(len(pids), 3)
+        self.assertFalse(pids & set(import_pids))
+
+    def test_exit_code(self):
+        self.__start_zygote()
+        code, _, _, _, _ = self.__run_task(TASK_EXIT="3")
+        self.assertEqual(code, 3)
+        self.assertEqual(len(self.__import_pids()), 2)
+
+    def test_pipes_socket(self):
+        self.__start_zygote()
+        with io.open(os.path.join(THIS_DIR, M_NAME), "rb") as f:
+            cmds = f.read()
+        path = os.path.join(self.wd, "pipes.sock")
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(1)
+        received = []
+
+        def serve():
+            conn, _ = server.accept()
+            conn.sendall(cmds)
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    break
+                received.append(chunk)
+            conn.close()
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        try:
+            code, _, _, err, _ = self.__run_task(**{
+                "mapreduce.pipes.command.socket": path
+            })
+        finally:
+            thread.join()
+            server.close()
+        self.assertEqual(code, 0, err)
+        self.assertEqual(len(self.__import_pids()), 2)
+        out_cmd_path = os.path.join(self.wd, "out.cmd")
+        with io.open(out_cmd_path, "wb") as f:
+            f.write(b"".join(received))
+        n_outputs = 0
+        with sercore.FileInStream(out_cmd_path) as stream:
+            while True:
+                try:
+                    cmd = stream.read_vint()
+                except IOError:
+                    break
+                if cmd == bp.OUTPUT:
+                    stream.read_tuple("bb")
+                    n_outputs += 1
+                elif cmd == bp.PROGRESS:
+                    stream.read_float()
+                else:
+                    self.assertEqual(cmd, bp.DONE)
+        self.assertTrue(n_outputs)
+
+
+CASES = [
+    TestZygote,
+]
+
+
+def suite():
+    ret = unittest.TestSuite()
+    test_loader = unittest.TestLoader()
+    for c in CASES:
+        ret.addTest(test_loader.loadTestsFromTestCase(c))
+    return ret
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run((suite()))
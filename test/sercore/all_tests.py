@@ -22,6 +22,7 @@ from pydoop.test_utils import get_module
 
 TEST_MODULE_NAMES = [
     'test_deser',
+    'test_partition',
     'test_streams',
 ]
 
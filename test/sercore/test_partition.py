@@ -0,0 +1,193 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright 2009-2019 CRS4.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# END_COPYRIGHT
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from pydoop.mapreduce.binary_protocol import PARTITIONED_OUTPUT
+from pydoop.mapreduce.intermediate import OrderedCodec
+import pydoop.sercore as sercore
+
+
+def java_hash(data, seed=1):
+    # WritableComparator.hashBytes (seed=1)
+    h = seed
+    for b in bytearray(data):
+        h = (31 * h + (b - 256 if b > 127 else b)) & 0xffffffff
+    return h & 0x7fffffff
+
+
+class TestPartitioner(unittest.TestCase):
+
+    def setUp(self):
+        self.encode = OrderedCodec().encode
+
+    def test_hash(self):
+        # "hello".hashCode() + 31 ** 5
+        self.assertEqual(java_hash(b"hello"), 127791473)
+        p = sercore.Partitioner()
+        keys = [b"", b"hello", u"à".encode("utf-8")]
+        keys.extend(os.urandom(random.randint(1, 100)) for _ in range(100))
+        for n in 1, 3, 10:
+            for k in keys:
+                self.assertEqual(p.partition(k, n), java_hash(k) % n)
+        self.assertEqual(p.partition(bytearray(b"hello"), 7), 127791473 % 7)
+
+    def test_fields(self):
+        p = sercore.Partitioner("fields", 0, 2)
+        keys = [("a", i, j) for i in range(5) for j in range(5)]
+        parts = {}
+        for k in keys:
+            parts.setdefault(k[:2], set()).add(
+                p.partition(self.encode(k), 1000)
+            )
+        self.assertTrue(all(len(_) == 1 for _ in parts.values()))
+        self.assertTrue(len(set.union(*parts.values())) > 1)
+        # non-tuple keys have a single field, items can be anything
+        key = self.encode((b"\x00x", 1.5, (2, u"y"), {"z": 3}))
+        for start, stop in (0, 1), (1, 3), (3, 4), (4, 5), (0, 1000):
+            p = sercore.Partitioner("fields", start, stop)
+            self.assertTrue(0 <= p.partition(key, 10) < 10)
+        p = sercore.Partitioner("fields", 0, 1)
+        key = self.encode("foo")
+        self.assertEqual(p.partition(key, 1000), java_hash(key) % 1000)
+        self.assertRaises(ValueError, p.partition, b"\x50\x30foo", 10)
+
+    def test_text_fields(self):
+        # same as KeyFieldBasedPartitioner with -k2,3
+        p = sercore.Partitioner("fields", 1, 3, separator="::")
+        for k, span in [
+                (b"a::bb::c::d", b"bb::c"),
+                (b"a::bb", b"bb"),
+                (b"a", b""),
+                (b"a::::c", b"::c"),
+        ]:
+            self.assertEqual(p.partition(k, 1000), java_hash(span, 0) % 1000)
+
+    def test_range(self):
+        splits = [-10, 0, 2.5, 100]
+        cases = [
+            (-2**70, 0), (-11, 0), (-10, 1), (-1, 1), (0, 2), (2, 2),
+            (2.5, 3), (99.9, 3), (100, 4), (2**70, 4), (float("inf"), 4),
+        ]
+        p = sercore.Partitioner("range", 1, splits=splits)
+        t = sercore.Partitioner("range", 1, separator="\t", splits=splits)
+        for v, part in cases:
+            self.assertEqual(p.partition(self.encode(("k", v)), 5), part)
+            self.assertEqual(
+                p.partition(self.encode(("k", v)), 3), min(part, 2)
+            )
+            key = ("k\t%r\tz" % (v,)).encode("ascii")
+            self.assertEqual(t.partition(key, 5), part)
+        p = sercore.Partitioner("range", splits=[0])
+        self.assertEqual(p.partition(self.encode(1), 2), 1)
+        self.assertRaises(ValueError, p.partition, self.encode("x"), 2)
+        self.assertRaises(ValueError, t.partition, b"k\tx", 2)
+        self.assertRaises(ValueError, t.partition, b"k", 2)
+
+    def test_order(self):
+        splits = [b"b", b"d", b"d\x00", b"f"]
+        p = sercore.Partitioner("order", splits=splits)
+        for k, part in [
+                (b"", 0), (b"a", 0), (b"b", 1), (b"c", 1), (b"d", 2),
+                (b"d\x00", 3), (b"d\x01", 3), (b"f", 4), (b"\xff", 4),
+        ]:
+            self.assertEqual(p.partition(k, 5), part)
+            self.assertEqual(p.partition(k, 2), min(part, 1))
+        self.assertEqual(sercore.Partitioner("order").partition(b"x", 3), 0)
+        # same order as the encoded keys
+        keys = sorted(random.randint(-1000, 1000) for _ in range(100))
+        p = sercore.Partitioner(
+            "order", splits=[self.encode(_) for _ in (-500, 0, 500)]
+        )
+        parts = [p.partition(self.encode(k), 4) for k in keys]
+        self.assertEqual(parts, sorted(parts))
+        self.assertEqual(set(parts), set(range(4)))
+
+    def test_errors(self):
+        self.assertRaises(ValueError, sercore.Partitioner, "foo")
+        self.assertRaises(ValueError, sercore.Partitioner, "fields", -1)
+        self.assertRaises(ValueError, sercore.Partitioner, "fields", 2, 1)
+        self.assertRaises(ValueError, sercore.Partitioner, separator="")
+        self.assertRaises(
+            ValueError, sercore.Partitioner, "range", splits=[1, 0]
+        )
+        self.assertRaises(TypeError, sercore.Partitioner, "range", splits=1)
+        self.assertRaises(
+            ValueError, sercore.Partitioner, "order", splits=[b"b", b"a"]
+        )
+        self.assertRaises(
+            TypeError, sercore.Partitioner, "order", splits=[u"a"]
+        )
+        p = sercore.Partitioner()
+        self.assertRaises(ValueError, p.partition, b"k", 0)
+        self.assertRaises(TypeError, p.partition, u"k", 1)
+
+
+class TestWriteOutputs(unittest.TestCase):
+
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix="pydoop_")
+        self.fname = os.path.join(self.wd, "foo")
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def test_partitioner(self):
+        p = sercore.Partitioner()
+        keys = [b"k%d" % i for i in range(100)]
+        values = [b"v%d" % i for i in range(100)]
+        with sercore.FileOutStream(self.fname) as s:
+            s.write_outputs(keys, values, p, 7)
+        with sercore.FileInStream(self.fname) as s:
+            for k, v in zip(keys, values):
+                self.assertEqual(s.read_vint(), PARTITIONED_OUTPUT)
+                self.assertEqual(s.read_vint(), java_hash(k) % 7)
+                self.assertEqual(s.read_bytes(), k)
+                self.assertEqual(s.read_bytes(), v)
+            self.assertRaises(IOError, s.read_vint)
+
+    def test_errors(self):
+        p = sercore.Partitioner("range")
+        with sercore.FileOutStream(self.fname) as s:
+            self.assertRaises(ValueError, s.write_outputs, [b"k"], [b"v"], p)
+            self.assertRaises(
+                ValueError, s.write_outputs, [b"k"], [b"v"], p, 2
+            )
+        self.assertEqual(os.stat(self.fname).st_size, 0)
+
+
+CASES = [
+    TestPartitioner,
+    TestWriteOutputs,
+]
+
+
+def suite():
+    ret = unittest.TestSuite()
+    test_loader = unittest.TestLoader()
+    for c in CASES:
+        ret.addTest(test_loader.loadTestsFromTestCase(c))
+    return ret
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run((suite()))
@@ -16,16 +16,20 @@
 #
 # END_COPYRIGHT
 
+import ctypes
 import io
 import os
 import shutil
 import struct
 import tempfile
+import threading
 import unittest
 import uuid
 from random import randint
 
-from pydoop.mapreduce.binary_protocol import OUTPUT, PARTITIONED_OUTPUT
+from pydoop.mapreduce.binary_protocol import (
+    MAP_ITEM, REDUCE_KEY, REDUCE_VALUE, CLOSE, OUTPUT, PARTITIONED_OUTPUT
+)
 import pydoop.sercore as sercore
 
 INT64_MIN = -2**63
@@ -175,6 +179,39 @@ class TestSerDe(unittest.TestCase):
             self.assertEqual(s.read_bytes(), k)
             self.assertEqual(s.read_bytes(), v)
 
+    def test_outputs(self):
+        keys = [b"k%d" % i for i in range(10)]
+        values = [bytearray(b"v%d" % i) for i in range(10)]
+        values[-1] = memoryview(b"\x00")
+        with sercore.FileOutStream(self.fname) as s:
+            s.write_outputs(keys, values)
+            s.write_outputs([], [])
+            s.write_outputs(tuple(keys), values, range(10))
+        with sercore.FileInStream(self.fname) as s:
+            for k, v in zip(keys, values):
+                self.assertEqual(s.read_vint(), OUTPUT)
+                self.assertEqual(s.read_bytes(), k)
+                self.assertEqual(s.read_bytes(), bytes(v))
+            for i, (k, v) in enumerate(zip(keys, values)):
+                self.assertEqual(s.read_vint(), PARTITIONED_OUTPUT)
+                self.assertEqual(s.read_vint(), i)
+                self.assertEqual(s.read_bytes(), k)
+                self.assertEqual(s.read_bytes(), bytes(v))
+            self.assertRaises(IOError, s.read_vint)
+
+    def test_outputs_errors(self):
+        with sercore.FileOutStream(self.fname) as s:
+            self.assertRaises(ValueError, s.write_outputs, [b"k"], [])
+            self.assertRaises(
+                ValueError, s.write_outputs, [b"k"], [b"v"], [0, 1]
+            )
+            self.assertRaises(
+                ValueError, s.write_outputs, [b"k"], [b"v"], [-1]
+            )
+            self.assertRaises(TypeError, s.write_outputs, [b"k"], [u"v"])
+            self.assertRaises(TypeError, s.write_outputs, [b"k"], None)
+        self.assertEqual(os.stat(self.fname).st_size, 0)
+
     def test_multi_no_tuple(self):
         self.__fill_stream_multi()
         self.__check_stream_multi()
@@ -340,12 +377,382 @@ class TestHadoopTypes(unittest.TestCase):
             self.assertEqual(stream.read_long_writable(), k)
 
 
+class Context(object):
+    pass
+
+
+class _PyBuffer(ctypes.Structure):
+    _fields_ = [
+        ("buf", ctypes.c_void_p),
+        ("obj", ctypes.c_void_p),
+        ("len", ctypes.c_ssize_t),
+        ("itemsize", ctypes.c_ssize_t),
+        ("readonly", ctypes.c_int),
+        ("ndim", ctypes.c_int),
+        ("format", ctypes.c_char_p),
+        ("shape", ctypes.c_void_p),
+        ("strides", ctypes.c_void_p),
+        ("suboffsets", ctypes.c_void_p),
+        ("internal", ctypes.c_void_p),
+    ]
+
+
+def _address(obj):
+    """\
+    Get the memory address of a (possibly read-only) buffer.
+    """
+    b = _PyBuffer()
+    ctypes.pythonapi.PyObject_GetBuffer(
+        ctypes.py_object(obj), ctypes.byref(b), 0
+    )
+    try:
+        return b.buf
+    finally:
+        ctypes.pythonapi.PyBuffer_Release(ctypes.byref(b))
+
+
+class TestMapItems(unittest.TestCase):
+
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix="pydoop_")
+        self.fname = os.path.join(self.wd, "foo")
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def __write_items(self, items):
+        with sercore.FileOutStream(self.fname) as s:
+            for k, v in items:
+                s.write_tuple("ibb", (MAP_ITEM, k, v))
+            s.write_vint(CLOSE)
+
+    def test_raw(self):
+        items = [(b"k%d" % i, b"v\x00%d" % i) for i in range(10)]
+        self.__write_items(items)
+        with sercore.FileInStream(self.fname) as s:
+            self.assertEqual(s.read_map_items(100), items)
+            self.assertEqual(s.read_map_items(100), [])
+            self.assertEqual(s.read_vint(), CLOSE)
+
+    def test_max_n(self):
+        items = [(b"k%d" % i, b"v%d" % i) for i in range(10)]
+        self.__write_items(items)
+        with sercore.FileInStream(self.fname) as s:
+            self.assertEqual(s.read_map_items(3), items[:3])
+            self.assertEqual(s.read_map_items(3, "bb", 1), items[3:4])
+            self.assertEqual(s.read_map_items(100), items[4:])
+            self.assertEqual(s.read_vint(), CLOSE)
+
+    def test_writables(self):
+        def text(s):
+            b = s.encode("utf-8")
+            return vint(len(b)) + b
+
+        def vint(n):  # WritableUtils.writeVLong, for small n only
+            assert -112 <= n <= 127
+            return struct.pack(">b", n)
+
+        def array(items):
+            return struct.pack(">i", len(items)) + b"".join(items)
+
+        cases = [
+            ("i", struct.pack(">i", -3), -3),
+            ("q", struct.pack(">q", INT64_MAX), INT64_MAX),
+            ("v", b"\x05", 5),
+            ("v", b"\x8e\x01\x00", 256),
+            ("v", b"\x86\x00\xff", -256),
+            ("f", struct.pack(">f", 1.5), 1.5),
+            ("d", struct.pack(">d", -0.1), -0.1),
+            ("o", b"\x01", True),
+            ("o", b"\x00", False),
+            ("n", b"", None),
+            ("I", array([struct.pack(">i", _) for _ in (1, 2)]), [1, 2]),
+            ("Q", array([struct.pack(">q", -1)]), [-1]),
+            ("V", array([vint(1), b"\x86\x01\x00"]), [1, -257]),
+            ("F", array([]), []),
+            ("D", array([struct.pack(">d", 2.5)]), [2.5]),
+            ("O", array([b"\x01", b"\x00"]), [True, False]),
+            ("S", array([text(u"a"), text(UNI_CHR)]), [u"a", UNI_CHR]),
+        ]
+        self.__write_items((b"k", raw) for _, raw, _ in cases)
+        with sercore.FileInStream(self.fname) as s:
+            for code, _, exp in cases:
+                [(k, v)] = s.read_map_items(1, "b" + code)
+                self.assertEqual(k, b"k")
+                self.assertEqual(v, exp)
+                self.assertIs(type(v), type(exp))
+            self.assertEqual(s.read_vint(), CLOSE)
+
+    def test_writable_errors(self):
+        cases = [
+            ("i", b"\x00\x00\x01"),
+            ("i", b"\x00\x00\x00\x00\x00"),
+            ("d", b"\x00"),
+            ("n", b"\x00"),
+            ("v", b"\x8e\x01"),
+            ("I", struct.pack(">i", 2) + struct.pack(">i", 1)),
+            ("I", struct.pack(">i", -1)),
+            ("S", struct.pack(">i", 1) + b"\x05ab"),
+        ]
+        self.__write_items((b"k", raw) for _, raw in cases)
+        with sercore.FileInStream(self.fname) as s:
+            for code, _ in cases:
+                self.assertRaises(ValueError, s.read_map_items, 1, "b" + code)
+            self.assertEqual(s.read_vint(), CLOSE)
+
+    def test_pending(self):
+        items = [(b"k%d" % i, b"v%d" % i) for i in range(5)]
+        self.__write_items(items)
+        with sercore.FileInStream(self.fname) as s:
+            self.assertEqual(s.read_vint(), MAP_ITEM)
+            self.assertEqual(s.read_map_items(2, "bb", 0, True), items[:2])
+            self.assertEqual(s.read_map_items(2, "bb", 0, False), items[2:4])
+            self.assertEqual(s.read_map_items(2), items[4:])
+            self.assertEqual(s.read_vint(), CLOSE)
+
+    def test_typed(self):
+        data = [(i, u"v%d%s" % (i, UNI_CHR)) for i in (INT64_MIN, -1, 0, 1)]
+        self.__write_items(
+            (struct.pack(">q", k), v.encode("utf-8")) for k, v in data
+        )
+        with sercore.FileInStream(self.fname) as s:
+            self.assertEqual(s.read_map_items(100, "qs"), data)
+            self.assertEqual(s.read_vint(), CLOSE)
+
+    def test_run(self):
+        items = [(b"k%d" % i, b"v%d" % i) for i in range(3000)]
+        self.__write_items(items)
+        context, seen = Context(), []
+        with sercore.FileInStream(self.fname) as s:
+            self.assertEqual(s.read_vint(), MAP_ITEM)
+            n = s.run_map_items(
+                context, lambda c: seen.append((c._key, c._value))
+            )
+            self.assertEqual(s.read_vint(), CLOSE)
+        self.assertEqual(n, len(items))
+        self.assertEqual(seen, items)
+        del seen[:]
+        with sercore.FileInStream(self.fname) as s:
+            self.assertEqual(s.read_vint(), MAP_ITEM)
+            s.run_map_items(
+                context, lambda c: seen.append((c._key, c._value)), "bs",
+                len, lambda v: v.upper()
+            )
+        exp = [(len(k), v.decode("utf-8").upper()) for k, v in items]
+        self.assertEqual(seen, exp)
+
+    def test_run_errors(self):
+        self.__write_items([(b"k", b"v")])
+
+        def map_func(context):
+            raise RuntimeError("foo")
+
+        with sercore.FileInStream(self.fname) as s:
+            s.read_vint()
+            self.assertRaises(AttributeError, s.run_map_items, object(), len)
+        with sercore.FileInStream(self.fname) as s:
+            s.read_vint()
+            self.assertRaises(RuntimeError, s.run_map_items, self, map_func)
+
+    def test_zero_copy(self):
+        items = [(b"k%d" % i, b"v\x00" * i) for i in range(100)]
+        self.__write_items(items)
+        with sercore.FileInStream(self.fname) as s:
+            views = s.read_map_items(len(items), "mb")
+        self.assertEqual(len(views), len(items))
+        for (k, v), (view, v2) in zip(items, views):
+            self.assertTrue(isinstance(view, memoryview))
+            self.assertTrue(view.readonly)
+            self.assertEqual(view.tobytes(), k)
+            self.assertEqual(v2, v)
+        context, seen = Context(), []
+        with sercore.FileInStream(self.fname) as s:
+            self.assertEqual(s.read_vint(), MAP_ITEM)
+            s.run_map_items(context, lambda c: seen.append(
+                (bytes(c._key), bytes(c._value))
+            ), "mm")
+        self.assertEqual(seen, items)
+
+    def test_zero_copy_recycle(self):
+        # values large enough to fill several arena blocks
+        v = b"x" * (1024 * 1024)
+        items = [(b"k%d" % i, v) for i in range(20)]
+        self.__write_items(items)
+        addresses, kept = set(), []
+
+        def map_func(context):
+            addresses.add(_address(context._value))
+            if len(kept) < 3:
+                kept.append(context._value)
+
+        context = Context()
+        with sercore.FileInStream(self.fname) as s:
+            self.assertEqual(s.read_vint(), MAP_ITEM)
+            s.run_map_items(context, map_func, "bm")
+        # released blocks are reused: far fewer distinct addresses than items
+        self.assertTrue(len(addresses) < len(items))
+        # held views are never overwritten
+        for view in kept:
+            self.assertEqual(view.tobytes(), v)
+
+    def test_errors(self):
+        self.__write_items([(b"short", b"v")])
+        with sercore.FileInStream(self.fname) as s:
+            for fmt in "b", "bbb", "bx":
+                self.assertRaises(ValueError, s.read_map_items, 1, fmt)
+            self.assertRaises(ValueError, s.read_map_items, 1, "qb")
+        with sercore.FileInStream(self.fname) as s:
+            s.close()
+            self.assertRaises(ValueError, s.read_map_items, 1)
+
+
+class TestReduceValues(unittest.TestCase):
+
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix="pydoop_")
+        self.fname = os.path.join(self.wd, "foo")
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def __write_groups(self, groups):
+        with sercore.FileOutStream(self.fname) as s:
+            for k, values in groups:
+                s.write_tuple("ib", (REDUCE_KEY, k))
+                for v in values:
+                    s.write_tuple("ib", (REDUCE_VALUE, v))
+            s.write_vint(CLOSE)
+
+    def __check_key(self, s, k):
+        self.assertEqual(s.read_vint(), REDUCE_KEY)
+        self.assertEqual(s.read_bytes(), k)
+
+    def test_iter(self):
+        groups = [
+            (b"k0", [b"v%d" % i for i in range(3000)]),
+            (b"k1", [b"x"]),
+        ]
+        self.__write_groups(groups)
+        with sercore.FileInStream(self.fname) as s:
+            for k, values in groups:
+                self.__check_key(s, k)
+                vit = s.reduce_values()
+                self.assertEqual(list(vit), values)
+                self.assertEqual(list(vit), [])
+            self.assertEqual(s.read_vint(), CLOSE)
+
+    def test_typed(self):
+        values = [u"v%d%s" % (i, UNI_CHR) for i in range(5)]
+        self.__write_groups([(b"k", [_.encode("utf-8") for _ in values])])
+        with sercore.FileInStream(self.fname) as s:
+            self.__check_key(s, b"k")
+            self.assertEqual(list(s.reduce_values("s")), values)
+            self.assertEqual(s.read_vint(), CLOSE)
+
+    def test_deser(self):
+        values = [b"%d" % i for i in range(5)]
+        self.__write_groups([(b"k", values)])
+        with sercore.FileInStream(self.fname) as s:
+            self.__check_key(s, b"k")
+            self.assertEqual(list(s.reduce_values("b", int)), list(range(5)))
+            self.assertEqual(s.read_vint(), CLOSE)
+
+    def test_skip(self):
+        groups = [
+            (b"k0", [b"v%d" % i for i in range(2000)]),
+            (b"k1", [b"w%d" % i for i in range(10)]),
+        ]
+        self.__write_groups(groups)
+        with sercore.FileInStream(self.fname) as s:
+            self.__check_key(s, b"k0")
+            vit = s.reduce_values()
+            self.assertEqual(next(vit), b"v0")
+            self.assertEqual(vit.skip(), 1999)
+            self.assertEqual(vit.skip(), 0)
+            self.__check_key(s, b"k1")
+            self.assertEqual(s.reduce_values().skip(), 10)
+            self.assertEqual(s.read_vint(), CLOSE)
+
+    def test_pending(self):
+        self.__write_groups([(b"k", [b"v0", b"v1"])])
+        with sercore.FileInStream(self.fname) as s:
+            self.__check_key(s, b"k")
+            self.assertEqual(s.read_vint(), REDUCE_VALUE)
+            self.assertEqual(
+                list(s.reduce_values("b", None, True)), [b"v0", b"v1"]
+            )
+            self.assertEqual(s.read_vint(), CLOSE)
+
+    def test_errors(self):
+        self.__write_groups([(b"k", [b"v0", b"v1"])])
+        with sercore.FileInStream(self.fname) as s:
+            self.__check_key(s, b"k")
+            self.assertRaises(ValueError, s.reduce_values, "bb")
+            self.assertRaises(ValueError, s.reduce_values, "x")
+            self.assertRaises(ValueError, list, s.reduce_values("q"))
+            vit = s.reduce_values()
+        self.assertRaises(ValueError, next, vit)
+
+
+class TestShmRing(unittest.TestCase):
+
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix="pydoop_")
+        self.fname = os.path.join(self.wd, "ring")
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def test_stream(self):
+        # small capacity, to exercise wrap-around and waits on both sides
+        w = sercore.ShmRing(self.fname, "w", 100)
+        r = sercore.ShmRing(self.fname)
+        self.assertEqual(w.capacity, 100)
+        self.assertEqual(r.capacity, 100)
+        records = [(i, b"x" * (i % 150)) for i in range(3000)]
+
+        def produce():
+            with sercore.FileOutStream(w) as s:
+                for rec in records:
+                    s.write_tuple("ib", rec)
+
+        t = threading.Thread(target=produce)
+        t.start()
+        with sercore.FileInStream(r) as s:
+            for rec in records:
+                self.assertEqual(s.read_tuple("ib"), rec)
+            # producer closed: end of stream
+            self.assertRaises(IOError, s.read_vint)
+        t.join()
+
+    def test_consumer_closed(self):
+        w = sercore.ShmRing(self.fname, "w", 100)
+        sercore.ShmRing(self.fname).close()
+        with sercore.FileOutStream(w) as s:
+            # larger than the stdio buffer, goes straight to the ring
+            self.assertRaises(IOError, s.write, b"x" * (1 << 20))
+
+    def test_errors(self):
+        self.assertRaises(IOError, sercore.ShmRing, self.fname)
+        with io.open(self.fname, "wb") as f:
+            f.write(b"\x00" * 1000)
+        self.assertRaises(IOError, sercore.ShmRing, self.fname)
+        self.assertRaises(ValueError, sercore.ShmRing, self.fname, "x", 100)
+        w = sercore.ShmRing(self.fname, "w", 100)
+        r = sercore.ShmRing(self.fname, "r")
+        self.assertRaises(ValueError, sercore.FileInStream, w)
+        self.assertRaises(ValueError, sercore.FileOutStream, r)
+
+
 CASES = [
     TestFileInStream,
     TestFileOutStream,
     TestSerDe,
     TestCheckClosed,
     TestHadoopTypes,
+    TestMapItems,
+    TestReduceValues,
+    TestShmRing,
 ]
 
 